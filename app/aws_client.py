@@ -11,7 +11,7 @@ sqs_client = boto3.client(
     region_name=settings.AWS_REGION
 )
 
-def push_template_task(template_id: str, s3_key: str):
+def push_template_task(template_id: str, s3_key: str, content_hash: str = None):
     """
     Push template processing task to SQS
     """
@@ -19,6 +19,8 @@ def push_template_task(template_id: str, s3_key: str):
         "template_id": template_id,
         "s3_key": s3_key
     }
+    if content_hash:
+        message_body["content_hash"] = content_hash
     response = sqs_client.send_message(
         QueueUrl=settings.SQS_QUEUE_URL,
         MessageBody=json.dumps(message_body)
@@ -1,6 +1,13 @@
 # app/database/booking_queries.py
 
+import base64
+import json
+from datetime import datetime
+from typing import AsyncIterator, Optional, Tuple
+
+from app.core.config import settings
 from app.database import booking_collection
+from app.utils.export_stream import stream_ndjson
 from bson import ObjectId
 
 async def get_booking_summary(user_id: str):
@@ -34,3 +41,72 @@ async def get_recent_bookings(user_id: str, limit: int = 5):
     for booking in bookings:
         booking["id"] = str(booking["_id"])
     return bookings
+
+
+# -----------------------------
+# Keyset pagination / streaming
+# -----------------------------
+BOOKING_SORT = [("created_at", -1), ("_id", -1)]
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(doc: dict) -> str:
+    raw = json.dumps({"t": doc["created_at"].isoformat(), "id": str(doc["_id"])})
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, ObjectId]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(data["t"]), ObjectId(data["id"])
+    except Exception:
+        raise InvalidCursor("Malformed pagination cursor")
+
+
+def _after_cursor(query: dict, cursor: Optional[str]) -> dict:
+    if not cursor:
+        return query
+    created_at, last_id = decode_cursor(cursor)
+    # Strictly "older than" the last row of the previous page in (created_at, _id) order
+    return {
+        **query,
+        "$or": [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "_id": {"$lt": last_id}},
+        ],
+    }
+
+
+def booking_out(doc: dict) -> dict:
+    doc["id"] = str(doc.pop("_id"))
+    return doc
+
+
+def clamp_page_size(limit: Optional[int]) -> int:
+    if not limit:
+        return settings.BOOKING_PAGE_SIZE
+    return max(1, min(limit, settings.BOOKING_PAGE_SIZE_MAX))
+
+
+async def get_bookings_page(query: dict, cursor: Optional[str] = None, limit: Optional[int] = None):
+    """
+    Returns (bookings, next_cursor). next_cursor is None on the last page.
+    """
+    limit = clamp_page_size(limit)
+    docs = await booking_collection.find(_after_cursor(query, cursor)).sort(BOOKING_SORT).limit(limit + 1).to_list(length=limit + 1)
+    next_cursor = encode_cursor(docs[limit - 1]) if len(docs) > limit else None
+    return [booking_out(d) for d in docs[:limit]], next_cursor
+
+
+async def stream_bookings_ndjson(query: dict, cursor: Optional[str] = None) -> AsyncIterator[bytes]:
+    """
+    Yields NDJSON straight off the Motor cursor, one chunk per server batch
+    """
+    batch_size = settings.BOOKING_STREAM_BATCH_SIZE
+    mongo_cursor = booking_collection.find(_after_cursor(query, cursor)).sort(BOOKING_SORT).batch_size(batch_size)
+    async for chunk in stream_ndjson(mongo_cursor, batch_size, transform=booking_out):
+        yield chunk
@@ -0,0 +1,158 @@
+# app/build_log.py
+"""
+Build output handling for the worker.
+
+Command output is read line by line (see worker.run_with_timeout) and fed
+to a BuildLog, which keeps memory flat no matter how much a build prints:
+
+- a ring buffer of the last BUILD_LOG_TAIL_KB, used for error reports;
+- zlib-compressed chunks of about BUILD_LOG_CHUNK_KB, persisted to the
+  `build_log_chunks` collection and published on the template's log topic
+  for live tailing. At most one chunk write is in flight at a time, and
+  persistence stops (with a marker) after BUILD_LOG_MAX_PERSIST_MB.
+
+write()/close() are called from build threads and hand the async work to
+the worker's event loop. A ticker thread flushes buffered output every
+BUILD_LOG_FLUSH_SECONDS, so a build that goes quiet (a long bundler step)
+doesn't sit on unflushed output.
+"""
+import asyncio
+import logging
+import threading
+import time
+import zlib
+from collections import deque
+from datetime import datetime
+from typing import Optional
+
+from app.core.config import settings
+from app.services.pubsub import publish, template_log_topic
+
+logger = logging.getLogger("s8worker.build_log")
+
+TRUNCATED_MARKER = "\n[... log truncated: persisted size limit reached, see the tail for the end ...]\n"
+
+
+class LogRing:
+    """
+    Last `max_bytes` of text, kept as whole lines
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.lines = deque()
+        self.size = 0
+
+    def append(self, line: str):
+        self.lines.append(line)
+        self.size += len(line)
+        while self.size > self.max_bytes and len(self.lines) > 1:
+            self.size -= len(self.lines.popleft())
+
+    def text(self) -> str:
+        text = "".join(self.lines)
+        return text[-self.max_bytes:]
+
+
+class BuildLog:
+    def __init__(self, template_id: Optional[str] = None, collection=None, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.template_id = template_id
+        self.collection = collection
+        self.loop = loop
+        self.ring = LogRing(settings.BUILD_LOG_TAIL_KB * 1024)
+        self.seq = 0
+        self.persisted = 0
+        self.total = 0
+        self._buf = []
+        self._buf_size = 0
+        self._last_flush = time.monotonic()
+        self._pending = None  # concurrent.futures.Future of the chunk being stored
+        self._truncated = False
+        self._lock = threading.Lock()  # write() and the ticker both flush
+        self._closed = threading.Event()
+        if collection is not None:
+            threading.Thread(target=self._tick, name=f"build-log-{template_id}", daemon=True).start()
+
+    @classmethod
+    def detached(cls) -> "BuildLog":
+        """
+        Ring buffer only; nothing is persisted or published
+        """
+        return cls()
+
+    def write(self, line: str):
+        with self._lock:
+            self.ring.append(line)
+            self.total += len(line)
+            if self.collection is None or self._truncated:
+                return
+            self._buf.append(line)
+            self._buf_size += len(line)
+            if (
+                self._buf_size >= settings.BUILD_LOG_CHUNK_KB * 1024
+                or time.monotonic() - self._last_flush >= settings.BUILD_LOG_FLUSH_SECONDS
+            ):
+                self._flush()
+
+    def tail(self) -> str:
+        with self._lock:
+            return self.ring.text()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _tick(self):
+        while not self._closed.wait(settings.BUILD_LOG_FLUSH_SECONDS):
+            with self._lock:
+                if time.monotonic() - self._last_flush >= settings.BUILD_LOG_FLUSH_SECONDS:
+                    self._flush()
+
+    def _flush(self):
+        if not self._buf or self.collection is None:
+            return
+        text = "".join(self._buf)
+        self._buf, self._buf_size = [], 0
+        self._last_flush = time.monotonic()
+        if self.persisted + len(text) > settings.BUILD_LOG_MAX_PERSIST_MB * 1024 * 1024:
+            text, self._truncated = TRUNCATED_MARKER, True
+        self.persisted += len(text)
+
+        # Backpressure: never more than one chunk waiting on Mongo
+        self._wait_pending()
+        self._pending = asyncio.run_coroutine_threadsafe(self._store(self.seq, text), self.loop)
+        self.seq += 1
+
+    def close(self):
+        self._closed.set()
+        with self._lock:
+            self._flush()
+            self._wait_pending()
+
+    def _wait_pending(self):
+        if self._pending is not None:
+            try:
+                self._pending.result(timeout=30)
+            except Exception as e:
+                logger.warning(f"Build log chunk for {self.template_id} not stored: {e}")
+            self._pending = None
+
+    async def _store(self, seq: int, text: str):
+        await self.collection.insert_one({
+            "template_id": self.template_id,
+            "seq": seq,
+            "data": zlib.compress(text.encode("utf-8", errors="replace"), 6),
+            "size": len(text),
+            "created_at": datetime.utcnow(),
+        })
+        try:
+            await publish(
+                template_log_topic(self.template_id),
+                {"type": "template_log", "template_id": self.template_id, "seq": seq, "text": text},
+            )
+        except Exception as e:
+            logger.warning(f"Build log publish failed for {self.template_id}: {e}")
+
+
+def decode_chunk(doc: dict) -> str:
+    return zlib.decompress(doc["data"]).decode("utf-8", errors="replace")
@@ -0,0 +1,279 @@
+# app/build_metrics.py
+"""
+Build worker instrumentation.
+
+- BuildMetrics: per-job stage timings plus per-command resource usage,
+  stored on the template as `build_metrics`.
+- ProcessTreeSampler: peak RSS and CPU time of a command's whole process
+  tree (npm spawns node, which spawns more node), sampled with psutil.
+- A minimal Prometheus text-format registry and HTTP endpoint for
+  fleet-level queue lag, throughput and stage latency. Hand-rolled to keep
+  the worker free of extra dependencies.
+"""
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+
+import psutil
+
+
+# -----------------------------
+# Prometheus registry
+# -----------------------------
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name, self.help, self.label_names = name, help, labels
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1.0):
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+class Gauge:
+    """
+    Read at scrape time from a callback, so it can't go stale
+    """
+
+    def __init__(self, name: str, help: str, fn: Callable[[], float]):
+        self.name, self.help, self.fn = name, help, fn
+
+    def render(self) -> list:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {self.fn()}"]
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: tuple, labels: tuple = ()):
+        self.name, self.help, self.label_names = name, help, labels
+        self.buckets = tuple(sorted(buckets))
+        self.series = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        with self._lock:
+            series = self.series.setdefault(labels, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, series in sorted(self.series.items()):
+                for bound, count in zip(self.buckets, series):
+                    le = 'le="%s"' % bound
+                    lines.append(f"{self.name}_bucket{_labels(self.label_names, labels, le)} {count}")
+                le = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, labels, le)} {series[-1]}")
+                lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {series[-2]}")
+                lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {series[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception:
+                pass  # a broken gauge callback must not take the endpoint down
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+_STAGE_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 900, 1200, 1800, 3600)
+BUILDS = registry.register(Counter("s8_builds_total", "Finished template jobs by result", ("result",)))
+STAGE_SECONDS = registry.register(
+    Histogram("s8_build_stage_seconds", "Wall-clock time per build stage", _STAGE_BUCKETS, ("stage",))
+)
+BUILD_SECONDS = registry.register(
+    Histogram("s8_build_duration_seconds", "Wall-clock time per template job", _STAGE_BUCKETS, ("result",))
+)
+QUEUE_LAG = registry.register(
+    Histogram("s8_build_queue_lag_seconds", "Time from SQS send to receive by a worker",
+              (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600))
+)
+COMMAND_PEAK_RSS = registry.register(
+    Histogram("s8_build_command_peak_rss_bytes", "Peak RSS of a build command's process tree",
+              tuple(mb * 1024 * 1024 for mb in (128, 256, 512, 1024, 2048, 4096, 8192)), ("stage",))
+)
+CPU_SECONDS = registry.register(Counter("s8_build_cpu_seconds_total", "CPU time used by build commands", ("stage",)))
+BYTES_PUBLISHED = registry.register(Counter("s8_build_published_bytes_total", "Bytes uploaded to S3 by publishing"))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scrapes every few seconds would flood the worker log
+
+
+def start_metrics_server(port: int) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("0.0.0.0", port), _Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+# -----------------------------
+# Process tree sampling
+# -----------------------------
+class ProcessTreeSampler:
+    """
+    Samples a process and all its descendants every `interval` seconds on a
+    background thread. CPU time is the sum of the last value seen for each
+    pid, so very short-lived children can be under-counted.
+    """
+
+    def __init__(self, pid: int, interval: float):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = 0
+        self._cpu = {}  # (pid, create_time) -> user+system seconds
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"sampler-{pid}", daemon=True)
+
+    @property
+    def cpu_seconds(self) -> float:
+        return sum(self._cpu.values())
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _sample(self):
+        try:
+            root = psutil.Process(self.pid)
+            procs = [root] + root.children(recursive=True)
+        except psutil.Error:
+            return
+        rss = 0
+        for proc in procs:
+            try:
+                with proc.oneshot():
+                    rss += proc.memory_info().rss
+                    times = proc.cpu_times()
+                    self._cpu[(proc.pid, proc.create_time())] = times.user + times.system
+            except psutil.Error:
+                continue
+        self.peak_rss = max(self.peak_rss, rss)
+
+    def _run(self):
+        while True:
+            self._sample()
+            if self._stop.wait(self.interval):
+                return
+
+
+# -----------------------------
+# Per-job metrics
+# -----------------------------
+class BuildMetrics:
+    """
+    Stage timings come from the same transitions that are pushed to clients
+    (downloading, extracting, installing, building, ...): mark() closes the
+    running stage and opens the next one.
+    """
+
+    TERMINAL = ("done", "failed", "retrying")
+
+    def __init__(self, queue_lag: Optional[float] = None):
+        self.started = time.monotonic()
+        self.queue_lag = queue_lag
+        self.stages = {}
+        self.commands = []
+        self.extra = {}
+        self._current = None
+        self._current_started = None
+        self._lock = threading.Lock()
+        if queue_lag is not None:
+            QUEUE_LAG.observe(queue_lag)
+
+    @property
+    def current_stage(self) -> Optional[str]:
+        return self._current
+
+    def mark(self, stage: str):
+        now = time.monotonic()
+        with self._lock:
+            if self._current is not None:
+                elapsed = now - self._current_started
+                self.stages[self._current] = self.stages.get(self._current, 0.0) + elapsed
+                STAGE_SECONDS.observe(elapsed, self._current)
+            if stage in self.TERMINAL:
+                self._current = self._current_started = None
+            else:
+                self._current, self._current_started = stage, now
+
+    def add_command(self, cmd: list, seconds: float, peak_rss: int, cpu_seconds: float, exit_code: Optional[int]):
+        stage = self._current or "unknown"
+        self.commands.append({
+            "cmd": " ".join(cmd),
+            "stage": stage,
+            "seconds": round(seconds, 2),
+            "peak_rss_mb": round(peak_rss / 1024 / 1024, 1),
+            "cpu_seconds": round(cpu_seconds, 2),
+            "exit_code": exit_code,
+        })
+        COMMAND_PEAK_RSS.observe(peak_rss, stage)
+        CPU_SECONDS.inc(stage, amount=cpu_seconds)
+
+    def finish(self, result: str) -> dict:
+        self.mark("done")
+        total = time.monotonic() - self.started
+        BUILDS.inc(result)
+        BUILD_SECONDS.observe(total, result)
+        return self.to_doc(result, total)
+
+    def to_doc(self, result: str, total: float) -> dict:
+        return {
+            "result": result,
+            "worker": socket.gethostname(),
+            "queue_lag_seconds": round(self.queue_lag, 2) if self.queue_lag is not None else None,
+            "total_seconds": round(total, 2),
+            "stages": {name: round(sec, 2) for name, sec in self.stages.items()},
+            "peak_rss_mb": max((c["peak_rss_mb"] for c in self.commands), default=0),
+            "cpu_seconds": round(sum(c["cpu_seconds"] for c in self.commands), 2),
+            "commands": self.commands,
+            **self.extra,
+        }
@@ -0,0 +1,44 @@
+# app/build_plan.py
+"""
+Framework detection rules shared by the upload-time archive inspector and
+the build worker, so both agree on how a template will be built.
+"""
+from typing import Callable, Optional, Tuple
+
+LOCKFILES = ("package-lock.json", "npm-shrinkwrap.json")
+OUTPUT_GUESSES = ("dist", "build", "out")
+
+
+def detect_framework_from_package(pkg: Optional[dict], exists: Callable[[str], bool]) -> Tuple[str, Optional[str]]:
+    """
+    Returns (framework, guessed output dir). `exists(name)` tells whether a
+    top-level entry of the project exists.
+    """
+    if not pkg:
+        return "plain", None
+    deps = {**pkg.get("dependencies", {}), **pkg.get("devDependencies", {})}
+    if "next" in deps:
+        return "next", "out"
+    if "vite" in deps:
+        return "vite", "dist"
+    if "react" in deps:
+        return "cra", "build"
+    for guess in OUTPUT_GUESSES:
+        if exists(guess):
+            return "unknown", guess
+    return "plain", None
+
+
+def make_build_plan(pkg: Optional[dict], exists: Callable[[str], bool], root: str = "") -> dict:
+    framework, output_dir = detect_framework_from_package(pkg, exists)
+    scripts = (pkg or {}).get("scripts", {})
+    plan = {
+        "framework": framework,
+        "output_dir": output_dir,
+        "root": root,
+    }
+    if framework != "plain":
+        plan["install"] = "ci" if any(exists(lf) for lf in LOCKFILES) else "install"
+        plan["build_script"] = "build" in scripts
+        plan["export_script"] = "export" in scripts
+    return plan
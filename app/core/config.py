@@ -20,6 +20,16 @@ class Settings:
     SMTP_PORT: int = int(os.getenv("SMTP_PORT", "587"))
     SMTP_USER: str = os.getenv("SMTP_USER")
     SMTP_PASSWORD: str = os.getenv("SMTP_PASSWORD")
+    SMTP_USE_SSL: bool = os.getenv("SMTP_USE_SSL", "true").lower() == "true"
+    SMTP_TIMEOUT_SECONDS: float = float(os.getenv("SMTP_TIMEOUT_SECONDS", "30"))
+
+    # Outbound mail queue
+    MAIL_QUEUE_MAXSIZE: int = int(os.getenv("MAIL_QUEUE_MAXSIZE", "10000"))
+    MAIL_BATCH_SIZE: int = int(os.getenv("MAIL_BATCH_SIZE", "20"))
+    MAIL_MAX_ATTEMPTS: int = int(os.getenv("MAIL_MAX_ATTEMPTS", "5"))
+    MAIL_RETRY_BASE_SECONDS: float = float(os.getenv("MAIL_RETRY_BASE_SECONDS", "2"))
+    MAIL_IDLE_CLOSE_SECONDS: float = float(os.getenv("MAIL_IDLE_CLOSE_SECONDS", "300"))
+    MAIL_PROBE_IDLE_SECONDS: float = float(os.getenv("MAIL_PROBE_IDLE_SECONDS", "30"))
     
     # Admin credentials
     ADMIN_EMAIL: str = os.getenv("ADMIN_EMAIL")
@@ -31,6 +41,110 @@ class Settings:
     AWS_REGION: str = os.getenv("AWS_REGION", "eu-north-1")
     BUCKET_NAME: str = os.getenv("BUCKET_NAME", "s8templates")
     SQS_QUEUE_URL: str = os.getenv("SQS_QUEUE_URL")
+    SQS_DLQ_URL: str = os.getenv("SQS_DLQ_URL")  # permanently failed build messages
+    SQS_VISIBILITY_TIMEOUT_SECONDS: int = int(os.getenv("SQS_VISIBILITY_TIMEOUT_SECONDS", "300"))
+    SQS_LEASE_HEARTBEAT_SECONDS: int = int(os.getenv("SQS_LEASE_HEARTBEAT_SECONDS", "60"))
+    SQS_MAX_RECEIVE_COUNT: int = int(os.getenv("SQS_MAX_RECEIVE_COUNT", "5"))
+    SQS_RETRY_BASE_SECONDS: int = int(os.getenv("SQS_RETRY_BASE_SECONDS", "30"))
+
+    # Streaming S3 uploads from the API
+    S3_UPLOAD_PART_SIZE_MB: int = int(os.getenv("S3_UPLOAD_PART_SIZE_MB", "8"))
+    S3_UPLOAD_MAX_INFLIGHT_PARTS: int = int(os.getenv("S3_UPLOAD_MAX_INFLIGHT_PARTS", "4"))
+    S3_UPLOAD_THREADS: int = int(os.getenv("S3_UPLOAD_THREADS", "16"))
+    TEMPLATE_UPLOAD_CONCURRENCY: int = int(os.getenv("TEMPLATE_UPLOAD_CONCURRENCY", "4"))
+
+    # Direct-to-S3 (presigned) template uploads
+    TEMPLATE_UPLOAD_SESSION_MINUTES: int = int(os.getenv("TEMPLATE_UPLOAD_SESSION_MINUTES", "60"))
+    TEMPLATE_MAX_ZIP_BYTES: int = int(os.getenv("TEMPLATE_MAX_ZIP_BYTES", str(1024 * 1024 * 1024)))
+    TEMPLATE_MAX_IMAGE_BYTES: int = int(os.getenv("TEMPLATE_MAX_IMAGE_BYTES", str(20 * 1024 * 1024)))
+    TEMPLATE_MAX_IMAGES: int = int(os.getenv("TEMPLATE_MAX_IMAGES", "20"))
+
+    # Upload-time archive inspection
+    TEMPLATE_MAX_UNCOMPRESSED_BYTES: int = int(os.getenv("TEMPLATE_MAX_UNCOMPRESSED_BYTES", str(2 * 1024 * 1024 * 1024)))
+    TEMPLATE_MAX_ENTRIES: int = int(os.getenv("TEMPLATE_MAX_ENTRIES", "50000"))
+    TEMPLATE_MAX_COMPRESSION_RATIO: int = int(os.getenv("TEMPLATE_MAX_COMPRESSION_RATIO", "100"))
+
+    # Build worker. Bump BUILDER_VERSION whenever the build pipeline changes
+    # output, so cached artifacts from the old pipeline stop matching.
+    BUILDER_VERSION: str = os.getenv("BUILDER_VERSION", "1")
+    BUILD_ARTIFACT_CACHE: bool = os.getenv("BUILD_ARTIFACT_CACHE", "true").lower() == "true"
+    WORKER_MAX_BUILDS: int = int(os.getenv("WORKER_MAX_BUILDS", "0"))  # 0 = derive from CPU/RAM
+    BUILD_CPUS_PER_JOB: float = float(os.getenv("BUILD_CPUS_PER_JOB", "2"))
+    BUILD_MEM_PER_JOB_MB: int = int(os.getenv("BUILD_MEM_PER_JOB_MB", "2048"))
+    BUILD_MIN_FREE_MEM_MB: int = int(os.getenv("BUILD_MIN_FREE_MEM_MB", "1024"))
+    BUILD_MAX_CPU_PERCENT: float = float(os.getenv("BUILD_MAX_CPU_PERCENT", "85"))
+    BUILD_ADMISSION_POLL_SECONDS: float = float(os.getenv("BUILD_ADMISSION_POLL_SECONDS", "2"))
+    WORKER_UPLOAD_CONCURRENCY: int = int(os.getenv("WORKER_UPLOAD_CONCURRENCY", "4"))
+    WORKER_SHUTDOWN_GRACE_SECONDS: float = float(os.getenv("WORKER_SHUTDOWN_GRACE_SECONDS", "0"))
+    WORKER_METRICS_PORT: int = int(os.getenv("WORKER_METRICS_PORT", "9108"))  # 0 = disabled
+    BUILD_SCRIPT_PERMANENT_AFTER: int = int(os.getenv("BUILD_SCRIPT_PERMANENT_AFTER", "2"))  # same failure, N deliveries
+    BUILD_SAMPLE_SECONDS: float = float(os.getenv("BUILD_SAMPLE_SECONDS", "1"))
+
+    # Build output: in-memory tail for errors, compressed chunks in Mongo for the live log
+    BUILD_LOG_TAIL_KB: int = int(os.getenv("BUILD_LOG_TAIL_KB", "64"))
+    BUILD_LOG_CHUNK_KB: int = int(os.getenv("BUILD_LOG_CHUNK_KB", "64"))
+    BUILD_LOG_FLUSH_SECONDS: float = float(os.getenv("BUILD_LOG_FLUSH_SECONDS", "2"))
+    BUILD_LOG_MAX_PERSIST_MB: int = int(os.getenv("BUILD_LOG_MAX_PERSIST_MB", "20"))
+    BUILD_LOG_TTL_DAYS: int = int(os.getenv("BUILD_LOG_TTL_DAYS", "14"))
+
+    # Build worker dependency cache (shared npm cache + node_modules snapshots)
+    NPM_CACHE_ENABLED: bool = os.getenv("NPM_CACHE_ENABLED", "true").lower() == "true"
+    NPM_CACHE_DIR: str = os.getenv("NPM_CACHE_DIR", "/home/ec2-user/s8Backend/cache")
+    NPM_CACHE_MAX_GB: float = float(os.getenv("NPM_CACHE_MAX_GB", "20"))  # node_modules snapshots
+    NPM_CONTENT_CACHE_MAX_GB: float = float(os.getenv("NPM_CONTENT_CACHE_MAX_GB", "10"))  # npm's tarball cache
+
+    # Publishing build output to S3
+    S3_PUBLISH_THREADS: int = int(os.getenv("S3_PUBLISH_THREADS", "32"))
+    S3_PUBLISH_GZIP: bool = os.getenv("S3_PUBLISH_GZIP", "true").lower() == "true"
+
+    # Auth principal cache (per process)
+    PRINCIPAL_CACHE_SIZE: int = int(os.getenv("PRINCIPAL_CACHE_SIZE", "1024"))
+    PRINCIPAL_CACHE_TTL_SECONDS: float = float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "60"))
+    # TTL cap when invalidations can't be broadcast (WS_PUBSUB_BACKEND=local)
+    PRINCIPAL_CACHE_LOCAL_TTL_SECONDS: float = float(os.getenv("PRINCIPAL_CACHE_LOCAL_TTL_SECONDS", "5"))
+
+    # Indexes: explain every registered hot query at startup and refuse to boot on COLLSCAN
+    INDEX_VERIFY_ON_STARTUP: bool = os.getenv("INDEX_VERIFY_ON_STARTUP", "false").lower() == "true"
+
+    # Booking listings
+    BOOKING_PAGE_SIZE: int = int(os.getenv("BOOKING_PAGE_SIZE", "50"))
+    BOOKING_PAGE_SIZE_MAX: int = int(os.getenv("BOOKING_PAGE_SIZE_MAX", "500"))
+    BOOKING_STREAM_BATCH_SIZE: int = int(os.getenv("BOOKING_STREAM_BATCH_SIZE", "500"))
+    BOOKING_BULK_MAX_ITEMS: int = int(os.getenv("BOOKING_BULK_MAX_ITEMS", "1000"))
+
+    # Booking slots / availability
+    BOOKING_SLOT_MINUTES: int = int(os.getenv("BOOKING_SLOT_MINUTES", "30"))
+    BOOKING_DEFAULT_RESOURCE: str = os.getenv("BOOKING_DEFAULT_RESOURCE", "default")
+    BOOKING_SLOT_REFRESH_SECONDS: float = float(os.getenv("BOOKING_SLOT_REFRESH_SECONDS", "60"))
+    BOOKING_AVAILABILITY_MAX_DAYS: int = int(os.getenv("BOOKING_AVAILABILITY_MAX_DAYS", "62"))
+
+    # Admin exports
+    EXPORT_BATCH_SIZE: int = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+    EXPORT_BATCH_SIZE_MAX: int = int(os.getenv("EXPORT_BATCH_SIZE_MAX", "10000"))
+
+    # WebSocket fan-out
+    WS_QUEUE_MAXSIZE: int = int(os.getenv("WS_QUEUE_MAXSIZE", "256"))
+    WS_SEND_TIMEOUT_SECONDS: float = float(os.getenv("WS_SEND_TIMEOUT_SECONDS", "10"))
+    WS_SLOW_CONSUMER_POLICY: str = os.getenv("WS_SLOW_CONSUMER_POLICY", "drop")  # "drop" | "disconnect"
+    WS_HEARTBEAT_INTERVAL_SECONDS: float = float(os.getenv("WS_HEARTBEAT_INTERVAL_SECONDS", "20"))
+    WS_IDLE_TIMEOUT_SECONDS: float = float(os.getenv("WS_IDLE_TIMEOUT_SECONDS", "60"))
+    WS_BATCH_WINDOW_MS: float = float(os.getenv("WS_BATCH_WINDOW_MS", "25"))
+    WS_BATCH_MAX_EVENTS: int = int(os.getenv("WS_BATCH_MAX_EVENTS", "100"))
+    WS_PER_MESSAGE_DEFLATE: bool = os.getenv("WS_PER_MESSAGE_DEFLATE", "true").lower() == "true"
+    SSE_KEEPALIVE_SECONDS: float = float(os.getenv("SSE_KEEPALIVE_SECONDS", "15"))
+    WS_PUBSUB_BACKEND: str = os.getenv("WS_PUBSUB_BACKEND", "local")  # "local" | "mongo"
+    WS_PUBSUB_COLLECTION: str = os.getenv("WS_PUBSUB_COLLECTION", "ws_events")
+    WS_PUBSUB_CAPPED_BYTES: int = int(os.getenv("WS_PUBSUB_CAPPED_BYTES", str(16 * 1024 * 1024)))
+
+    # Password reset / email verification tokens
+    RESET_TOKEN_TTL_MINUTES: int = int(os.getenv("RESET_TOKEN_TTL_MINUTES", "60"))
+    VERIFICATION_TOKEN_TTL_DAYS: int = int(os.getenv("VERIFICATION_TOKEN_TTL_DAYS", "7"))
+    TOKEN_FRONT_CACHE_SIZE: int = int(os.getenv("TOKEN_FRONT_CACHE_SIZE", "4096"))
+    TOKEN_FRONT_CACHE_TTL_SECONDS: float = float(os.getenv("TOKEN_FRONT_CACHE_TTL_SECONDS", "3600"))
+
+    # Password hashing pool (0 = derive from CPU count)
+    HASH_POOL_WORKERS: int = int(os.getenv("HASH_POOL_WORKERS", "0"))
+    HASH_POOL_MAX_PENDING: int = int(os.getenv("HASH_POOL_MAX_PENDING", "0"))
 
 # Instantiate settings
 settings = Settings()
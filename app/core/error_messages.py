@@ -29,3 +29,8 @@ class ErrorResponses:
         status_code=500,
         detail="Something went wrong on our end."
     )
+    AUTH_BUSY = HTTPException(
+        status_code=503,
+        detail="Authentication service is busy. Please retry shortly.",
+        headers={"Retry-After": "1"}
+    )
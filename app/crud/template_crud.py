@@ -22,7 +22,7 @@ async def update_template(template_id: str, update_data: dict):
     )
     return result.modified_count
 
-# Get all templates
+# Get all templates (capped; use GET /api/exports/templates for full dumps)
 async def get_all_templates(limit=100):
     templates = await template_collection.find().to_list(limit)
     return templates
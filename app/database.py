@@ -19,4 +19,11 @@ user_collection = db["users"]
 
 booking_collection = db["bookings"]
 
-template_collection = db["templates"]
\ No newline at end of file
+template_collection = db["templates"]
+
+mail_delivery_collection = db["mail_deliveries"]
+
+auth_token_collection = db["auth_tokens"]
+
+upload_session_collection = db["upload_sessions"]
+build_log_collection = db["build_log_chunks"]
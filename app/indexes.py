@@ -0,0 +1,204 @@
+# app/indexes.py
+"""
+Index registry.
+
+Every index the app relies on is declared here and applied idempotently at
+startup by main.py and worker.py. HOT_QUERIES lists the queries those
+indexes exist for; `verify_query_plans` explains each one and reports any
+that fall back to a collection scan.
+
+    python -m app.indexes            # apply indexes
+    python -m app.indexes --verify   # apply, then fail on any COLLSCAN
+"""
+import asyncio
+import logging
+import sys
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import List, Optional
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+from app.core.config import settings
+
+logger = logging.getLogger("s8indexes")
+
+
+# -----------------------------
+# Index declarations
+# -----------------------------
+INDEXES = {
+    "users": [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+    ],
+    "bookings": [
+        IndexModel([("userid", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)], name="userid_created_at"),
+        IndexModel([("userid", ASCENDING), ("date", DESCENDING)], name="userid_date"),
+        IndexModel([("created_at", DESCENDING), ("_id", DESCENDING)], name="created_at"),
+        # Slot index warm load: active bookings from the horizon onwards
+        IndexModel([("status", ASCENDING), ("date", ASCENDING)], name="status_date"),
+        # Race guard for the in-memory slot index: one active booking per grid slot
+        IndexModel(
+            [("resource", ASCENDING), ("slot_start", ASCENDING)],
+            name="slot_unique",
+            unique=True,
+            partialFilterExpression={"slot_held": True, "slot_start": {"$exists": True}},
+        ),
+    ],
+    "templates": [
+        IndexModel([("uploaded_by", ASCENDING), ("created_at", DESCENDING)], name="uploaded_by_created_at"),
+        IndexModel(
+            [("status", ASCENDING), ("created_at", ASCENDING)],
+            name="status_pending",
+            partialFilterExpression={"status": "pending"},
+        ),
+        IndexModel([("created_at", ASCENDING)], name="created_at"),
+        # Worker recovery: build claims whose lease has lapsed
+        IndexModel(
+            [("status", ASCENDING), ("build_lease_until", ASCENDING)],
+            name="status_processing_lease",
+            partialFilterExpression={"status": "processing"},
+        ),
+    ],
+    "build_artifacts": [
+        IndexModel(
+            [("content_hash", ASCENDING), ("builder_version", ASCENDING)],
+            name="content_hash_builder_unique",
+            unique=True,
+        ),
+    ],
+    "build_log_chunks": [
+        IndexModel([("template_id", ASCENDING), ("seq", ASCENDING)], name="template_seq"),
+        IndexModel(
+            [("created_at", ASCENDING)],
+            name="created_at_ttl",
+            expireAfterSeconds=settings.BUILD_LOG_TTL_DAYS * 86400,
+        ),
+    ],
+    "upload_sessions": [
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    # Default (key-derived) names: these were first created by the token store
+    # under those names, and re-declaring them under new ones would conflict
+    "auth_tokens": [
+        IndexModel([("token_hash", ASCENDING)], name="token_hash_1", unique=True),
+        # TTL monitor removes tokens once expires_at has passed
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_1", expireAfterSeconds=0),
+        IndexModel([("purpose", ASCENDING), ("email", ASCENDING)], name="purpose_1_email_1"),
+    ],
+}
+
+
+# -----------------------------
+# Hot queries (explain targets)
+# -----------------------------
+@dataclass
+class HotQuery:
+    name: str
+    collection: str
+    filter: dict
+    sort: Optional[List[tuple]] = None
+    projection: Optional[dict] = field(default=None)
+
+
+_SAMPLE_ID = ObjectId("000000000000000000000000")
+_SAMPLE_DATE = datetime(2024, 1, 1)
+# Same shape as booking_queries._after_cursor builds for page 2+
+_KEYSET_AFTER = {
+    "$or": [
+        {"created_at": {"$lt": _SAMPLE_DATE}},
+        {"created_at": _SAMPLE_DATE, "_id": {"$lt": _SAMPLE_ID}},
+    ],
+}
+
+HOT_QUERIES = [
+    HotQuery("users by email", "users", {"email": "explain@example.com"}),
+    HotQuery("bookings by user, newest first", "bookings", {"userid": str(_SAMPLE_ID)}, [("created_at", -1), ("_id", -1)]),
+    HotQuery("bookings by user, by date", "bookings", {"userid": str(_SAMPLE_ID)}, [("date", -1)]),
+    HotQuery("all bookings, newest first", "bookings", {}, [("created_at", -1), ("_id", -1)]),
+    HotQuery("bookings by user, next page", "bookings", {"userid": str(_SAMPLE_ID), **_KEYSET_AFTER}, [("created_at", -1), ("_id", -1)]),
+    HotQuery("all bookings, next page", "bookings", dict(_KEYSET_AFTER), [("created_at", -1), ("_id", -1)]),
+    HotQuery("templates by uploader", "templates", {"uploaded_by": str(_SAMPLE_ID)}, [("created_at", -1)]),
+    HotQuery("pending templates", "templates", {"status": "pending"}),
+    HotQuery("expired build claims", "templates", {"status": "processing", "build_lease_until": {"$lt": _SAMPLE_DATE}}, [("build_lease_until", 1)]),
+    HotQuery("template export by date", "templates", {"created_at": {"$gte": _SAMPLE_DATE}}, [("created_at", 1)]),
+    HotQuery("upcoming active bookings", "bookings", {"status": {"$in": ["pending", "approved"]}, "date": {"$gte": _SAMPLE_DATE}}),
+    HotQuery("booking export by date", "bookings", {"created_at": {"$gte": _SAMPLE_DATE}}, [("created_at", 1)]),
+    HotQuery("build log by template", "build_log_chunks", {"template_id": str(_SAMPLE_ID)}, [("seq", 1)]),
+    HotQuery("build artifact by hash", "build_artifacts", {"content_hash": "0" * 64, "builder_version": "1"}),
+    HotQuery("token by hash", "auth_tokens", {"token_hash": "0" * 64, "purpose": "password_reset"}),
+]
+
+
+# -----------------------------
+# Apply / verify
+# -----------------------------
+async def apply_indexes(db) -> List[str]:
+    """
+    Creates every registered index. Safe to call on every start; failures
+    (e.g. duplicate emails blocking the unique index) are logged and returned
+    rather than raised so one bad index never blocks boot.
+    """
+    failures = []
+    for collection_name, models in INDEXES.items():
+        collection = db[collection_name]
+        for model in models:
+            name = model.document["name"]
+            try:
+                await collection.create_indexes([model])
+            except OperationFailure as e:
+                logger.error(f"Index {collection_name}.{name} not applied: {e}")
+                failures.append(f"{collection_name}.{name}")
+    return failures
+
+
+def _plan_stages(plan) -> List[str]:
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(_plan_stages(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            stages.extend(_plan_stages(item))
+    return stages
+
+
+async def verify_query_plans(db) -> List[str]:
+    """
+    Explains every hot query and returns the names of those whose winning
+    plan contains a COLLSCAN.
+    """
+    offenders = []
+    for query in HOT_QUERIES:
+        cursor = db[query.collection].find(query.filter, query.projection)
+        if query.sort:
+            cursor = cursor.sort(query.sort)
+        explain = await cursor.explain()
+        winning = explain.get("queryPlanner", {}).get("winningPlan", {})
+        stages = _plan_stages(winning)
+        if "COLLSCAN" in stages:
+            logger.error(f"COLLSCAN: {query.name} ({query.collection} {query.filter})")
+            offenders.append(query.name)
+        else:
+            logger.info(f"OK: {query.name} -> {' > '.join(stages)}")
+    return offenders
+
+
+async def _main(verify: bool) -> int:
+    from app.database import db
+
+    failures = await apply_indexes(db)
+    if failures:
+        return 1
+    if verify and await verify_query_plans(db):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    sys.exit(asyncio.run(_main("--verify" in sys.argv[1:])))
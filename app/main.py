@@ -4,6 +4,8 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exceptions import RequestValidationError
 from starlette.exceptions import HTTPException as StarletteHTTPException
+from pymongo.errors import PyMongoError
+import asyncio
 import logging
 
 from app.routes.auth import auth_router
@@ -11,7 +13,15 @@ from app.routes.templates import template_router
 from app.routes.bookings import booking_router
 from app.routes.dashboard import dashboard_router
 from app.routes.ws import ws_router
-from app.database import user_collection
+from app.routes.exports import export_router
+from app.database import db, user_collection
+from app.indexes import apply_indexes, verify_query_plans
+from app.core.config import settings
+from app.utils.hash_utils import shutdown_hash_pool
+from app.utils.mail_queue import mail_queue
+from app.utils.principal_cache import listen_for_invalidations
+from app.services import pubsub
+from app.services.slot_index import warm_load as warm_slot_index, refresh_forever as refresh_slot_index
 
 from app.core.error_handlers import (
     http_exception_handler,
@@ -28,6 +38,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Keyset pagination cursor and upload timings; the SPA can't read response headers that aren't listed here
+    expose_headers=["X-Next-Cursor", "Server-Timing"],
 )
 
 # ✅ Register routes
@@ -36,6 +48,7 @@ app.include_router(booking_router, prefix="/api/bookings")
 app.include_router(ws_router, prefix="/api/ws")
 app.include_router(template_router, prefix="/api/templates")
 app.include_router(dashboard_router, prefix="/api/dashboard")
+app.include_router(export_router, prefix="/api/exports")
 # ✅ Register global exception handlers
 app.add_exception_handler(StarletteHTTPException, http_exception_handler)
 app.add_exception_handler(RequestValidationError, validation_exception_handler)
@@ -53,3 +66,37 @@ async def startup_db_check():
         logging.info("✅ MongoDB connected successfully.")
     except Exception as e:
         logging.error("❌ MongoDB connection failed: %s", e)
+
+@app.on_event("startup")
+async def startup_indexes():
+    try:
+        await apply_indexes(db)
+        offenders = await verify_query_plans(db) if settings.INDEX_VERIFY_ON_STARTUP else []
+    except PyMongoError as e:
+        # Mongo unreachable at boot: keep serving, as startup_db_check does
+        logging.error("❌ Index setup failed: %s", e)
+        return
+    if offenders:
+        raise RuntimeError(f"Hot queries without index support: {offenders}")
+
+@app.on_event("startup")
+async def start_background_workers():
+    mail_queue.start()
+    listen_for_invalidations()
+    try:
+        await mail_queue.recover()
+    except Exception as e:
+        logging.error("❌ Mail recovery failed: %s", e)
+    await pubsub.backend.start()
+    try:
+        await warm_slot_index()
+    except Exception as e:
+        logging.error("❌ Slot index warm-load failed: %s", e)
+    app.state.slot_refresh = asyncio.create_task(refresh_slot_index())
+
+@app.on_event("shutdown")
+async def shutdown_workers():
+    app.state.slot_refresh.cancel()
+    await pubsub.backend.stop()
+    await mail_queue.stop()
+    shutdown_hash_pool()
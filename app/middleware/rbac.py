@@ -2,6 +2,7 @@
 from fastapi import HTTPException, Depends
 from fastapi.security import OAuth2PasswordBearer
 from app.utils.auth_utils import decode_token
+from app.utils.principal_cache import principal_cache, token_fingerprint
 from app.database import user_collection
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
@@ -12,17 +13,23 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         email = payload.get("email")
         if not email:
             raise HTTPException(status_code=401, detail="Invalid token")
-        
+
+        fingerprint = token_fingerprint(token)
+        user = principal_cache.get(email, fingerprint)
+        if user:
+            return user
+
         user = await user_collection.find_one({"email": email})
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
-        
+
+        principal_cache.set(email, fingerprint, user)
         return user
     except Exception as e:
         print(f"Token decode error or DB fetch failed: {e}")
         raise HTTPException(status_code=401, detail="Invalid token")
-    
-    
+
+
 def is_admin(user: dict = Depends(get_current_user)):
     if user["role"] != "admin":
         raise HTTPException(status_code=403, detail="Admin access only")
@@ -13,6 +13,10 @@ class Template(BaseModel):
     images: List[str] = []
     tags: List[str] = []
     preview_url: Optional[str] = None
+    preview_prefix: Optional[str] = None  # S3 prefix of the built site; may be shared by identical uploads
+    content_hash: Optional[str] = None    # SHA-256 of the uploaded ZIP
+    build_plan: Optional[dict] = None     # framework/output/install detected at upload time
+    build_metrics: Optional[dict] = None  # stage timings and resource usage of the last build
     status: str = "pending"
     is_public: bool = False   # <-- NEW FIELD
     created_at: datetime = Field(default_factory=datetime.utcnow)
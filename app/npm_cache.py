@@ -0,0 +1,282 @@
+# app/npm_cache.py
+"""
+Persistent dependency cache for the build worker.
+
+- A shared npm cache directory (npm_config_cache) so tarballs are fetched
+  once per host instead of once per build. It is dropped wholesale, while
+  no install is using it, once it outgrows its own cap.
+- node_modules snapshots keyed by sha256(lockfile + Node version + arch).
+  Projects whose root package.json has install lifecycle scripts aren't
+  snapshotted: a restore skips `npm ci`, so those scripts (and whatever
+  they write outside node_modules) would never run. A hit restores the snapshot with reflinks (copy-on-write filesystems) or
+  hardlinks and skips `npm ci` entirely. Snapshot files are made read-only
+  so a build that writes through a hardlink fails loudly instead of
+  corrupting the snapshot for everyone else.
+- Snapshots are evicted least-recently-used once they exceed the size cap.
+"""
+import hashlib
+import json
+import logging
+import os
+import platform
+import shutil
+import stat
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Optional
+
+from app.build_plan import LOCKFILES
+from app.core.config import settings
+
+logger = logging.getLogger("s8worker.npm_cache")
+
+META_FILE = ".s8snapshot.json"
+
+# Root package.json scripts that `npm ci` runs itself
+INSTALL_SCRIPTS = ("preinstall", "install", "postinstall", "prepublish", "preprepare", "prepare", "postprepare")
+
+NPM_DIR_CHECK_SECONDS = 600  # walking the content cache is slow; size it at most this often
+
+
+@lru_cache(maxsize=1)
+def node_version() -> str:
+    try:
+        return subprocess.run(["node", "--version"], capture_output=True, text=True, timeout=30).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def _tree_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for f in files:
+            try:
+                total += os.lstat(os.path.join(root, f)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def _install_scripts(project_dir: str) -> list:
+    try:
+        with open(os.path.join(project_dir, "package.json"), "r", encoding="utf-8") as f:
+            scripts = json.load(f).get("scripts") or {}
+    except (OSError, ValueError, AttributeError):
+        return []
+    return [name for name in INSTALL_SCRIPTS if name in scripts]
+
+
+def _make_read_only(path: str):
+    mask = ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)
+    for root, _, files in os.walk(path):
+        for f in files:
+            full = os.path.join(root, f)
+            if not os.path.islink(full):
+                os.chmod(full, os.lstat(full).st_mode & mask)
+
+
+class NpmCache:
+    def __init__(self, root: str, max_bytes: int, npm_max_bytes: int):
+        self.root = root
+        self.npm_dir = os.path.join(root, "npm")
+        self.snapshot_dir = os.path.join(root, "node_modules")
+        self.max_bytes = max_bytes
+        self.npm_max_bytes = npm_max_bytes
+        self._lock = threading.Lock()
+        self._in_use = {}  # key -> active restores, never evicted meanwhile
+        self._installs = 0  # npm runs using npm_dir right now
+        self._npm_checked = 0.0
+        self._reflink = True  # flips to False after the first failed reflink copy
+        self.hits = 0
+        self.misses = 0
+        self.seconds_saved = 0.0
+        os.makedirs(self.npm_dir, exist_ok=True)
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+
+    # -------- keys / env --------
+    def env(self, env: dict) -> dict:
+        env["npm_config_cache"] = self.npm_dir
+        env["npm_config_prefer_offline"] = "true"
+        return env
+
+    def key(self, project_dir: str) -> Optional[str]:
+        scripts = _install_scripts(project_dir)
+        if scripts:
+            logger.info(f"Not snapshotting node_modules: package.json has install scripts {scripts}")
+            return None
+        for name in LOCKFILES:
+            path = os.path.join(project_dir, name)
+            if os.path.exists(path):
+                digest = hashlib.sha256()
+                with open(path, "rb") as f:
+                    digest.update(f.read())
+                digest.update(f"\0{node_version()}\0{platform.machine()}".encode())
+                return digest.hexdigest()
+        return None  # no lockfile: installs aren't reproducible, so nothing to key on
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.snapshot_dir, key)
+
+    def hit_rate(self) -> str:
+        total = self.hits + self.misses
+        return f"{self.hits}/{total} ({self.hits / total:.0%})" if total else "n/a"
+
+    # -------- restore / save --------
+    def _copy_tree(self, src: str, dst: str):
+        if self._reflink:
+            try:
+                subprocess.run(["cp", "-a", "--reflink=always", src, dst], check=True, capture_output=True)
+                return
+            except subprocess.CalledProcessError:
+                shutil.rmtree(dst, ignore_errors=True)
+                self._reflink = False
+                logger.info("Filesystem has no reflink support; falling back to hardlinks")
+        subprocess.run(["cp", "-al", src, dst], check=True, capture_output=True)
+
+    def restore(self, key: str, project_dir: str) -> bool:
+        snapshot = self._path(key)
+        with self._lock:
+            if not os.path.isdir(snapshot):
+                self.misses += 1
+                return False
+            self._in_use[key] = self._in_use.get(key, 0) + 1
+        started = time.monotonic()
+        try:
+            dst = os.path.join(project_dir, "node_modules")
+            shutil.rmtree(dst, ignore_errors=True)
+            self._copy_tree(os.path.join(snapshot, "node_modules"), dst)
+            os.utime(snapshot)  # LRU clock
+            meta = self._read_meta(key)
+        except Exception as e:
+            logger.warning(f"node_modules restore failed for {key[:12]}, installing instead: {e}")
+            shutil.rmtree(os.path.join(project_dir, "node_modules"), ignore_errors=True)
+            with self._lock:
+                self.misses += 1
+            return False
+        finally:
+            with self._lock:
+                self._in_use[key] -= 1
+                if not self._in_use[key]:
+                    del self._in_use[key]
+
+        elapsed = time.monotonic() - started
+        saved = max(0.0, meta.get("install_seconds", 0.0) - elapsed)
+        with self._lock:
+            self.hits += 1
+            self.seconds_saved += saved
+        logger.info(
+            f"npm cache HIT {key[:12]}: restored in {elapsed:.1f}s, saved ~{saved:.0f}s "
+            f"(hit rate {self.hit_rate()}, {self.seconds_saved / 60:.1f} min saved total)"
+        )
+        return True
+
+    def save(self, key: str, project_dir: str, install_seconds: float):
+        src = os.path.join(project_dir, "node_modules")
+        if not os.path.isdir(src) or os.path.isdir(self._path(key)):
+            return
+        tmp = os.path.join(self.snapshot_dir, f".tmp-{key}-{threading.get_ident()}")
+        try:
+            os.makedirs(tmp)
+            self._copy_tree(src, os.path.join(tmp, "node_modules"))
+            _make_read_only(os.path.join(tmp, "node_modules"))
+            size = _tree_size(tmp)
+            with open(os.path.join(tmp, META_FILE), "w") as f:
+                json.dump({"size": size, "install_seconds": install_seconds, "created_at": time.time()}, f)
+            try:
+                os.rename(tmp, self._path(key))  # atomic publish
+            except OSError:
+                return  # a concurrent build saved the same key first
+            logger.info(
+                f"npm cache MISS {key[:12]}: install took {install_seconds:.0f}s, "
+                f"snapshot saved ({size / 1024 / 1024:.0f} MB, hit rate {self.hit_rate()})"
+            )
+        except Exception as e:
+            logger.warning(f"Failed to snapshot node_modules for {key[:12]}: {e}")
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.evict()
+
+    def _read_meta(self, key: str) -> dict:
+        try:
+            with open(os.path.join(self._path(key), META_FILE)) as f:
+                return json.load(f)
+        except Exception:
+            return {}
+
+    # -------- eviction --------
+    @contextmanager
+    def installing(self):
+        """
+        Wraps an npm run that reads or fills npm_dir, so the content cache is
+        never dropped from under it
+        """
+        with self._lock:
+            self._installs += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._installs -= 1
+            self.prune_npm_dir()
+
+    def prune_npm_dir(self):
+        """
+        Caps the shared npm content cache. npm's cacache never records reads,
+        so there is no LRU order to evict by: once over the cap the whole
+        cache is dropped while no install is running, and refills on demand.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._installs or now - self._npm_checked < NPM_DIR_CHECK_SECONDS:
+                return
+            self._npm_checked = now
+        size = _tree_size(self.npm_dir)
+        if size <= self.npm_max_bytes:
+            return
+        doomed = os.path.join(self.root, f".npm-evict-{threading.get_ident()}")
+        with self._lock:
+            if self._installs:
+                return  # an install started while we were measuring; next time
+            os.rename(self.npm_dir, doomed)
+            os.makedirs(self.npm_dir, exist_ok=True)
+        shutil.rmtree(doomed, ignore_errors=True)
+        logger.info(f"npm content cache dropped ({size / 1024 / 1024:.0f} MB over its cap)")
+
+    def evict(self):
+        """
+        Drops least-recently-used snapshots until they fit under the cap
+        """
+        with self._lock:
+            entries = []
+            for key in os.listdir(self.snapshot_dir):
+                path = self._path(key)
+                if key.startswith(".") or not os.path.isdir(path):
+                    continue
+                size = self._read_meta(key).get("size") or _tree_size(path)
+                entries.append((os.path.getmtime(path), key, size))
+            total = sum(size for _, _, size in entries)
+            for _, key, size in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if key in self._in_use:
+                    continue
+                # Rename first so a concurrent restore never sees a half-deleted snapshot
+                doomed = os.path.join(self.snapshot_dir, f".evict-{key}")
+                os.rename(self._path(key), doomed)
+                shutil.rmtree(doomed, ignore_errors=True)
+                total -= size
+                logger.info(f"npm cache evicted {key[:12]} ({size / 1024 / 1024:.0f} MB)")
+
+
+npm_cache = (
+    NpmCache(
+        settings.NPM_CACHE_DIR,
+        int(settings.NPM_CACHE_MAX_GB * 1024 ** 3),
+        int(settings.NPM_CONTENT_CACHE_MAX_GB * 1024 ** 3),
+    )
+    if settings.NPM_CACHE_ENABLED
+    else None
+)
@@ -2,25 +2,25 @@
 from datetime import timedelta
 from fastapi import APIRouter, Body, Query, Security, HTTPException
 from fastapi.responses import RedirectResponse
-from app.middleware.rbac import get_current_user
+from app.middleware.rbac import get_current_user, is_admin
 from app.schemas.user import *
-from app.utils.hash_utils import hash_password, verify_password
+from app.utils.hash_utils import hash_password_async, verify_password_async, HashPoolSaturated
 from app.utils.auth_utils import create_access_token, decode_token, create_refresh_token
 from app.database import user_collection
 from app.core.config import settings
 from app.core.error_messages import ErrorResponses  # Centralized error messages
-from uuid import uuid4
-from app.utils.email_utils import send_email
+from app.utils.mail_queue import enqueue_email, MailQueueFull
+from app.utils.principal_cache import principal_cache, invalidate_principal
+from app.services.auth_service import update_user_role
+from app.services.token_store import issue_token, consume_token, PURPOSE_RESET, PURPOSE_VERIFY
 from datetime import datetime, timedelta
 auth_router = APIRouter(tags=["Auth"])
 from pydantic import BaseModel
 from bson import ObjectId
 class EmailSchema(BaseModel):
     email: str
-# Temporary in-memory token storage
-reset_tokens = {}
-verification_tokens = {}
-
+class RoleUpdateSchema(BaseModel):
+    role: str
 
 
 # ------------------------
@@ -34,12 +34,11 @@ async def trigger_verification_email(email: str):
     if user.get("is_verified"):
         return {"msg": "Email already verified"}
 
-    token = str(uuid4())
-    expires_at = datetime.utcnow() + timedelta(days=7)
-
-    await user_collection.update_one(
-        {"email": email},
-        {"$set": {"verification_token": token, "token_expires_at": expires_at}}
+    token = await issue_token(
+        PURPOSE_VERIFY,
+        email,
+        timedelta(days=settings.VERIFICATION_TOKEN_TTL_DAYS),
+        revoke_existing=True,
     )
 
     verify_link = f"http://localhost:5173/verify-email?token={token}"
@@ -57,9 +56,9 @@ async def trigger_verification_email(email: str):
     """
 
     try:
-        send_email(email, subject, body)
-    except Exception as e:
-        print("SMTP send failed:", e)
+        enqueue_email(email, subject, body)
+    except MailQueueFull as e:
+        print("Mail enqueue failed:", e)
         raise ErrorResponses.INTERNAL_SERVER_ERROR
 
     return {"msg": "✅ Verification email sent successfully"}
@@ -74,7 +73,10 @@ async def register(data: RegisterSchema):
     if user:
         raise ErrorResponses.USER_EXISTS
 
-    hashed_pw = hash_password(data.password)
+    try:
+        hashed_pw = await hash_password_async(data.password)
+    except HashPoolSaturated:
+        raise ErrorResponses.AUTH_BUSY
     role = "admin" if (
         data.email == settings.ADMIN_EMAIL and data.password == settings.ADMIN_PASSWORD
     ) else "user"
@@ -99,7 +101,13 @@ async def register(data: RegisterSchema):
 @auth_router.post("/login", response_model=TokenResponse)
 async def login(data: LoginSchema):
     user = await user_collection.find_one({"email": data.email})
-    if not user or not verify_password(data.password, user["password"]):
+    if not user:
+        raise ErrorResponses.INVALID_CREDENTIALS
+    try:
+        password_ok = await verify_password_async(data.password, user["password"])
+    except HashPoolSaturated:
+        raise ErrorResponses.AUTH_BUSY
+    if not password_ok:
         raise ErrorResponses.INVALID_CREDENTIALS
 
     if not bool(user.get("is_verified", False)):
@@ -124,26 +132,25 @@ async def login(data: LoginSchema):
 # ------------------------
 @auth_router.get("/verify-email")
 async def verify_email(token: str = Query(...)):
-    # 1️⃣ Find user by token
-    user = await user_collection.find_one({"verification_token": token})
-    if not user:
-        raise HTTPException(status_code=400, detail="Invalid token")
-
-    # 2️⃣ Check expiry
-    if datetime.utcnow() > user["token_expires_at"]:
-        raise HTTPException(status_code=400, detail="Token expired")
-
-    # 3️⃣ Update verified status
-    await user_collection.update_one(
-        {"_id": ObjectId(user["_id"])},
+    # 1️⃣ Consume token (single use, expiry enforced by the store)
+    record = await consume_token(PURPOSE_VERIFY, token)
+    if not record:
+        raise HTTPException(status_code=400, detail="Invalid or expired token")
+
+    # 2️⃣ Update verified status
+    user = await user_collection.find_one_and_update(
+        {"email": record["email"]},
         {"$set": {"is_verified": True}, "$unset": {"verification_token": "", "token_expires_at": ""}}
     )
+    if not user:
+        raise ErrorResponses.USER_NOT_FOUND
+    await invalidate_principal(user["email"])
 
-    # 4️⃣ Auto-login: generate tokens
+    # 3️⃣ Auto-login: generate tokens
     access_token = create_access_token({"email": user["email"], "role": user["role"]})
     refresh_token = create_refresh_token({"email": user["email"], "role": user["role"]}, timedelta(days=7))
 
-    # 5️⃣ Redirect straight to dashboard with tokens
+    # 4️⃣ Redirect straight to dashboard with tokens
     return RedirectResponse(
         url=f"http://localhost:5173/dashboard?access_token={access_token}&refresh_token={refresh_token}"
     )
@@ -181,8 +188,11 @@ async def forgot_password(email: str):
     if not user:
         raise ErrorResponses.USER_NOT_FOUND
 
-    token = str(uuid4())
-    reset_tokens[token] = email
+    token = await issue_token(
+        PURPOSE_RESET,
+        email,
+        timedelta(minutes=settings.RESET_TOKEN_TTL_MINUTES),
+    )
 # Local development (no SSL)
     reset_link = f"http://localhost:5173/reset-password?token={token}"
 
@@ -196,8 +206,8 @@ async def forgot_password(email: str):
     """
 
     try:
-        send_email(email, subject, body)
-    except Exception:
+        enqueue_email(email, subject, body)
+    except MailQueueFull:
         raise ErrorResponses.INTERNAL_SERVER_ERROR
 
     return {"msg": "✅ Password reset email sent successfully"}
@@ -205,13 +215,18 @@ async def forgot_password(email: str):
 
 @auth_router.post("/reset-password")
 async def reset_password(data: ResetPasswordSchema):
-    email = reset_tokens.get(data.token)
-    if not email:
-        raise ErrorResponses.INVALID_TOKEN
+    # Hash first: if the pool is saturated the client is told to retry, so the token must survive
+    try:
+        hashed_pw = await hash_password_async(data.new_password)
+    except HashPoolSaturated:
+        raise ErrorResponses.AUTH_BUSY
 
-    hashed_pw = hash_password(data.new_password)
+    record = await consume_token(PURPOSE_RESET, data.token)
+    if not record:
+        raise ErrorResponses.INVALID_TOKEN
+    email = record["email"]
     await user_collection.update_one({"email": email}, {"$set": {"password": hashed_pw}})
-    del reset_tokens[data.token]
+    await invalidate_principal(email)
     return {"msg": "Password has been reset successfully"}
 
 
@@ -221,3 +236,22 @@ async def get_current_user_info(current_user: dict = Security(get_current_user))
     if not user:
         raise ErrorResponses.USER_NOT_FOUND
     return user
+
+
+# ------------------------
+# Admin: principal cache stats
+# ------------------------
+@auth_router.get("/principal-cache/stats")
+async def principal_cache_stats(admin: dict = Security(is_admin)):
+    return principal_cache.stats()
+
+
+@auth_router.patch("/users/{email}/role")
+async def change_user_role(email: str, data: RoleUpdateSchema, admin: dict = Security(is_admin)):
+    try:
+        updated = await update_user_role(email, data.role)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not updated:
+        raise ErrorResponses.USER_NOT_FOUND
+    return {"msg": f"Role updated to {data.role}"}
@@ -1,16 +1,32 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 import traceback
 from uuid import uuid4
-from fastapi import APIRouter, Depends, HTTPException, status
-from typing import List
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Response, status
+from fastapi.responses import StreamingResponse
+from typing import List, Optional
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
 
 from app.database import booking_collection
-
-from app.schemas.bookings import BookingCreate, BookingOut, BookingStatusUpdate
+from app.booking_queries import get_bookings_page, stream_bookings_ndjson, decode_cursor, InvalidCursor
+
+from app.schemas.bookings import (
+    BookingCreate,
+    BookingOut,
+    BookingStatusUpdate,
+    BookingBulkStatusUpdate,
+    BookingBulkStatusResult,
+    AvailabilityOut,
+)
 from app.middleware.rbac import get_current_user, is_admin as get_admin_user
-from app.routes.ws import broadcast_booking_update
-from app.utils.meet_link_and_mail import send_meeting_email
+from app.services.booking_service import (
+    transition_booking_status,
+    dispatch_status_side_effects,
+    apply_bulk_transitions,
+    dispatch_bulk_side_effects,
+)
+from app.core.config import settings
+from app.services.slot_index import slot_index, slot_floor, is_slot_aligned, to_utc_naive, apply_booking
 
 from app.utils.serialize import serialize_doc
 booking_router = APIRouter( tags=["Bookings"])
@@ -18,79 +34,154 @@ booking_router = APIRouter( tags=["Bookings"])
 
 @booking_router.post("/", response_model=BookingOut)
 async def create_booking(data: BookingCreate, user=Depends(get_current_user)):
+    resource = data.resource or settings.BOOKING_DEFAULT_RESOURCE
+    start = to_utc_naive(data.date)
+    if not is_slot_aligned(start, slot_index.slot):
+        # An off-grid booking would span two cells, which the slot_unique guard can't see
+        raise HTTPException(
+            status_code=400,
+            detail=f"Bookings must start on a {settings.BOOKING_SLOT_MINUTES}-minute boundary",
+        )
+    if slot_index.conflict(resource, start):
+        raise HTTPException(status_code=409, detail="That time slot is already booked")
+
     try:
         new_booking = {
             "booking_id": str(uuid4()),
             "userid": str(user["_id"]), 
             "name": user["name"],
             "email": user["email"],
-            "date": data.date,
+            "date": start,
             "notes": data.notes,
             "status": "pending",
             "meet_link": None,
+            "resource": resource,
+            "slot_start": slot_floor(start, slot_index.slot),
+            "slot_held": True,
             "created_at": datetime.utcnow(),
             "updated_at": datetime.utcnow()
         }
 
         result = await booking_collection.insert_one(new_booking)
+        apply_booking(new_booking)
         new_booking["id"] = str(result.inserted_id)   # 🟢 Match Pydantic schema
         print("📌 New booking created:", new_booking)
 
         return new_booking
 
+    except DuplicateKeyError:
+        # Another worker took the slot after our in-memory check
+        raise HTTPException(status_code=409, detail="That time slot is already booked")
     except Exception as e:
         print("❌ Booking creation failed:", e)
         traceback.print_exc() 
         raise HTTPException(status_code=500, detail="Booking creation failed")
 
+# -----------------------------
+# Listing helper: keyset page (next cursor in X-Next-Cursor) or NDJSON stream
+# -----------------------------
+async def list_bookings(query: dict, response: Response, cursor: Optional[str], limit: Optional[int], format: str):
+    if format == "ndjson":
+        try:
+            if cursor:
+                decode_cursor(cursor)  # fail before the 200 is sent, not mid-stream
+        except InvalidCursor as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return StreamingResponse(stream_bookings_ndjson(query, cursor), media_type="application/x-ndjson")
+
+    try:
+        bookings, next_cursor = await get_bookings_page(query, cursor, limit)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return bookings
+
+
+# Free/busy view over a date range
+@booking_router.get("/availability", response_model=AvailabilityOut)
+async def get_availability(
+    start: datetime = Query(...),
+    end: datetime = Query(...),
+    resource: Optional[str] = Query(None),
+    user=Depends(get_current_user),
+):
+    start, end = to_utc_naive(start), to_utc_naive(end)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    if end - start > timedelta(days=settings.BOOKING_AVAILABILITY_MAX_DAYS):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Range may span at most {settings.BOOKING_AVAILABILITY_MAX_DAYS} days",
+        )
+
+    resource = resource or settings.BOOKING_DEFAULT_RESOURCE
+    return {
+        "resource": resource,
+        "slot_minutes": settings.BOOKING_SLOT_MINUTES,
+        "start": start,
+        "end": end,
+        "busy": slot_index.busy(resource, start, end),
+    }
+
+
 # Get current user's bookings
 @booking_router.get("/my", response_model=List[BookingOut])
-async def get_my_bookings(user=Depends(get_current_user)):
-    bookings = await booking_collection.find({"user_id": str(user["_id"])}).to_list(100)
-    for booking in bookings:
-        booking["_id"] = str(booking["_id"])
-    return bookings
+async def get_my_bookings(
+    response: Response,
+    cursor: Optional[str] = Query(None),
+    limit: Optional[int] = Query(None, ge=1),
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    user=Depends(get_current_user),
+):
+    return await list_bookings({"userid": str(user["_id"])}, response, cursor, limit, format)
 
 
 # Admin: get all bookings
 @booking_router.get("/", response_model=List[BookingOut])
-async def get_all_bookings(admin=Depends(get_admin_user)):
-    bookings = await booking_collection.find({}).to_list(100)
-    for booking in bookings:
-        booking["_id"] = str(booking["_id"])
-    return bookings
+async def get_all_bookings(
+    response: Response,
+    cursor: Optional[str] = Query(None),
+    limit: Optional[int] = Query(None, ge=1),
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    admin=Depends(get_admin_user),
+):
+    return await list_bookings({}, response, cursor, limit, format)
 
 
 # Admin: update booking status
 @booking_router.patch("/{booking_id}/status")
-async def update_status(booking_id: str, status: BookingStatusUpdate, admin=Depends(get_admin_user)):
-    booking = await booking_collection.find_one({"_id": ObjectId(booking_id)})
-
-    if not booking:
-        raise HTTPException(status_code=404, detail="Booking not found")
+async def update_status(
+    booking_id: str,
+    status: BookingStatusUpdate,
+    background_tasks: BackgroundTasks,
+    admin=Depends(get_admin_user),
+):
+    # One round trip; meeting email and WebSocket broadcast run after the response
+    booking = await transition_booking_status(booking_id, status.status)
+    background_tasks.add_task(dispatch_status_side_effects, booking)
 
-    await booking_collection.update_one(
-        {"_id": ObjectId(booking_id)},
-        {"$set": {"status": status.status}}
-    )
+    return {"message": "Booking status updated"}
+# Admin: bulk update booking statuses
+@booking_router.patch("/status", response_model=List[BookingBulkStatusResult])
+async def bulk_update_status(
+    data: BookingBulkStatusUpdate,
+    background_tasks: BackgroundTasks,
+    admin=Depends(get_admin_user),
+):
+    if len(data.items) > settings.BOOKING_BULK_MAX_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {settings.BOOKING_BULK_MAX_ITEMS} items per request",
+        )
 
-    # Send email and attach Meet link if approved
-    if status.status.lower() == "approved":
-        user_email = booking.get("email") or booking.get("user_email") or "default@example.com"
-        meet_link = await send_meeting_email(user_email, booking_id)
+    results, updated = await apply_bulk_transitions(data.items)
+    if updated:
+        background_tasks.add_task(dispatch_bulk_side_effects, updated)
 
-        await booking_collection.update_one(
-            {"_id": ObjectId(booking_id)},
-            {"$set": {"meet_link": meet_link}}
-        )
+    return results
 
-    # Notify connected WebSocket clients
-    await broadcast_booking_update({
-        "booking_id": booking_id,
-        "status": status.status,
-    })
 
-    return {"message": "Booking status updated"}
 # Get a booking by ID
 
 @booking_router.get("/{booking_id}", response_model=BookingOut)
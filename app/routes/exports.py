@@ -0,0 +1,109 @@
+# app/routes/exports.py
+from datetime import datetime
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+
+from app.core.config import settings
+from app.database import booking_collection, template_collection
+from app.middleware.rbac import is_admin as get_admin_user
+from app.utils.export_stream import stream_csv, stream_ndjson, gzip_stream
+
+export_router = APIRouter(tags=["Exports"])
+
+BOOKING_EXPORT_FIELDS = [
+    "_id", "booking_id", "userid", "name", "email", "date",
+    "notes", "status", "meet_link", "created_at", "updated_at",
+]
+TEMPLATE_EXPORT_FIELDS = [
+    "_id", "title", "category", "uploaded_by", "status", "is_public",
+    "tags", "zip_s3_key", "preview_url", "created_at",
+]
+
+
+# -----------------------------
+# Helper: build a streaming export response
+# -----------------------------
+def export_response(
+    collection,
+    fields: list,
+    name: str,
+    format: str,
+    start: Optional[datetime],
+    end: Optional[datetime],
+    status: Optional[str],
+    batch_size: Optional[int],
+    gzip: bool,
+):
+    if start and end and start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+
+    query = {}
+    if start or end:
+        query["created_at"] = {}
+        if start:
+            query["created_at"]["$gte"] = start
+        if end:
+            query["created_at"]["$lt"] = end
+    if status:
+        query["status"] = status
+
+    batch_size = min(batch_size or settings.EXPORT_BATCH_SIZE, settings.EXPORT_BATCH_SIZE_MAX)
+    cursor = collection.find(
+        query,
+        {f: 1 for f in fields},
+    ).sort("created_at", 1).batch_size(batch_size)
+
+    if format == "csv":
+        body = stream_csv(cursor, fields, batch_size)
+        media_type = "text/csv"
+    else:
+        body = stream_ndjson(cursor, batch_size)
+        media_type = "application/x-ndjson"
+
+    filename = f"{name}-{datetime.utcnow():%Y%m%dT%H%M%S}.{format}"
+    if gzip:
+        body = gzip_stream(body)
+        media_type = "application/gzip"
+        filename += ".gz"
+
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+# Admin: export bookings
+@export_router.get("/bookings")
+async def export_bookings(
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    start: Optional[datetime] = Query(None, description="created_at >= start"),
+    end: Optional[datetime] = Query(None, description="created_at < end"),
+    status: Optional[str] = Query(None),
+    batch_size: Optional[int] = Query(None, ge=1),
+    gzip: bool = Query(False),
+    admin=Depends(get_admin_user),
+):
+    return export_response(
+        booking_collection, BOOKING_EXPORT_FIELDS, "bookings",
+        format, start, end, status, batch_size, gzip,
+    )
+
+
+# Admin: export templates
+@export_router.get("/templates")
+async def export_templates(
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    start: Optional[datetime] = Query(None, description="created_at >= start"),
+    end: Optional[datetime] = Query(None, description="created_at < end"),
+    status: Optional[str] = Query(None),
+    batch_size: Optional[int] = Query(None, ge=1),
+    gzip: bool = Query(False),
+    admin=Depends(get_admin_user),
+):
+    return export_response(
+        template_collection, TEMPLATE_EXPORT_FIELDS, "templates",
+        format, start, end, status, batch_size, gzip,
+    )
@@ -1,18 +1,30 @@
 # app/routes/templates.py
 import os
-import aiofiles
+import json
+import asyncio
+import time
 from uuid import uuid4
-from fastapi import APIRouter, UploadFile, Form, File, Depends, HTTPException, Path
+from fastapi import APIRouter, UploadFile, Form, File, Depends, HTTPException, Path, Query, Response
+from fastapi.responses import StreamingResponse
 from datetime import datetime
+from typing import Optional
 import boto3
 from bson import ObjectId
 
 from app.core.config import settings
 from app.aws_client import push_template_task
-from app.template_service import create_template_record
+from app.template_service import create_template_record, TERMINAL_STATUSES
+from app.services.ws_hub import hub, Subscriber
+from app.services.pubsub import template_topic, template_log_topic
 from app.models.template import Template
-from app.database import template_collection
+from app.schemas.templates import UploadInitiate, UploadInitiateOut
+from app.services.upload_sessions import open_session, finalize_session
+from app.database import template_collection, build_log_collection
+from app.build_log import decode_chunk
 from app.utils.serialize import serialize_list
+from app.utils.export_stream import json_default
+from app.utils.s3_upload import upload_all_to_s3, server_timing
+from app.utils.archive_inspector import inspect_archive, ArchiveRejected
 from app.middleware.rbac import get_current_user  # 🔑 Auth
 
 template_router = APIRouter(tags=["Templates"])
@@ -28,28 +40,19 @@ s3_client = boto3.client(
 )
 
 # -----------------------------
-# Helper to upload to S3
+# Helper: S3 object keys (uploads stream via app.utils.s3_upload from
+# Starlette's spooled temp files; POST /uploads bypasses the API entirely)
 # -----------------------------
-async def upload_file_to_s3(file: UploadFile, folder="templates"):
+def new_object_key(file: UploadFile, folder="templates") -> str:
     file_ext = os.path.splitext(file.filename)[1]
-    file_key = f"{folder}/{uuid4()}{file_ext}"
-
-    temp_path = f"/tmp/{uuid4()}{file_ext}"
-    async with aiofiles.open(temp_path, "wb") as out_file:
-        content = await file.read()
-        await out_file.write(content)
-
-    s3_client.upload_file(temp_path, settings.BUCKET_NAME, file_key)
-    os.remove(temp_path)  # cleanup
-
-    s3_url = f"https://{settings.BUCKET_NAME}.s3.{settings.AWS_REGION}.amazonaws.com/{file_key}"
-    return file_key, s3_url
+    return f"{folder}/{uuid4()}{file_ext}"
 
 # -----------------------------
 # Upload template route
 # -----------------------------
 @template_router.post("/upload-template")
 async def upload_template(
+    response: Response,
     title: str = Form(...),
     description: str = Form(...),
     category: str = Form(...),
@@ -61,14 +64,29 @@ async def upload_template(
     if not zip_file.filename.endswith(".zip"):
         raise HTTPException(status_code=400, detail="Only ZIP files allowed.")
 
-    # Upload ZIP
-    zip_key, zip_url = await upload_file_to_s3(zip_file)
+    # Reject bad archives (zip bombs, traversal, nothing buildable) before touching S3
+    started = time.perf_counter()
+    try:
+        report = await asyncio.to_thread(inspect_archive, zip_file.file)
+    except ArchiveRejected as e:
+        raise HTTPException(status_code=400, detail=f"Invalid template archive: {e}")
+    await zip_file.seek(0)
+    inspect_ms = (time.perf_counter() - started) * 1000
+
+    # Upload ZIP and images concurrently; any failure cancels and cleans up the rest
+    started = time.perf_counter()
+    uploads = [(zip_file, new_object_key(zip_file))]
+    uploads += [(image, new_object_key(image, folder="images")) for image in images]
+    results = await upload_all_to_s3(uploads, s3_client, settings.TEMPLATE_UPLOAD_CONCURRENCY)
+    zip_upload, image_uploads = results[0], results[1:]
+    zip_key, zip_url = zip_upload.key, zip_upload.url
+    image_urls = [img.url for img in image_uploads]
 
-    # Upload images
-    image_urls = []
-    for image in images:
-        _, img_url = await upload_file_to_s3(image, folder="images")
-        image_urls.append(img_url)
+    timings = {"inspect": inspect_ms, "zip": zip_upload.elapsed_ms}
+    timings.update({f"img{i}": img.elapsed_ms for i, img in enumerate(image_uploads)})
+    timings["uploads"] = (time.perf_counter() - started) * 1000
+    response.headers["Server-Timing"] = server_timing(timings)
+    print(f"⏱️ upload-template S3 timings (ms): {timings}")
 
     # Build Template model (no raw dicts, private by default)
     template = Template(
@@ -77,6 +95,8 @@ async def upload_template(
         category=category,
         tags=[t.strip() for t in tags.split(",") if t.strip()],
         zip_s3_key=zip_key,
+        content_hash=zip_upload.sha256,
+        build_plan=report.build_plan,
         images=image_urls,
         uploaded_by=str(current_user["_id"]),  # 👈 real user ID from auth
         status="pending",
@@ -86,8 +106,8 @@ async def upload_template(
     # Store in MongoDB
     template_id = await create_template_record(template.dict())
 
-    # Push to SQS
-    push_template_task(template_id, template.zip_s3_key)
+    # Push to SQS (blocking boto3 call, kept off the event loop)
+    await asyncio.to_thread(push_template_task, template_id, template.zip_s3_key, template.content_hash)
 
     return {
         "message": "Template uploaded successfully.",
@@ -96,6 +116,24 @@ async def upload_template(
         "image_urls": image_urls
     }
 
+# -----------------------------
+# Direct-to-S3 upload (presigned URLs, two phases)
+# -----------------------------
+@template_router.post("/uploads", response_model=UploadInitiateOut)
+async def initiate_template_upload(
+    data: UploadInitiate,
+    current_user: dict = Depends(get_current_user)
+):
+    return await open_session(data, str(current_user["_id"]), s3_client)
+
+
+@template_router.post("/uploads/{session_id}/finalize")
+async def finalize_template_upload(
+    session_id: str = Path(...),
+    current_user: dict = Depends(get_current_user)
+):
+    return await finalize_session(session_id, str(current_user["_id"]), s3_client)
+
 # -----------------------------
 # Get current user's templates
 # -----------------------------
@@ -127,4 +165,209 @@ async def get_my_template_by_id(
     # Ensure preview_url is included even if not yet processed
     template["preview_url"] = template.get("preview_url")  # could be None if still processing
 
-    return template
\ No newline at end of file
+    return template
+
+
+# -----------------------------
+# Live build status (Server-Sent Events)
+# -----------------------------
+def _sse(event: str, data: str) -> bytes:
+    return f"event: {event}\ndata: {data}\n\n".encode()
+
+
+_CLOSED = object()
+
+
+async def _next_message(sub: Subscriber):
+    """
+    Next queued message; None if nothing arrived within the keepalive window;
+    _CLOSED once the hub has dropped the subscriber and its queue is drained
+    (slow-consumer "disconnect" policy)
+    """
+    if not sub.queue.empty():
+        return sub.queue.get_nowait()
+    if sub.closed.is_set():
+        return _CLOSED
+    get = asyncio.ensure_future(sub.queue.get())
+    closed = asyncio.ensure_future(sub.closed.wait())
+    done, _ = await asyncio.wait({get, closed}, timeout=settings.SSE_KEEPALIVE_SECONDS, return_when=asyncio.FIRST_COMPLETED)
+    closed.cancel()
+    if get in done:
+        return get.result()
+    get.cancel()
+    return _CLOSED if closed in done else None
+
+
+async def _status_snapshot(obj_id: ObjectId, template_id: str) -> dict:
+    template = await template_collection.find_one({"_id": obj_id}, {"status": 1, "preview_url": 1}) or {}
+    return {
+        "type": "template_status",
+        "template_id": template_id,
+        "status": template.get("status"),
+        "stage": "snapshot",
+        "preview_url": template.get("preview_url"),
+    }
+
+
+@template_router.get("/my-templates/{template_id}/events")
+async def stream_template_events(
+    template_id: str = Path(...),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Streams status/stage events published by the build worker until the
+    template is ready or failed. Replaces polling GET /my-templates/{id}.
+    """
+    try:
+        obj_id = ObjectId(template_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid template ID")
+
+    # Subscribe before reading the snapshot so no transition falls in between
+    sub = hub.register(Subscriber(settings.WS_QUEUE_MAXSIZE, {template_topic(template_id)}))
+    template = await template_collection.find_one(
+        {"_id": obj_id, "uploaded_by": str(current_user["_id"])},
+        {"status": 1, "preview_url": 1},
+    )
+    if not template:
+        hub.unregister(sub)
+        raise HTTPException(status_code=404, detail="Template not found")
+
+    async def events():
+        try:
+            snapshot = {
+                "type": "template_status",
+                "template_id": template_id,
+                "status": template.get("status"),
+                "stage": "snapshot",
+                "preview_url": template.get("preview_url"),
+            }
+            yield _sse("template_status", json.dumps(snapshot, default=json_default))
+            if template.get("status") in TERMINAL_STATUSES:
+                return
+            dropped = 0
+            while True:
+                text = await _next_message(sub)
+                if text is None:
+                    yield b": keepalive\n\n"
+                    continue
+                if text is _CLOSED or sub.dropped > dropped:
+                    # Events were lost (queue overflowed), maybe the terminal one: skip
+                    # what's queued (older than the loss) and re-read the status instead
+                    dropped = sub.dropped
+                    while not sub.queue.empty():
+                        sub.queue.get_nowait()
+                    snapshot = await _status_snapshot(obj_id, template_id)
+                    yield _sse("template_status", json.dumps(snapshot, default=json_default))
+                    if text is _CLOSED or snapshot["status"] in TERMINAL_STATUSES:
+                        return  # EventSource reconnects if the build is still running
+                    continue
+                yield _sse("template_status", text)
+                if json.loads(text).get("status") in TERMINAL_STATUSES:
+                    return
+        finally:
+            hub.unregister(sub)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@template_router.get("/my-templates/{template_id}/logs")
+async def get_template_build_log(
+    template_id: str = Path(...),
+    follow: bool = Query(False, description="Stream new output as SSE until the build finishes"),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Output of the template's latest build. Without `follow` the stored log
+    is streamed as plain text; with `follow` it is sent as SSE `log` events
+    followed by live output until the template is ready or failed.
+    """
+    try:
+        obj_id = ObjectId(template_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid template ID")
+
+    sub = None
+    if follow:
+        # Subscribe before reading stored chunks so no output falls in between
+        sub = hub.register(Subscriber(
+            settings.WS_QUEUE_MAXSIZE, {template_topic(template_id), template_log_topic(template_id)}
+        ))
+    template = await template_collection.find_one(
+        {"_id": obj_id, "uploaded_by": str(current_user["_id"])},
+        {"status": 1},
+    )
+    if not template:
+        if sub:
+            hub.unregister(sub)
+        raise HTTPException(status_code=404, detail="Template not found")
+
+    if not follow:
+        async def text():
+            async for doc in build_log_collection.find({"template_id": template_id}).sort("seq", 1).batch_size(16):
+                yield decode_chunk(doc).encode()
+
+        return StreamingResponse(text(), media_type="text/plain; charset=utf-8")
+
+    last_seq = -1
+
+    async def stored_after(before: Optional[int] = None):
+        """
+        Stored chunks past last_seq (and before `before`), as SSE log events
+        """
+        nonlocal last_seq
+        query = {"template_id": template_id, "seq": {"$gt": last_seq}}
+        if before is not None:
+            query["seq"]["$lt"] = before
+        async for doc in build_log_collection.find(query).sort("seq", 1).batch_size(16):
+            last_seq = doc["seq"]
+            yield _sse("log", json.dumps({"seq": doc["seq"], "text": decode_chunk(doc)}))
+
+    async def events():
+        nonlocal last_seq
+        try:
+            async for event in stored_after():
+                yield event
+            if template.get("status") in TERMINAL_STATUSES:
+                return
+            dropped = 0
+            while True:
+                text = await _next_message(sub)
+                if text is None:
+                    yield b": keepalive\n\n"
+                    continue
+                if text is _CLOSED or sub.dropped > dropped:
+                    # Live events were lost: catch up from Mongo, and stop if the build ended meanwhile
+                    dropped = sub.dropped
+                    snapshot = await _status_snapshot(obj_id, template_id)
+                    async for event in stored_after():
+                        yield event
+                    if text is _CLOSED or snapshot["status"] in TERMINAL_STATUSES:
+                        yield _sse("template_status", json.dumps(snapshot, default=json_default))
+                        return
+                event = json.loads(text)
+                if event.get("type") == "template_log":
+                    if event["seq"] > last_seq + 1:
+                        # A chunk was dropped on the way here; it is already stored
+                        async for stored in stored_after(before=event["seq"]):
+                            yield stored
+                    if event["seq"] > last_seq:
+                        last_seq = event["seq"]
+                        yield _sse("log", json.dumps({"seq": event["seq"], "text": event["text"]}))
+                elif event.get("status") in TERMINAL_STATUSES:
+                    async for stored in stored_after():
+                        yield stored
+                    yield _sse("template_status", text)
+                    return
+        finally:
+            hub.unregister(sub)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
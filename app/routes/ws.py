@@ -1,18 +1,45 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from fastapi import APIRouter, Depends, HTTPException, Query, WebSocket, WebSocketDisconnect, status
+
+from app.middleware.rbac import get_current_user, is_admin
+from app.services.ws_hub import hub
+from app.services.pubsub import publish_many, user_topic, ADMIN_BOOKINGS_TOPIC
 
 ws_router = APIRouter()
-active_connections = []
 
 @ws_router.websocket("/ws/bookings")
-async def booking_ws(websocket: WebSocket):
+async def booking_ws(websocket: WebSocket, token: str = Query(...)):
+    # Browsers can't set Authorization on websocket upgrades, so the access token comes as ?token=
+    try:
+        user = await get_current_user(token)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    topics = {user_topic(user["_id"])}
+    if user.get("role") == "admin":
+        topics.add(ADMIN_BOOKINGS_TOPIC)
+
     await websocket.accept()
-    active_connections.append(websocket)
+    sub = hub.register_websocket(websocket, topics)
     try:
         while True:
-            await websocket.receive_text()  # keep connection alive
+            # Any client frame (e.g. {"type":"pong"}) opts the socket into app-level idle eviction
+            await websocket.receive_text()
+            sub.touch()
     except WebSocketDisconnect:
-        active_connections.remove(websocket)
+        pass
+    finally:
+        hub.unregister(sub)
+
+async def broadcast_booking_update(data, user_id=None):
+    """
+    Sends a booking event to admins and, if given, to the booking's owner
+    """
+    topics = [ADMIN_BOOKINGS_TOPIC]
+    if user_id:
+        topics.append(user_topic(user_id))
+    await publish_many(topics, data)
 
-async def broadcast_booking_update(data):
-    for connection in active_connections:
-        await connection.send_json(data)
+@ws_router.get("/metrics")
+async def ws_metrics(admin: dict = Depends(is_admin)):
+    return hub.metrics()
@@ -0,0 +1,185 @@
+# app/s3_publisher.py
+"""
+Publishes a build output folder to an S3 prefix.
+
+- Files upload concurrently on a shared thread pool with a tuned
+  TransferConfig.
+- Every object gets a Content-Type and a Cache-Control: fingerprinted
+  assets are immutable, HTML and everything else revalidate.
+- Text assets are stored gzip-precompressed (Content-Encoding: gzip).
+- A manifest of file hashes (.s8manifest.json) is kept under the prefix,
+  so re-publishing uploads only changed files and deletes stale ones.
+"""
+import gzip
+import hashlib
+import io
+import json
+import logging
+import mimetypes
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from boto3.s3.transfer import TransferConfig
+
+from app.core.config import settings
+
+logger = logging.getLogger("s8worker.publisher")
+
+MANIFEST_NAME = ".s8manifest.json"
+# Bumped when the way objects are stored changes (headers, encoding), forcing a full re-upload
+PUBLISH_FORMAT = 1
+
+_executor = ThreadPoolExecutor(max_workers=settings.S3_PUBLISH_THREADS, thread_name_prefix="s3-publish")
+_transfer_config = TransferConfig(
+    multipart_threshold=16 * 1024 * 1024,
+    multipart_chunksize=16 * 1024 * 1024,
+    max_concurrency=4,  # per large file; parallelism across files comes from _executor
+)
+
+_EXTRA_TYPES = {
+    ".js": "application/javascript",
+    ".mjs": "application/javascript",
+    ".map": "application/json",
+    ".json": "application/json",
+    ".webmanifest": "application/manifest+json",
+    ".wasm": "application/wasm",
+    ".svg": "image/svg+xml",
+    ".woff": "font/woff",
+    ".woff2": "font/woff2",
+    ".ico": "image/x-icon",
+    ".txt": "text/plain",
+}
+_COMPRESSIBLE = ("text/", "application/javascript", "application/json", "application/manifest+json",
+                 "image/svg+xml", "application/xml", "application/wasm")
+# main.3f2a9c1b.js, index-BzX8a_1q.css, chunk.a1b2c3d4e5.woff2 ...
+_FINGERPRINT = re.compile(r"[.-](?=[A-Za-z_]*[0-9])[A-Za-z0-9_]{8,}\.[a-z0-9]+$")  # needs a digit: not ".development.js"
+_IMMUTABLE_DIRS = ("_next/static/", "static/js/", "static/css/", "static/media/")
+
+MIN_GZIP_BYTES = 1024
+
+
+def content_type(rel: str) -> str:
+    ext = os.path.splitext(rel)[1].lower()
+    ctype = _EXTRA_TYPES.get(ext) or mimetypes.guess_type(rel)[0] or "application/octet-stream"
+    if ctype.startswith("text/") or ctype in ("application/javascript", "application/json"):
+        ctype += "; charset=utf-8"
+    return ctype
+
+
+def cache_control(rel: str) -> str:
+    if rel.endswith(".html") or rel.endswith(".webmanifest") or os.path.basename(rel) == "sw.js":
+        return "public, max-age=0, must-revalidate"
+    if rel.startswith(_IMMUTABLE_DIRS) or _FINGERPRINT.search(os.path.basename(rel)):
+        return "public, max-age=31536000, immutable"
+    return "public, max-age=3600"
+
+
+def _compressible(ctype: str) -> bool:
+    return settings.S3_PUBLISH_GZIP and ctype.startswith(_COMPRESSIBLE)
+
+
+def _sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _scan(folder: str) -> dict:
+    files = {}
+    for root, _, names in os.walk(folder):
+        for name in names:
+            full = os.path.join(root, name)
+            rel = os.path.relpath(full, folder).replace(os.sep, "/")
+            if rel == MANIFEST_NAME:
+                continue
+            ctype = content_type(rel)
+            files[rel] = {
+                "sha256": _sha256_file(full),
+                "size": os.path.getsize(full),
+                "content_type": ctype,
+                "cache_control": cache_control(rel),
+                "gzip": _compressible(ctype) and os.path.getsize(full) >= MIN_GZIP_BYTES,
+            }
+    return files
+
+
+def _load_manifest(client, bucket: str, prefix: str) -> dict:
+    try:
+        body = client.get_object(Bucket=bucket, Key=f"{prefix}/{MANIFEST_NAME}")["Body"].read()
+        manifest = json.loads(body)
+    except Exception:
+        return {}
+    if manifest.get("format") != PUBLISH_FORMAT:
+        return {}
+    return manifest.get("files", {})
+
+
+def _upload(client, bucket: str, folder: str, prefix: str, rel: str, entry: dict) -> int:
+    full = os.path.join(folder, rel)
+    extra = {"ContentType": entry["content_type"], "CacheControl": entry["cache_control"]}
+    key = f"{prefix}/{rel}"
+    if entry["gzip"]:
+        with open(full, "rb") as f:
+            raw = f.read()
+        compressed = gzip.compress(raw, compresslevel=9, mtime=0)
+        if len(compressed) < len(raw) * 0.9:
+            client.upload_fileobj(io.BytesIO(compressed), bucket, key,
+                                  ExtraArgs={**extra, "ContentEncoding": "gzip"}, Config=_transfer_config)
+            return len(compressed)
+        entry["gzip"] = False  # not worth it; store as-is
+    client.upload_file(full, bucket, key, ExtraArgs=extra, Config=_transfer_config)
+    return entry["size"]
+
+
+def publish_folder(client, folder: str, prefix: str, bucket: str = None) -> dict:
+    """
+    Syncs `folder` to s3://bucket/prefix/ and returns transfer stats.
+    Blocking: run it in a thread.
+    """
+    bucket = bucket or settings.BUCKET_NAME
+    started = time.monotonic()
+    files = _scan(folder)
+    previous = _load_manifest(client, bucket, prefix)
+
+    def unchanged(rel: str, entry: dict) -> bool:
+        old = previous.get(rel)
+        return bool(old) and all(old.get(k) == entry[k] for k in ("sha256", "content_type", "cache_control"))
+
+    changed = [rel for rel, entry in files.items() if not unchanged(rel, entry)]
+    for rel in files.keys() - set(changed):
+        files[rel]["gzip"] = previous[rel].get("gzip", False)
+
+    futures = [_executor.submit(_upload, client, bucket, folder, prefix, rel, files[rel]) for rel in changed]
+    sent = sum(f.result() for f in futures)  # re-raises the first failed upload
+
+    stale = [rel for rel in previous if rel not in files]
+    for i in range(0, len(stale), 1000):
+        client.delete_objects(
+            Bucket=bucket,
+            Delete={"Objects": [{"Key": f"{prefix}/{rel}"} for rel in stale[i:i + 1000]], "Quiet": True},
+        )
+
+    # Written last: if anything above failed, the next publish re-diffs against the old manifest
+    client.put_object(
+        Bucket=bucket,
+        Key=f"{prefix}/{MANIFEST_NAME}",
+        Body=json.dumps({"format": PUBLISH_FORMAT, "files": files}).encode(),
+        ContentType="application/json",
+        CacheControl="no-store",
+    )
+
+    stats = {
+        "files": len(files),
+        "uploaded": len(changed),
+        "skipped": len(files) - len(changed),
+        "deleted": len(stale),
+        "bytes_sent": sent,
+        "bytes_raw": sum(files[rel]["size"] for rel in changed),
+        "seconds": round(time.monotonic() - started, 2),
+    }
+    logger.info(f"Published {prefix}: {stats}")
+    return stats
@@ -1,11 +1,12 @@
 from bson import ObjectId
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
 
 class BookingCreate(BaseModel):
     date: datetime
     notes: Optional[str] = None
+    resource: Optional[str] = None
 
 class BookingOut(BaseModel):
     id: str
@@ -25,3 +26,27 @@ class BookingOut(BaseModel):
 
 class BookingStatusUpdate(BaseModel):
     status: str
+
+class BusySlot(BaseModel):
+    start: datetime
+    end: datetime
+
+class AvailabilityOut(BaseModel):
+    resource: str
+    slot_minutes: int
+    start: datetime
+    end: datetime
+    busy: List[BusySlot]
+
+class BookingBulkStatusItem(BaseModel):
+    booking_id: str
+    status: str
+
+class BookingBulkStatusUpdate(BaseModel):
+    items: List[BookingBulkStatusItem]
+
+class BookingBulkStatusResult(BaseModel):
+    booking_id: str
+    status: str
+    ok: bool
+    error: Optional[str] = None
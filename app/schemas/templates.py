@@ -0,0 +1,31 @@
+# app/schemas/templates.py
+from pydantic import BaseModel, Field
+from typing import Dict, List, Optional
+from datetime import datetime
+
+class UploadFileSpec(BaseModel):
+    kind: str = Field(..., pattern="^(zip|image)$")
+    filename: str
+    size: int = Field(..., gt=0)
+    sha256: str = Field(..., pattern="^[0-9a-fA-F]{64}$")
+    content_type: Optional[str] = None
+
+class UploadInitiate(BaseModel):
+    title: str
+    description: str
+    category: str
+    tags: str = ""
+    files: List[UploadFileSpec]
+
+class PresignedUpload(BaseModel):
+    kind: str
+    filename: str
+    key: str
+    url: str
+    method: str = "PUT"
+    headers: Dict[str, str]
+
+class UploadInitiateOut(BaseModel):
+    session_id: str
+    expires_at: datetime
+    uploads: List[PresignedUpload]
@@ -0,0 +1,16 @@
+# app/services/auth_service.py
+from app.database import user_collection
+from app.utils.principal_cache import invalidate_principal
+
+VALID_ROLES = ("user", "admin")
+
+
+async def update_user_role(email: str, role: str) -> bool:
+    """
+    Changes a user's role and drops any cached principal for them
+    """
+    if role not in VALID_ROLES:
+        raise ValueError(f"Unknown role: {role}")
+    result = await user_collection.update_one({"email": email}, {"$set": {"role": role}})
+    await invalidate_principal(email)
+    return result.matched_count > 0
@@ -0,0 +1,264 @@
+# app/services/booking_service.py
+import logging
+from datetime import datetime
+
+from bson import ObjectId
+from fastapi import HTTPException
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from app.database import booking_collection
+from app.services.slot_index import ACTIVE_STATUSES, apply_booking, conflicting_booking, slot_floor, slot_index
+from app.routes.ws import broadcast_booking_update
+from app.services.pubsub import publish, user_topic, ADMIN_BOOKINGS_TOPIC
+from app.utils.meet_link_and_mail import generate_meet_link, queue_meeting_email, queue_meeting_emails
+
+logger = logging.getLogger("s8bookings")
+
+# status -> statuses it may move to
+ALLOWED_TRANSITIONS = {
+    "pending": {"approved", "rejected"},
+    "approved": {"rejected"},
+    "rejected": {"approved"},
+}
+
+
+def allowed_sources(target: str) -> list:
+    return [src for src, targets in ALLOWED_TRANSITIONS.items() if target in targets]
+
+
+def slot_fields(booking: dict) -> dict:
+    """
+    Grid cell for the slot_unique guard, re-set when a booking re-enters an
+    active status (older bookings may not have one yet)
+    """
+    if not booking.get("date"):
+        return {}
+    return {"slot_start": slot_floor(booking["date"], slot_index.slot)}
+
+
+def build_transition_update(target: str, now: datetime) -> dict:
+    update = {"status": target, "updated_at": now, "slot_held": target in ACTIVE_STATUSES}
+    if target == "approved":
+        update["meet_link"] = generate_meet_link()
+    return update
+
+
+async def transition_booking_status(booking_id: str, target: str) -> dict:
+    """
+    Applies a status change in a single find_one_and_update. The filter only
+    matches bookings whose current status may move to `target`, so the
+    transition check and the write are atomic. A booking re-entering an
+    active status (rejected -> approved) is first re-checked for overlaps,
+    which costs one extra read. Returns the updated booking.
+    """
+    target = target.lower()
+    sources = allowed_sources(target)
+    if not sources:
+        raise HTTPException(status_code=400, detail=f"Unknown booking status: {target}")
+    try:
+        obj_id = ObjectId(booking_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid booking ID")
+
+    update = build_transition_update(target, datetime.utcnow())
+    # Sources that already hold the slot need no overlap check (pending -> approved);
+    # re-entering an active status (rejected -> approved) does
+    holding = [src for src in sources if src in ACTIVE_STATUSES or target not in ACTIVE_STATUSES]
+    reentering = [src for src in sources if src not in holding]
+
+    try:
+        booking = await booking_collection.find_one_and_update(
+            {"_id": obj_id, "status": {"$in": holding}},
+            {"$set": update},
+            return_document=ReturnDocument.AFTER,
+        ) if holding else None
+        if not booking and reentering:
+            current = await booking_collection.find_one(
+                {"_id": obj_id, "status": {"$in": reentering}}, {"status": 1, "date": 1, "resource": 1}
+            )
+            if current:
+                if conflicting_booking(current):
+                    raise HTTPException(status_code=409, detail="That time slot is already booked")
+                booking = await booking_collection.find_one_and_update(
+                    {"_id": obj_id, "status": current["status"]},
+                    {"$set": {**update, **slot_fields(current)}},
+                    return_document=ReturnDocument.AFTER,
+                )
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="That time slot is already booked")
+    if booking:
+        apply_booking(booking)
+        return booking
+
+    # Slow path, only on failure: tell "missing" apart from "not allowed"
+    current = await booking_collection.find_one({"_id": obj_id}, {"status": 1})
+    if not current:
+        raise HTTPException(status_code=404, detail="Booking not found")
+    raise HTTPException(
+        status_code=409,
+        detail=f"Cannot change booking from {current.get('status')} to {target}",
+    )
+
+
+async def dispatch_status_side_effects(booking: dict):
+    """
+    Post-commit side effects of a transition. Runs after the HTTP response
+    has been sent (FastAPI BackgroundTasks), so failures are only logged.
+    """
+    booking_id = str(booking["_id"])
+    try:
+        if booking["status"] == "approved":
+            user_email = booking.get("email") or booking.get("user_email") or "default@example.com"
+            queue_meeting_email(user_email, booking_id, booking["meet_link"])
+    except Exception as e:
+        logger.error(f"Failed to queue meeting email for {booking_id}: {e}")
+
+    try:
+        await broadcast_booking_update({
+            "booking_id": booking_id,
+            "status": booking["status"],
+        }, user_id=booking.get("userid"))
+    except Exception as e:
+        logger.error(f"Failed to broadcast booking {booking_id}: {e}")
+
+
+# -----------------------------
+# Bulk transitions
+# -----------------------------
+async def apply_bulk_transitions(items: list):
+    """
+    Applies many (booking_id, status) changes with one find + one bulk_write.
+    Each UpdateOne is guarded on the status we just read, so a booking changed
+    concurrently is reported as a conflict instead of being overwritten.
+
+    Returns (results, updated_bookings): one result dict per input item, in
+    order, and the post-update documents of the bookings that changed.
+    """
+    now = datetime.utcnow()
+    results = []
+    planned = {}  # ObjectId -> index into results
+    for item in items:
+        target = item.status.lower()
+        result = {"booking_id": item.booking_id, "status": target, "ok": False, "error": None}
+        results.append(result)
+        if not allowed_sources(target):
+            result["error"] = f"Unknown booking status: {target}"
+            continue
+        try:
+            obj_id = ObjectId(item.booking_id)
+        except Exception:
+            result["error"] = "Invalid booking ID"
+            continue
+        if obj_id in planned:
+            result["error"] = "Duplicate booking ID in request"
+            continue
+        planned[obj_id] = len(results) - 1
+
+    current = {}
+    if planned:
+        cursor = booking_collection.find(
+            {"_id": {"$in": list(planned)}},
+            {"status": 1, "email": 1, "user_email": 1, "userid": 1, "date": 1, "resource": 1},
+        )
+        async for doc in cursor:
+            current[doc["_id"]] = doc
+
+    ops, op_ids, updates = [], [], {}
+    claimed = set()  # (resource, slot_start) re-entered earlier in this batch
+    for obj_id, idx in planned.items():
+        result = results[idx]
+        doc = current.get(obj_id)
+        if not doc:
+            result["error"] = "Booking not found"
+            continue
+        source = doc.get("status")
+        if result["status"] not in ALLOWED_TRANSITIONS.get(source, set()):
+            result["error"] = f"Cannot change booking from {source} to {result['status']}"
+            continue
+        update = build_transition_update(result["status"], now)
+        if result["status"] in ACTIVE_STATUSES and source not in ACTIVE_STATUSES:
+            cell = (doc.get("resource"), slot_fields(doc).get("slot_start"))
+            if conflicting_booking(doc) or cell in claimed:
+                result["error"] = "That time slot is already booked"
+                continue
+            claimed.add(cell)
+            update.update(slot_fields(doc))
+        updates[obj_id] = update
+        ops.append(UpdateOne({"_id": obj_id, "status": source}, {"$set": update}))
+        op_ids.append(obj_id)
+
+    failed = {}
+    matched = 0
+    if ops:
+        try:
+            write = await booking_collection.bulk_write(ops, ordered=False)
+            matched = write.matched_count
+        except BulkWriteError as e:
+            matched = e.details.get("nMatched", 0)
+            for err in e.details.get("writeErrors", []):
+                if err.get("code") == 11000:
+                    failed[op_ids[err["index"]]] = "That time slot is already booked"
+                else:
+                    failed[op_ids[err["index"]]] = err.get("errmsg", "Write failed")
+
+    # If fewer ops matched than were sent, find out which ones lost the race
+    lost = set()
+    if matched < len(ops) - len(failed):
+        check_ids = [i for i in op_ids if i not in failed]
+        landed = set()
+        async for doc in booking_collection.find(
+            {"_id": {"$in": check_ids}, "updated_at": now}, {"_id": 1}
+        ):
+            landed.add(doc["_id"])
+        lost = set(check_ids) - landed
+
+    updated_bookings = []
+    for obj_id in op_ids:
+        result = results[planned[obj_id]]
+        if obj_id in failed:
+            result["error"] = failed[obj_id]
+        elif obj_id in lost:
+            result["error"] = "Booking was modified concurrently"
+        else:
+            result["ok"] = True
+            booking = {**current[obj_id], **updates[obj_id]}
+            apply_booking(booking)
+            updated_bookings.append(booking)
+
+    return results, updated_bookings
+
+
+async def dispatch_bulk_side_effects(bookings: list):
+    """
+    Bulk counterpart of dispatch_status_side_effects: one batch of approval
+    emails and a single coalesced broadcast.
+    """
+    try:
+        queue_meeting_emails([
+            (
+                b.get("email") or b.get("user_email") or "default@example.com",
+                str(b["_id"]),
+                b["meet_link"],
+            )
+            for b in bookings
+            if b["status"] == "approved"
+        ])
+    except Exception as e:
+        logger.error(f"Failed to queue bulk meeting emails: {e}")
+
+    try:
+        # Admins get one coalesced message; each owner only their own bookings
+        by_user = {}
+        for b in bookings:
+            update = {"booking_id": str(b["_id"]), "status": b["status"]}
+            by_user.setdefault(b.get("userid"), []).append(update)
+        await publish(ADMIN_BOOKINGS_TOPIC, {
+            "type": "bulk_status",
+            "updates": [u for updates in by_user.values() for u in updates],
+        })
+        for user_id, updates in by_user.items():
+            if user_id:
+                await publish(user_topic(user_id), {"type": "bulk_status", "updates": updates})
+    except Exception as e:
+        logger.error(f"Failed to broadcast bulk booking update: {e}")
@@ -0,0 +1,154 @@
+# app/services/pubsub.py
+"""
+Cross-worker pub/sub for websocket messages.
+
+publish() serializes a payload once per topic and hands the string to the
+configured backend, which gets it to ConnectionHub.deliver() on every
+worker that has subscribers for that topic:
+
+- "local": in-process only (single worker / development)
+- "mongo": a capped collection tailed by every worker, so messages
+  published by any API worker (or the build worker) reach all of them
+"""
+import asyncio
+import json
+import logging
+from datetime import datetime
+from typing import Optional
+
+from bson import Timestamp
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid
+
+from app.core.config import settings
+from app.services.ws_hub import hub
+from app.utils.export_stream import json_default
+
+logger = logging.getLogger("s8pubsub")
+
+
+def user_topic(user_id) -> str:
+    return f"user:{user_id}"
+
+
+def template_topic(template_id) -> str:
+    return f"template:{template_id}"
+
+
+def template_log_topic(template_id) -> str:
+    return f"template-log:{template_id}"
+
+
+ADMIN_BOOKINGS_TOPIC = "admin:bookings"
+PRINCIPAL_INVALIDATIONS_TOPIC = "auth:principal-invalidations"
+
+
+class InProcessBackend:
+    name = "local"
+
+    async def prepare(self):
+        pass
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, topic: str, text: str):
+        hub.deliver(topic, text)
+
+
+class MongoCappedBackend:
+    """
+    Every worker tails the same capped collection with a tailable/await
+    cursor and delivers what it reads to its local hub. Publishing is a
+    single insert; the publisher receives its own message through the tail
+    like everyone else.
+
+    Each message gets a server-assigned `seq` (an empty BSON Timestamp,
+    filled in by mongod on insert), so a restarted tail resumes after the
+    last message it saw. Client-generated ObjectIds can't be used for this:
+    they come from many hosts with skewed clocks and aren't ordered.
+    """
+
+    name = "mongo"
+
+    def __init__(self, db, collection_name: str, size_bytes: int):
+        self.db = db
+        self.collection_name = collection_name
+        self.size_bytes = size_bytes
+        self.collection = db[collection_name]
+        self._tail_task: Optional[asyncio.Task] = None
+
+    async def prepare(self):
+        """
+        Creates the capped collection. Publish-only processes (the build
+        worker) call this instead of start() so the first insert doesn't
+        create a regular, uncapped collection.
+        """
+        try:
+            await self.db.create_collection(self.collection_name, capped=True, size=self.size_bytes)
+        except CollectionInvalid:
+            pass  # already exists
+
+    async def start(self):
+        await self.prepare()
+        if self._tail_task is None:
+            last = await self.collection.find_one({}, {"seq": 1}, sort=[("$natural", -1)])
+            self._tail_task = asyncio.create_task(self._tail((last or {}).get("seq") or Timestamp(0, 0)))
+
+    async def stop(self):
+        if self._tail_task is not None:
+            self._tail_task.cancel()
+            try:
+                await self._tail_task
+            except asyncio.CancelledError:
+                pass
+            self._tail_task = None
+
+    async def publish(self, topic: str, text: str):
+        # seq first: servers before 5.0 only fill in empty timestamps in the first two fields
+        await self.collection.insert_one({"seq": Timestamp(0, 0), "topic": topic, "data": text, "ts": datetime.utcnow()})
+
+    async def _tail(self, last_seq: Timestamp):
+        while True:
+            # Capped collections take one writer at a time, so natural order is seq order
+            cursor = self.collection.find({"seq": {"$gt": last_seq}}, cursor_type=CursorType.TAILABLE_AWAIT)
+            try:
+                while cursor.alive:
+                    async for doc in cursor:
+                        last_seq = doc["seq"]
+                        hub.deliver(doc["topic"], doc["data"])
+                    # Tailable cursor returned no new docs within the await window
+                    await asyncio.sleep(0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Pub/sub tail failed, restarting: {e}")
+            # Cursor died (e.g. empty collection on first start) – back off and retry
+            await asyncio.sleep(1)
+
+
+def _build_backend():
+    if settings.WS_PUBSUB_BACKEND == "mongo":
+        from app.database import db
+
+        return MongoCappedBackend(db, settings.WS_PUBSUB_COLLECTION, settings.WS_PUBSUB_CAPPED_BYTES)
+    return InProcessBackend()
+
+
+backend = _build_backend()
+
+
+async def publish(topic: str, payload: dict):
+    await backend.publish(topic, json.dumps(payload, default=json_default))
+
+
+async def publish_many(topics, payload: dict):
+    """
+    Publishes the same payload to several topics, serializing it only once
+    """
+    text = json.dumps(payload, default=json_default)
+    for topic in topics:
+        await backend.publish(topic, text)
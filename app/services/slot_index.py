@@ -0,0 +1,210 @@
+# app/services/slot_index.py
+import asyncio
+import logging
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from app.core.config import settings
+from app.database import booking_collection
+
+logger = logging.getLogger("s8slots")
+
+# Statuses that occupy a slot
+ACTIVE_STATUSES = ("pending", "approved")
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def to_utc_naive(dt: datetime) -> datetime:
+    """
+    Mongo hands back naive UTC datetimes; normalise incoming ones to match
+    """
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def slot_floor(dt: datetime, slot: timedelta) -> datetime:
+    """
+    Start of the fixed grid slot containing dt. New bookings must start on
+    the grid (see is_slot_aligned), so each one covers exactly one cell and
+    two bookings overlap iff they share a floor, which is what the partial
+    unique index relies on.
+    """
+    return _EPOCH + ((dt - _EPOCH) // slot) * slot
+
+
+def is_slot_aligned(dt: datetime, slot: timedelta) -> bool:
+    return slot_floor(dt, slot) == dt
+
+
+class SlotIndex:
+    """
+    In-memory interval index of active bookings, one sorted start list per
+    resource. Every booking lasts exactly `slot`, so [s, s+slot) overlaps an
+    existing booking iff a neighbour of s in the sorted list is within `slot`
+    of it, which makes conflict checks O(log n).
+
+    Mongo stays the source of truth: the index is warm-loaded at startup,
+    refreshed periodically to pick up writes from other workers, and the
+    `slot_unique` partial index catches races it can't see. Only bookings
+    that can still overlap a future slot are held (see horizon()); older
+    ones are pruned as they fall into the past.
+    """
+
+    def __init__(self, slot: timedelta):
+        self.slot = slot
+        self._starts = {}      # resource -> sorted [datetime]
+        self._ids = {}         # resource -> [booking_id] parallel to _starts
+        self._by_booking = {}  # booking_id -> (resource, start)
+
+    def __len__(self):
+        return len(self._by_booking)
+
+    def clear(self):
+        self._starts.clear()
+        self._ids.clear()
+        self._by_booking.clear()
+
+    def add(self, resource: str, start: datetime, booking_id: str):
+        if booking_id in self._by_booking:
+            self.remove(booking_id)
+        starts = self._starts.setdefault(resource, [])
+        ids = self._ids.setdefault(resource, [])
+        idx = bisect_right(starts, start)
+        starts.insert(idx, start)
+        ids.insert(idx, booking_id)
+        self._by_booking[booking_id] = (resource, start)
+
+    def remove(self, booking_id: str):
+        entry = self._by_booking.pop(booking_id, None)
+        if entry is None:
+            return
+        resource, start = entry
+        starts, ids = self._starts[resource], self._ids[resource]
+        idx = bisect_left(starts, start)
+        while idx < len(starts) and starts[idx] == start:
+            if ids[idx] == booking_id:
+                del starts[idx]
+                del ids[idx]
+                return
+            idx += 1
+
+    def horizon(self) -> datetime:
+        """
+        Earliest start that can still overlap a slot beginning now or later
+        """
+        return datetime.utcnow() - self.slot
+
+    def prune(self, before: datetime) -> int:
+        """
+        Drops every booking starting before `before`. Returns how many went.
+        """
+        dropped = 0
+        for resource in list(self._starts):
+            starts, ids = self._starts[resource], self._ids[resource]
+            cut = bisect_left(starts, before)
+            if not cut:
+                continue
+            for booking_id in ids[:cut]:
+                self._by_booking.pop(booking_id, None)
+            del starts[:cut]
+            del ids[:cut]
+            dropped += cut
+            if not starts:
+                del self._starts[resource], self._ids[resource]
+        return dropped
+
+    def conflict(self, resource: str, start: datetime, exclude: Optional[str] = None) -> Optional[str]:
+        """
+        Returns the id of a booking overlapping [start, start + slot), if any
+        """
+        starts = self._starts.get(resource)
+        if not starts:
+            return None
+        ids = self._ids[resource]
+        lo = bisect_right(starts, start - self.slot)
+        hi = bisect_left(starts, start + self.slot)
+        for idx in range(lo, hi):
+            if ids[idx] != exclude:
+                return ids[idx]
+        return None
+
+    def busy(self, resource: str, start: datetime, end: datetime) -> List[dict]:
+        starts = self._starts.get(resource, [])
+        lo = bisect_right(starts, start - self.slot)
+        hi = bisect_left(starts, end)
+        return [{"start": s, "end": s + self.slot} for s in starts[lo:hi]]
+
+
+slot_index = SlotIndex(timedelta(minutes=settings.BOOKING_SLOT_MINUTES))
+
+# Updates applied while warm_load is scanning; replayed onto the fresh index
+# after the swap so they aren't lost to the (older) snapshot
+_pending_updates: Optional[list] = None
+
+
+def _mirror(index: SlotIndex, booking: dict):
+    booking_id = str(booking["_id"])
+    if booking.get("status") in ACTIVE_STATUSES and booking.get("date"):
+        resource = booking.get("resource") or settings.BOOKING_DEFAULT_RESOURCE
+        index.add(resource, booking["date"], booking_id)
+    else:
+        index.remove(booking_id)
+
+
+def apply_booking(booking: dict):
+    """
+    Mirrors a booking's current state into the index (add if active, else drop)
+    """
+    _mirror(slot_index, booking)
+    if _pending_updates is not None:
+        _pending_updates.append({k: booking.get(k) for k in ("_id", "status", "date", "resource")})
+
+
+def conflicting_booking(booking: dict) -> Optional[str]:
+    """
+    Id of another active booking overlapping `booking`'s slot, if any. Used
+    before a booking (re-)enters an active status.
+    """
+    if not booking.get("date"):
+        return None
+    resource = booking.get("resource") or settings.BOOKING_DEFAULT_RESOURCE
+    return slot_index.conflict(resource, booking["date"], exclude=str(booking["_id"]))
+
+
+async def warm_load():
+    global _pending_updates
+    fresh = SlotIndex(slot_index.slot)
+    horizon = fresh.horizon()
+    _pending_updates = []
+    try:
+        # Served by the status_date index; bookings that ended before now are never loaded
+        cursor = booking_collection.find(
+            {"status": {"$in": list(ACTIVE_STATUSES)}, "date": {"$gte": horizon}},
+            {"date": 1, "resource": 1},
+        ).batch_size(2000)
+        async for doc in cursor:
+            if doc.get("date"):
+                fresh.add(doc.get("resource") or settings.BOOKING_DEFAULT_RESOURCE, doc["date"], str(doc["_id"]))
+        # No await from here on: the replay and swap happen in one step, so
+        # readers never see a half-built index and no update slips in between
+        for booking in _pending_updates:
+            _mirror(fresh, booking)
+        fresh.prune(horizon)
+        slot_index._starts, slot_index._ids, slot_index._by_booking = fresh._starts, fresh._ids, fresh._by_booking
+    finally:
+        _pending_updates = None
+    logger.info(f"Slot index loaded with {len(slot_index)} active bookings")
+
+
+async def refresh_forever():
+    while True:
+        await asyncio.sleep(settings.BOOKING_SLOT_REFRESH_SECONDS)
+        # Cheap and local, so memory stays bounded even if the reload below fails
+        slot_index.prune(slot_index.horizon())
+        try:
+            await warm_load()
+        except Exception as e:
+            logger.error(f"Slot index refresh failed: {e}")
@@ -0,0 +1,101 @@
+# app/services/token_store.py
+import hashlib
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional
+
+from pymongo.errors import DuplicateKeyError
+
+from app.core.config import settings
+from app.database import auth_token_collection
+
+PURPOSE_RESET = "password_reset"
+PURPOSE_VERIFY = "email_verification"
+
+
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+class _SpentTokenCache:
+    """
+    Bounded in-process set of token hashes known to be consumed,
+    so replays are rejected without a Mongo round trip.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, token_hash: str):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[token_hash] = time.monotonic() + self.ttl
+            self._entries.move_to_end(token_hash)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def __contains__(self, token_hash: str) -> bool:
+        with self._lock:
+            expires_at = self._entries.get(token_hash)
+            if expires_at is None:
+                return False
+            if expires_at <= time.monotonic():
+                del self._entries[token_hash]
+                return False
+            return True
+
+
+_spent = _SpentTokenCache(
+    maxsize=settings.TOKEN_FRONT_CACHE_SIZE,
+    ttl=settings.TOKEN_FRONT_CACHE_TTL_SECONDS,
+)
+
+
+async def issue_token(purpose: str, email: str, ttl: timedelta, revoke_existing: bool = False) -> str:
+    """
+    Creates a single-use token and returns the raw value. Only its SHA-256
+    hash is stored.
+    """
+    if revoke_existing:
+        await auth_token_collection.delete_many({"purpose": purpose, "email": email})
+    now = datetime.utcnow()
+    while True:
+        token = secrets.token_urlsafe(32)
+        try:
+            await auth_token_collection.insert_one({
+                "token_hash": hash_token(token),
+                "purpose": purpose,
+                "email": email,
+                "created_at": now,
+                "expires_at": now + ttl,
+            })
+            return token
+        except DuplicateKeyError:
+            continue
+
+
+async def consume_token(purpose: str, token: str) -> Optional[dict]:
+    """
+    Atomically fetches and deletes a live token. Returns the stored record
+    (with `email`) or None if it is unknown, expired or already used.
+    """
+    token_hash = hash_token(token)
+    if token_hash in _spent:
+        return None
+    record = await auth_token_collection.find_one_and_delete({
+        "token_hash": token_hash,
+        "purpose": purpose,
+        # The TTL monitor only runs about once a minute
+        "expires_at": {"$gt": datetime.utcnow()},
+    })
+    if record is not None:
+        # Only a successful delete proves the token is spent; a miss may just be the wrong purpose
+        _spent.add(token_hash)
+    return record
@@ -0,0 +1,150 @@
+# app/services/upload_sessions.py
+"""
+Two-phase direct-to-S3 template uploads.
+
+1. open_session: validates the declared files, stores an upload session and
+   returns presigned PUT URLs. Template bytes never pass through the API.
+2. finalize_session: checks every object exists with the declared size and
+   SHA-256, then creates the Template record and queues the build.
+"""
+import asyncio
+import os
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from bson import ObjectId
+from fastapi import HTTPException
+from pymongo import ReturnDocument
+
+from app.aws_client import push_template_task
+from app.core.config import settings
+from app.database import upload_session_collection
+from app.models.template import Template
+from app.template_service import create_template_record, delete_template_record
+from app.utils.archive_inspector import inspect_archive, ArchiveRejected
+from app.utils.s3_upload import S3ObjectReader, presign_put, public_url, verify_uploaded_object
+
+
+def _object_key(kind: str, filename: str) -> str:
+    folder = "templates" if kind == "zip" else "images"
+    return f"{folder}/{uuid4()}{os.path.splitext(filename)[1]}"
+
+
+def _validate_files(files: list):
+    zips = [f for f in files if f.kind == "zip"]
+    images = [f for f in files if f.kind == "image"]
+    if len(zips) != 1:
+        raise HTTPException(status_code=400, detail="Exactly one ZIP file is required.")
+    if not zips[0].filename.endswith(".zip"):
+        raise HTTPException(status_code=400, detail="Only ZIP files allowed.")
+    if not images:
+        raise HTTPException(status_code=400, detail="At least one image is required.")
+    if len(images) > settings.TEMPLATE_MAX_IMAGES:
+        raise HTTPException(status_code=400, detail=f"At most {settings.TEMPLATE_MAX_IMAGES} images allowed.")
+    if zips[0].size > settings.TEMPLATE_MAX_ZIP_BYTES:
+        raise HTTPException(status_code=413, detail="ZIP file is too large.")
+    if any(img.size > settings.TEMPLATE_MAX_IMAGE_BYTES for img in images):
+        raise HTTPException(status_code=413, detail="Image file is too large.")
+
+
+async def open_session(data, user_id: str, client) -> dict:
+    _validate_files(data.files)
+
+    now = datetime.utcnow()
+    ttl = settings.TEMPLATE_UPLOAD_SESSION_MINUTES * 60
+    session_files, uploads = [], []
+    for spec in data.files:
+        key = _object_key(spec.kind, spec.filename)
+        signed = presign_put(client, key, spec.sha256, spec.content_type, expires=ttl)
+        session_files.append({
+            "kind": spec.kind,
+            "filename": spec.filename,
+            "key": key,
+            "size": spec.size,
+            "sha256": spec.sha256.lower(),
+            "content_type": spec.content_type,
+        })
+        uploads.append({"kind": spec.kind, "filename": spec.filename, "key": key, **signed})
+
+    session = {
+        "uploaded_by": user_id,
+        "title": data.title,
+        "description": data.description,
+        "category": data.category,
+        "tags": [t.strip() for t in data.tags.split(",") if t.strip()],
+        "files": session_files,
+        "status": "open",
+        "created_at": now,
+        "expires_at": now + timedelta(seconds=ttl),
+    }
+    result = await upload_session_collection.insert_one(session)
+    return {"session_id": str(result.inserted_id), "expires_at": session["expires_at"], "uploads": uploads}
+
+
+async def finalize_session(session_id: str, user_id: str, client) -> dict:
+    try:
+        obj_id = ObjectId(session_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid upload session ID")
+
+    # Claim the session so two concurrent finalize calls can't both create a template
+    session = await upload_session_collection.find_one_and_update(
+        {"_id": obj_id, "uploaded_by": user_id, "status": "open", "expires_at": {"$gt": datetime.utcnow()}},
+        {"$set": {"status": "finalizing"}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if not session:
+        raise HTTPException(status_code=404, detail="Upload session not found, expired or already finalized")
+
+    zip_file = next(f for f in session["files"] if f["kind"] == "zip")
+    image_urls = [public_url(f["key"]) for f in session["files"] if f["kind"] == "image"]
+    template_id = None
+    try:
+        problems = await asyncio.gather(*(
+            verify_uploaded_object(client, f["key"], f["size"], f["sha256"])
+            for f in session["files"]
+        ))
+        failed = {f["filename"]: p for f, p in zip(session["files"], problems) if p}
+        if failed:
+            raise HTTPException(status_code=400, detail={"message": "Uploaded files did not verify", "files": failed})
+        # Central directory only, via ranged reads; the archive is never downloaded here
+        reader = S3ObjectReader(client, zip_file["key"], zip_file["size"])
+        try:
+            report = await asyncio.to_thread(inspect_archive, reader)
+        except ArchiveRejected as e:
+            raise HTTPException(status_code=400, detail=f"Invalid template archive: {e}")
+
+        template = Template(
+            title=session["title"],
+            description=session["description"],
+            category=session["category"],
+            tags=session["tags"],
+            zip_s3_key=zip_file["key"],
+            content_hash=zip_file["sha256"],  # verified by S3 on upload
+            build_plan=report.build_plan,
+            images=image_urls,
+            uploaded_by=user_id,
+            status="pending",
+            is_public=False,
+        )
+        template_id = await create_template_record(template.dict())
+        await asyncio.to_thread(push_template_task, template_id, template.zip_s3_key, template.content_hash)
+    except Exception:
+        # A template whose build was never queued would sit in "pending" forever
+        if template_id is not None:
+            try:
+                await delete_template_record(template_id)
+            except Exception as e:
+                print(f"Failed to roll back template {template_id}: {e}")
+        # Re-open so the client can re-upload the offending files and retry
+        await upload_session_collection.update_one({"_id": obj_id}, {"$set": {"status": "open"}})
+        raise
+
+    await upload_session_collection.delete_one({"_id": obj_id})
+
+    return {
+        "message": "Template uploaded successfully.",
+        "template_id": template_id,
+        "zip_url": public_url(zip_file["key"]),
+        "image_urls": image_urls,
+    }
@@ -0,0 +1,228 @@
+# app/services/ws_hub.py
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from fastapi import WebSocket
+
+from app.core.config import settings
+
+logger = logging.getLogger("s8ws")
+
+
+class Subscriber:
+    """
+    One consumer of hub messages with its own bounded outbound queue.
+    Messages are pre-serialized JSON strings shared across subscribers.
+    """
+
+    def __init__(self, maxsize: int, topics=()):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.closed = asyncio.Event()
+        self.dropped = 0
+        self.topics = set(topics)
+
+    def offer(self, text: str) -> bool:
+        if self.closed.is_set():
+            return False
+        try:
+            self.queue.put_nowait(text)
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+
+    def close(self):
+        self.closed.set()
+
+
+PING_MESSAGE = '{"type":"ping"}'
+
+
+def batch_frame(texts) -> str:
+    # Messages are already JSON, so a batch is built by concatenation, not re-encoding
+    return '{"type":"batch","events":[' + ",".join(texts) + "]}"
+
+
+class WebSocketSubscriber(Subscriber):
+    def __init__(self, websocket: WebSocket, maxsize: int, topics=()):
+        super().__init__(maxsize, topics)
+        self.websocket = websocket
+        self.sender: Optional[asyncio.Task] = None
+        self.last_seen = time.monotonic()
+        # Set once the client sends any frame. Only such clients are held to
+        # the app-level idle timeout; silent ones rely on protocol ping/pong.
+        self.heartbeats = False
+
+    def touch(self):
+        self.last_seen = time.monotonic()
+        self.heartbeats = True
+
+    async def _next_frame(self) -> tuple:
+        """
+        Waits for one message, then coalesces whatever else arrives within
+        the batch window into a single frame. Returns (frame, message_count).
+        """
+        texts = [await self.queue.get()]
+        deadline = time.monotonic() + settings.WS_BATCH_WINDOW_MS / 1000
+        while len(texts) < settings.WS_BATCH_MAX_EVENTS:
+            try:
+                texts.append(self.queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                texts.append(await asyncio.wait_for(self.queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        if len(texts) == 1:
+            return texts[0], 1
+        return batch_frame(texts), len(texts)
+
+    async def send_loop(self, hub: "ConnectionHub"):
+        try:
+            while not self.closed.is_set():
+                frame, count = await self._next_frame()
+                await asyncio.wait_for(
+                    self.websocket.send_text(frame),
+                    timeout=settings.WS_SEND_TIMEOUT_SECONDS,
+                )
+                hub.sent += count
+                hub.frames += 1
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            hub.disconnected_slow += 1
+            logger.warning("Disconnecting websocket: send timed out")
+        except Exception as e:
+            logger.info(f"Websocket send failed, dropping connection: {e}")
+        finally:
+            hub.unregister(self)
+            await _close_quietly(self.websocket)
+
+
+async def _close_quietly(websocket: WebSocket, code: int = 1000):
+    try:
+        await websocket.close(code=code)
+    except Exception:
+        pass
+
+
+class ConnectionHub:
+    """
+    Local fan-out hub for this worker. Subscribers register for topics
+    (e.g. "user:<id>", "admin:bookings"); deliver() enqueues an already
+    serialized message on each subscriber of a topic without awaiting any
+    socket. Per-connection sender tasks do the actual writes, so one slow
+    client never delays the others. Cross-worker delivery is the job of
+    app.services.pubsub, which calls deliver() on every worker.
+    """
+
+    def __init__(self):
+        self.subscribers = set()
+        self.topics = {}  # topic -> set of subscribers
+        self.sent = 0
+        self.dropped = 0
+        self.disconnected_slow = 0
+        self.delivered_messages = 0
+        self.frames = 0
+        self.evicted_idle = 0
+        self._heartbeat: Optional[asyncio.Task] = None
+
+    # -------- registration --------
+    def register_websocket(self, websocket: WebSocket, topics) -> WebSocketSubscriber:
+        sub = WebSocketSubscriber(websocket, settings.WS_QUEUE_MAXSIZE, topics)
+        self.register(sub)
+        sub.sender = asyncio.create_task(sub.send_loop(self))
+        if self._heartbeat is None or self._heartbeat.done():
+            self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+        return sub
+
+    def register(self, sub: Subscriber) -> Subscriber:
+        self.subscribers.add(sub)
+        for topic in sub.topics:
+            self.topics.setdefault(topic, set()).add(sub)
+        return sub
+
+    def unregister(self, sub: Subscriber):
+        self.subscribers.discard(sub)
+        for topic in sub.topics:
+            subs = self.topics.get(topic)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self.topics[topic]
+        sub.close()
+        sender = getattr(sub, "sender", None)
+        if sender and sender is not asyncio.current_task() and not sender.done():
+            sender.cancel()
+
+    # -------- publishing --------
+    def deliver(self, topic: str, text: str) -> int:
+        """
+        Queues a serialized message for every local subscriber of `topic`.
+        Returns the number of subscribers it was queued for.
+        """
+        subs = self.topics.get(topic)
+        if not subs:
+            return 0
+        self.delivered_messages += 1
+        delivered = 0
+        for sub in list(subs):
+            if sub.offer(text):
+                delivered += 1
+                continue
+            self.dropped += 1
+            if settings.WS_SLOW_CONSUMER_POLICY == "disconnect":
+                self.disconnected_slow += 1
+                logger.warning("Disconnecting slow websocket consumer (queue full)")
+                self.unregister(sub)
+                if isinstance(sub, WebSocketSubscriber):
+                    asyncio.create_task(_close_quietly(sub.websocket, code=1013))
+        return delivered
+
+    # -------- heartbeat --------
+    async def _heartbeat_loop(self):
+        """
+        One task for all sockets: queues a ping on each. Dead TCP peers are
+        dropped by the server's protocol-level ping/pong (S8UvicornWorker),
+        whose pongs never reach the app, so only clients that answer with
+        frames of their own are evicted here once they go quiet.
+        """
+        while True:
+            await asyncio.sleep(settings.WS_HEARTBEAT_INTERVAL_SECONDS)
+            cutoff = time.monotonic() - settings.WS_IDLE_TIMEOUT_SECONDS
+            for sub in list(self.subscribers):
+                if not isinstance(sub, WebSocketSubscriber):
+                    continue
+                if sub.heartbeats and sub.last_seen < cutoff:
+                    self.evicted_idle += 1
+                    logger.info("Evicting idle websocket (no pong)")
+                    self.unregister(sub)
+                    asyncio.create_task(_close_quietly(sub.websocket, code=1001))
+                else:
+                    sub.offer(PING_MESSAGE)
+
+    def metrics(self) -> dict:
+        depths = [sub.queue.qsize() for sub in self.subscribers]
+        return {
+            "connections": len(self.subscribers),
+            "topics": len(self.topics),
+            "queued_messages": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            "queue_capacity": settings.WS_QUEUE_MAXSIZE,
+            "delivered_messages": self.delivered_messages,
+            "sent": self.sent,
+            "frames": self.frames,
+            "evicted_idle": self.evicted_idle,
+            "dropped": self.dropped,
+            "disconnected_slow": self.disconnected_slow,
+            "slow_consumer_policy": settings.WS_SLOW_CONSUMER_POLICY,
+        }
+
+
+hub = ConnectionHub()
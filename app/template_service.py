@@ -2,6 +2,7 @@
 from app.database import template_collection
 from datetime import datetime
 from bson import ObjectId
+from app.services.pubsub import publish_many, template_topic, user_topic
 
 async def create_template_record(template_data: dict) -> str:
     """
@@ -12,11 +13,17 @@ async def create_template_record(template_data: dict) -> str:
     result = await template_collection.insert_one(template_data)
     return str(result.inserted_id)
 
-async def update_template_status(template_id: str, status: str, preview_url: str = None):
+async def delete_template_record(template_id: str):
     """
-    Updates template status and preview URL
+    Removes a template record whose build was never queued
     """
-    update_data = {"status": status}
+    await template_collection.delete_one({"_id": ObjectId(template_id)})
+
+async def update_template_status(template_id: str, status: str, preview_url: str = None, **fields):
+    """
+    Updates template status and preview URL (plus any extra fields)
+    """
+    update_data = {"status": status, **fields}
     if preview_url:
         update_data["preview_url"] = preview_url
 
@@ -24,3 +31,36 @@ async def update_template_status(template_id: str, status: str, preview_url: str
         {"_id": ObjectId(template_id)},
         {"$set": update_data}
     )
+
+
+# -----------------------------
+# Live build progress
+# -----------------------------
+TERMINAL_STATUSES = ("ready", "error")
+
+
+async def publish_template_event(template_id: str, owner_id: str, status: str, stage: str, **extra):
+    """
+    Pushes a status/stage transition to the template's topic and its owner's
+    topic (websocket and SSE subscribers). Best effort: never fails a build.
+    """
+    event = {
+        "type": "template_status",
+        "template_id": template_id,
+        "status": status,
+        "stage": stage,
+        "ts": datetime.utcnow(),
+        **extra,
+    }
+    topics = [template_topic(template_id)]
+    if owner_id:
+        topics.append(user_topic(owner_id))
+    try:
+        await publish_many(topics, event)
+    except Exception as e:
+        print(f"Template event publish failed for {template_id}: {e}")
+
+
+async def get_template_owner(template_id: str):
+    doc = await template_collection.find_one({"_id": ObjectId(template_id)}, {"uploaded_by": 1})
+    return doc.get("uploaded_by") if doc else None
@@ -0,0 +1,123 @@
+# app/utils/archive_inspector.py
+"""
+Upload-time checks for template ZIPs.
+
+Only the central directory (plus package.json, if present) is read, so an
+archive is accepted or rejected in milliseconds, without extracting it.
+Declared sizes are authoritative: when the worker extracts, zipfile never
+inflates an entry past its declared size, so checking the declared sizes
+here is enough.
+"""
+import json
+import stat
+import zipfile
+from dataclasses import dataclass
+from typing import Optional
+
+from app.build_plan import make_build_plan
+from app.core.config import settings
+
+MAX_PACKAGE_JSON_BYTES = 1024 * 1024
+RATIO_CHECK_MIN_BYTES = 1024 * 1024  # tiny files compress absurdly well; don't flag them
+
+
+class ArchiveRejected(Exception):
+    pass
+
+
+@dataclass
+class ArchiveReport:
+    entries: int
+    uncompressed_size: int
+    build_plan: dict
+
+
+def _unsafe_name(name: str) -> bool:
+    if name.startswith("/") or "\\" in name or (len(name) > 1 and name[1] == ":"):
+        return True
+    return ".." in name.split("/")
+
+
+def _project_root(names: list) -> str:
+    """
+    Same rule as the worker: if the archive holds a single top-level
+    directory (ignoring dotfiles), the project lives inside it.
+    """
+    top = {n.split("/", 1)[0] for n in names if not n.startswith(".")}
+    if len(top) == 1:
+        only = top.pop()
+        if any(n.startswith(only + "/") for n in names):
+            return only + "/"
+    return ""
+
+
+def inspect_archive(fileobj) -> ArchiveReport:
+    """
+    Validates a ZIP read from a seekable file object and works out how it
+    will be built. Raises ArchiveRejected with a user-facing reason.
+    Blocking: run it in a thread.
+    """
+    try:
+        zf = zipfile.ZipFile(fileobj)
+    except (zipfile.BadZipFile, OSError) as e:
+        raise ArchiveRejected(f"not a valid ZIP archive ({e})")
+
+    with zf:
+        infos = zf.infolist()
+        if not infos:
+            raise ArchiveRejected("archive is empty")
+        if len(infos) > settings.TEMPLATE_MAX_ENTRIES:
+            raise ArchiveRejected(f"too many entries ({len(infos)} > {settings.TEMPLATE_MAX_ENTRIES})")
+
+        total = 0
+        offsets = set()
+        for info in infos:
+            if _unsafe_name(info.filename):
+                raise ArchiveRejected(f"unsafe path: {info.filename}")
+            if stat.S_ISLNK(info.external_attr >> 16):
+                raise ArchiveRejected(f"symlinks are not allowed: {info.filename}")
+            if info.flag_bits & 0x1:
+                raise ArchiveRejected(f"encrypted entry: {info.filename}")
+            if info.header_offset in offsets:
+                raise ArchiveRejected("overlapping entries")
+            offsets.add(info.header_offset)
+            if (
+                info.file_size > RATIO_CHECK_MIN_BYTES
+                and info.file_size > info.compress_size * settings.TEMPLATE_MAX_COMPRESSION_RATIO
+            ):
+                raise ArchiveRejected(f"suspicious compression ratio: {info.filename}")
+            total += info.file_size
+            if total > settings.TEMPLATE_MAX_UNCOMPRESSED_BYTES:
+                raise ArchiveRejected("uncompressed size exceeds the limit")
+
+        names = [info.filename for info in infos]
+        root = _project_root(names)
+        children = {n[len(root):].split("/", 1)[0] for n in names if n.startswith(root)}
+        exists = lambda name: name in children
+
+        pkg = _read_package_json(zf, root) if exists("package.json") else None
+        plan = make_build_plan(pkg, exists, root=root)
+
+        if plan["framework"] == "plain":
+            # The worker serves the first existing output dir, else the root
+            out = next((g for g in ("build", "dist", "out") if exists(g)), None)
+            index = f"{root}{out}/index.html" if out else f"{root}index.html"
+            if index not in names:
+                raise ArchiveRejected("static template has no index.html")
+        elif plan["framework"] != "next" and not plan["build_script"]:
+            raise ArchiveRejected("package.json has no \"build\" script")
+
+        plan["entries"] = len(infos)
+        plan["uncompressed_size"] = total
+        return ArchiveReport(entries=len(infos), uncompressed_size=total, build_plan=plan)
+
+
+def _read_package_json(zf: zipfile.ZipFile, root: str) -> Optional[dict]:
+    info = zf.getinfo(root + "package.json")
+    if info.file_size > MAX_PACKAGE_JSON_BYTES:
+        raise ArchiveRejected("package.json is too large")
+    try:
+        return json.loads(zf.read(info))
+    except Exception as e:
+        raise ArchiveRejected(f"package.json is not valid JSON ({e})")
+
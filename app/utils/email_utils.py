@@ -2,16 +2,34 @@ import smtplib
 from email.message import EmailMessage
 from app.core.config import settings
 
-def send_email(to_email: str, subject: str, body: str):
+def build_message(to_email: str, subject: str, body: str) -> EmailMessage:
     msg = EmailMessage()
     msg["Subject"] = subject
     msg["From"] = settings.SMTP_USER
     msg["To"] = to_email
     msg.set_content(body)
+    return msg
+
+def open_smtp_connection(timeout: float = settings.SMTP_TIMEOUT_SECONDS) -> smtplib.SMTP:
+    """
+    Opens and authenticates an SMTP connection using the configured server
+    """
+    if settings.SMTP_USE_SSL:
+        smtp = smtplib.SMTP_SSL(settings.SMTP_SERVER, settings.SMTP_PORT, timeout=timeout)
+    else:
+        smtp = smtplib.SMTP(settings.SMTP_SERVER, settings.SMTP_PORT, timeout=timeout)
+    if settings.SMTP_USER and settings.SMTP_PASSWORD:
+        smtp.login(settings.SMTP_USER, settings.SMTP_PASSWORD)
+    return smtp
+
+def send_email(to_email: str, subject: str, body: str):
+    """
+    One-shot blocking send. HTTP handlers should use app.utils.mail_queue.enqueue_email
+    """
+    msg = build_message(to_email, subject, body)
 
     try:
-        with smtplib.SMTP_SSL(settings.SMTP_SERVER, settings.SMTP_PORT) as smtp:
-            smtp.login(settings.SMTP_USER, settings.SMTP_PASSWORD)
+        with open_smtp_connection() as smtp:
             smtp.send_message(msg)
             print(f"Email sent to {to_email}")
     except Exception as e:
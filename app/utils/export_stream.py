@@ -0,0 +1,79 @@
+# app/utils/export_stream.py
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+from typing import AsyncIterator, Callable, List, Optional
+
+from bson import ObjectId
+
+
+def json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Unserializable type: {type(value).__name__}")
+
+
+def _csv_cell(value):
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (list, tuple)):
+        return ";".join(str(v) for v in value)
+    return str(value)
+
+
+async def stream_ndjson(
+    cursor,
+    batch_size: int,
+    transform: Optional[Callable[[dict], dict]] = None,
+) -> AsyncIterator[bytes]:
+    """
+    Yields one NDJSON chunk per `batch_size` documents read from a Motor cursor
+    """
+    lines = []
+    async for doc in cursor:
+        if transform:
+            doc = transform(doc)
+        lines.append(json.dumps(doc, default=json_default))
+        if len(lines) >= batch_size:
+            yield ("\n".join(lines) + "\n").encode()
+            lines = []
+    if lines:
+        yield ("\n".join(lines) + "\n").encode()
+
+
+async def stream_csv(cursor, fields: List[str], batch_size: int) -> AsyncIterator[bytes]:
+    """
+    Yields a header row, then one CSV chunk per `batch_size` documents
+    """
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(fields)
+    rows = 0
+    async for doc in cursor:
+        writer.writerow([_csv_cell(doc.get(f)) for f in fields])
+        rows += 1
+        if rows >= batch_size:
+            yield buf.getvalue().encode()
+            buf.seek(0)
+            buf.truncate()
+            rows = 0
+    if buf.tell():
+        yield buf.getvalue().encode()
+
+
+async def gzip_stream(chunks: AsyncIterator[bytes], level: int = 6) -> AsyncIterator[bytes]:
+    """
+    Compresses an async byte stream on the fly (gzip container, wbits=31)
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    async for chunk in chunks:
+        out = compressor.compress(chunk)
+        if out:
+            yield out
+    yield compressor.flush()
@@ -1,6 +1,11 @@
 # app/utils/hash_utils.py
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
 from passlib.context import CryptContext
 
+from app.core.config import settings
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 def hash_password(password: str):
@@ -8,3 +13,59 @@ def hash_password(password: str):
 
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
+
+
+# -----------------------------
+# Off-loop variants (bounded process pool)
+# -----------------------------
+class HashPoolSaturated(Exception):
+    """Raised when too many hash jobs are already queued"""
+
+
+HASH_POOL_WORKERS = settings.HASH_POOL_WORKERS or os.cpu_count() or 1
+HASH_POOL_MAX_PENDING = settings.HASH_POOL_MAX_PENDING or HASH_POOL_WORKERS * 8
+
+_pool = None
+_pending = 0
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=HASH_POOL_WORKERS)
+    return _pool
+
+
+async def _run_in_pool(fn, *args):
+    global _pending
+    if _pending >= HASH_POOL_MAX_PENDING:
+        raise HashPoolSaturated(f"{_pending} hash jobs pending")
+    _pending += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_pool(), fn, *args)
+    finally:
+        _pending -= 1
+
+
+async def hash_password_async(password: str) -> str:
+    return await _run_in_pool(hash_password, password)
+
+
+async def verify_password_async(plain_password, hashed_password) -> bool:
+    return await _run_in_pool(verify_password, plain_password, hashed_password)
+
+
+def hash_pool_stats() -> dict:
+    return {
+        "workers": HASH_POOL_WORKERS,
+        "max_pending": HASH_POOL_MAX_PENDING,
+        "pending": _pending,
+    }
+
+
+def shutdown_hash_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
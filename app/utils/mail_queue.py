@@ -0,0 +1,337 @@
+# app/utils/mail_queue.py
+import asyncio
+import logging
+import smtplib
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from app.core.config import settings
+from app.database import mail_delivery_collection
+from app.utils.email_utils import build_message, open_smtp_connection
+
+logger = logging.getLogger("s8mail")
+
+# A recovered mail still "retrying" this long after its last attempt was
+# claimed by a worker that died; far longer than the longest retry backoff
+STALE_CLAIM_SECONDS = 600
+
+
+class MailQueueFull(Exception):
+    """Raised when the outbound queue is at capacity"""
+
+
+@dataclass
+class MailJob:
+    to: str
+    subject: str
+    body: str
+    id: ObjectId = field(default_factory=ObjectId)
+    attempts: int = 0
+    created_at: datetime = field(default_factory=datetime.utcnow)
+    last_error: Optional[str] = None
+
+
+# -----------------------------
+# Persistent SMTP connection
+# -----------------------------
+class SMTPConnection:
+    """
+    One authenticated SMTP session reused across messages. All methods are
+    blocking and are only ever called from the mail worker's thread hop.
+    """
+
+    def __init__(self):
+        self._smtp: Optional[smtplib.SMTP] = None
+        self._last_used = 0.0
+
+    def _ensure(self) -> smtplib.SMTP:
+        if self._smtp is not None:
+            idle = time.monotonic() - self._last_used
+            if idle > settings.MAIL_IDLE_CLOSE_SECONDS:
+                self.close()
+            elif idle < settings.MAIL_PROBE_IDLE_SECONDS:
+                # Recently used: trust it; _send reconnects if the server dropped it anyway
+                return self._smtp
+            else:
+                try:
+                    if self._smtp.noop()[0] == 250:
+                        return self._smtp
+                except (smtplib.SMTPException, OSError):
+                    pass
+                self.close()
+        self._smtp = open_smtp_connection(timeout=settings.SMTP_TIMEOUT_SECONDS)
+        return self._smtp
+
+    def send_batch(self, jobs: List[MailJob]) -> List[Optional[str]]:
+        """
+        Sends each job over the shared session. Returns one error string
+        (or None on success) per job.
+        """
+        results = []
+        for job in jobs:
+            try:
+                self._send(job)
+                results.append(None)
+            except Exception as e:
+                results.append(f"{type(e).__name__}: {e}")
+            self._last_used = time.monotonic()
+        return results
+
+    def _send(self, job: MailJob):
+        msg = build_message(job.to, job.subject, job.body)
+        try:
+            self._ensure().send_message(msg)
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            # Server dropped the session since we last used it
+            self.close()
+            self._ensure().send_message(msg)
+
+    def close(self):
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except Exception:
+            pass
+        self._smtp = None
+
+
+# -----------------------------
+# Queue + worker
+# -----------------------------
+class MailQueue:
+    def __init__(self):
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._retry_handles = {}  # TimerHandle -> MailJob waiting for its retry
+        self._stopping = False  # set by stop(): failures are parked, not scheduled for retry
+        self._conn = SMTPConnection()
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+
+    def _get_queue(self) -> asyncio.Queue:
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=settings.MAIL_QUEUE_MAXSIZE)
+        return self._queue
+
+    def enqueue(self, to: str, subject: str, body: str) -> str:
+        """
+        Queues a message without touching the network. Returns the delivery id
+        under which its status will be recorded in `mail_deliveries`.
+        """
+        job = MailJob(to=to, subject=subject, body=body)
+        try:
+            self._get_queue().put_nowait(job)
+        except asyncio.QueueFull:
+            raise MailQueueFull(f"Mail queue is full ({settings.MAIL_QUEUE_MAXSIZE})")
+        return str(job.id)
+
+    def start(self):
+        self._stopping = False
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self, drain_timeout: float = 10.0):
+        queue = self._get_queue()
+        # From here on _record parks failed sends instead of creating retry timers
+        # that would never fire
+        self._stopping = True
+        pending = list(self._retry_handles.values())
+        for handle in self._retry_handles:
+            handle.cancel()
+        self._retry_handles.clear()
+        if self._worker is not None:
+            try:
+                await asyncio.wait_for(queue.join(), timeout=drain_timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Mail queue stopped with {queue.qsize()} messages undelivered")
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        while not queue.empty():
+            pending.append(queue.get_nowait())
+            queue.task_done()
+        if pending:
+            try:
+                await self._park(pending)
+            except Exception as e:
+                logger.error(f"Failed to park {len(pending)} undelivered mails: {e}")
+        await asyncio.to_thread(self._conn.close)
+
+    async def _park(self, jobs: List[MailJob]):
+        """
+        Persists undelivered jobs as "queued" (with their body) so the next
+        start picks them up in recover()
+        """
+        now = datetime.utcnow()
+        await mail_delivery_collection.bulk_write([
+            UpdateOne(
+                {"_id": job.id},
+                {
+                    "$set": {"status": "queued", "attempts": job.attempts, "body": job.body, "updated_at": now},
+                    "$setOnInsert": {"to": job.to, "subject": job.subject, "created_at": job.created_at},
+                },
+                upsert=True,
+            )
+            for job in jobs
+        ], ordered=False)
+        logger.info(f"Parked {len(jobs)} undelivered mails for the next start")
+
+    async def recover(self):
+        """
+        Re-queues mails parked by a previous stop(). Each one is claimed
+        atomically, so with several app workers every mail is taken once.
+        The body stays on the record until _record settles it as sent or
+        failed, so a claim whose worker died is re-claimed once it goes stale.
+        """
+        recovered = 0
+        while True:
+            now = datetime.utcnow()
+            doc = await mail_delivery_collection.find_one_and_update(
+                {"$or": [
+                    {"status": "queued"},
+                    {
+                        "status": "retrying",
+                        "body": {"$exists": True},
+                        "updated_at": {"$lt": now - timedelta(seconds=STALE_CLAIM_SECONDS)},
+                    },
+                ]},
+                {"$set": {"status": "retrying", "updated_at": now}},
+            )
+            if doc is None:
+                break
+            job = MailJob(
+                to=doc["to"],
+                subject=doc["subject"],
+                body=doc.get("body", ""),
+                id=doc["_id"],
+                attempts=doc.get("attempts", 0),
+                created_at=doc.get("created_at") or datetime.utcnow(),
+            )
+            try:
+                self._get_queue().put_nowait(job)
+            except asyncio.QueueFull:
+                await self._park([job])
+                break
+            recovered += 1
+        if recovered:
+            logger.info(f"Recovered {recovered} parked mails")
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._get_queue().qsize(),
+            "retry_scheduled": len(self._retry_handles),
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+        }
+
+    async def _next_batch(self) -> List[MailJob]:
+        queue = self._get_queue()
+        batch = [await queue.get()]
+        while len(batch) < settings.MAIL_BATCH_SIZE:
+            try:
+                batch.append(queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        return batch
+
+    async def _run(self):
+        queue = self._get_queue()
+        while True:
+            batch = await self._next_batch()
+            try:
+                errors = await asyncio.to_thread(self._conn.send_batch, batch)
+            except Exception as e:
+                errors = [f"{type(e).__name__}: {e}"] * len(batch)
+            try:
+                await self._record(batch, errors)
+            except Exception as e:
+                logger.error(f"Failed to record mail delivery status: {e}")
+            finally:
+                for _ in batch:
+                    queue.task_done()
+
+    async def _record(self, batch: List[MailJob], errors: List[Optional[str]]):
+        now = datetime.utcnow()
+        ops = []
+        for job, error in zip(batch, errors):
+            job.attempts += 1
+            job.last_error = error
+            if error is None:
+                status = "sent"
+                self.sent += 1
+            elif job.attempts < settings.MAIL_MAX_ATTEMPTS and self._stopping:
+                status = "queued"  # picked up by recover() on the next start
+            elif job.attempts < settings.MAIL_MAX_ATTEMPTS:
+                status = "retrying"
+                self.retried += 1
+                self._schedule_retry(job)
+            else:
+                status = "failed"
+                self.failed += 1
+                logger.error(f"Giving up on mail {job.id} to {job.to}: {error}")
+            update = {
+                "$set": {
+                    "status": status,
+                    "attempts": job.attempts,
+                    "last_error": error,
+                    "updated_at": now,
+                },
+                "$setOnInsert": {
+                    "to": job.to,
+                    "subject": job.subject,
+                    "created_at": job.created_at,
+                },
+            }
+            if status == "sent":
+                update["$set"]["sent_at"] = now
+            if status in ("sent", "failed"):
+                update["$unset"] = {"body": ""}  # only kept while the mail may still be resent
+            if status == "queued":
+                update["$set"]["body"] = job.body
+            ops.append(UpdateOne({"_id": job.id}, update, upsert=True))
+        if ops:
+            await mail_delivery_collection.bulk_write(ops, ordered=False)
+
+    def _schedule_retry(self, job: MailJob):
+        delay = settings.MAIL_RETRY_BASE_SECONDS * (2 ** (job.attempts - 1))
+        loop = asyncio.get_running_loop()
+
+        def requeue():
+            self._retry_handles.pop(handle, None)
+            try:
+                self._get_queue().put_nowait(job)
+            except asyncio.QueueFull:
+                logger.error(f"Dropping retry of mail {job.id}: queue full")
+
+        handle = loop.call_later(delay, requeue)
+        self._retry_handles[handle] = job
+
+
+mail_queue = MailQueue()
+
+
+def enqueue_email(to_email: str, subject: str, body: str) -> str:
+    return mail_queue.enqueue(to_email, subject, body)
+
+
+def enqueue_emails(messages: List[tuple]) -> List[str]:
+    """
+    Queues (to_email, subject, body) tuples in one go; the worker picks them
+    up as SMTP batches.
+    """
+    return [mail_queue.enqueue(to, subject, body) for to, subject, body in messages]
+
+
+async def get_delivery_status(delivery_id: str) -> Optional[dict]:
+    return await mail_delivery_collection.find_one({"_id": ObjectId(delivery_id)})
@@ -1,11 +1,10 @@
 import random
-from app.utils.email_utils import send_email
+from app.utils.mail_queue import enqueue_email, enqueue_emails
 
 def generate_meet_link():
     return f"https://meet.google.com/{''.join(random.choices('abcdefghijklmnopqrstuvwxyz', k=3))}-{'-'.join([''.join(random.choices('abcdefghijklmnopqrstuvwxyz1234567890', k=4)) for _ in range(2)])}"
 
-async def send_meeting_email(email: str, booking_id: str):
-    link = generate_meet_link()
+def build_meeting_email(booking_id: str, link: str):
     subject = "Booking Approved – Join Your Meeting"
     body = f"""
     Your booking (ID: {booking_id}) has been approved ✅
@@ -14,5 +13,18 @@ async def send_meeting_email(email: str, booking_id: str):
 
     Kindly be on time. Thank you.
     """
-    send_email(email, subject, body)
-    return link
+    return subject, body
+
+def queue_meeting_email(email: str, booking_id: str, link: str):
+    subject, body = build_meeting_email(booking_id, link)
+    return enqueue_email(email, subject, body)
+
+def queue_meeting_emails(meetings: list):
+    """
+    meetings: (email, booking_id, link) tuples
+    """
+    messages = []
+    for email, booking_id, link in meetings:
+        subject, body = build_meeting_email(booking_id, link)
+        messages.append((email, subject, body))
+    return enqueue_emails(messages)
@@ -0,0 +1,167 @@
+# app/utils/principal_cache.py
+"""
+Per-process cache of authenticated principals for get_current_user.
+
+Staleness bound: invalidate_principal() drops the entry locally and
+broadcasts the email on the pub/sub backend, so with WS_PUBSUB_BACKEND=mongo
+every worker forgets it within the tail latency (well under a second). The
+"local" backend can't reach other gunicorn workers, so there the TTL is
+capped at PRINCIPAL_CACHE_LOCAL_TTL_SECONDS, which then bounds how long a
+demoted admin or reset password can keep working on another worker.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from app.core.config import settings
+from app.services.ws_hub import Subscriber
+
+
+def token_fingerprint(token: str) -> str:
+    """
+    Short, non-reversible fingerprint of a bearer token used in cache keys
+    """
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()[:32]
+
+
+class PrincipalCache:
+    """
+    Per-process LRU cache of authenticated user documents.
+
+    Entries are keyed by (email, token fingerprint) and expire after `ttl`
+    seconds. `invalidate(email)` drops every entry of a user, whatever token
+    it was cached under.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._by_email: dict = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, email: str, fingerprint: str) -> Optional[dict]:
+        key = (email, fingerprint)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, user = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            # Shallow copy so handlers can't mutate the cached document
+            return dict(user)
+
+    def set(self, email: str, fingerprint: str, user: dict):
+        if self.maxsize <= 0:
+            return
+        key = (email, fingerprint)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            self._entries[key] = (time.monotonic() + self.ttl, dict(user))
+            self._by_email.setdefault(email, set()).add(fingerprint)
+            while len(self._entries) > self.maxsize:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, email: str):
+        with self._lock:
+            for fingerprint in self._by_email.pop(email, set()):
+                self._entries.pop((email, fingerprint), None)
+            self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_email.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def _remove(self, key: tuple):
+        self._entries.pop(key, None)
+        email, fingerprint = key
+        fingerprints = self._by_email.get(email)
+        if fingerprints is not None:
+            fingerprints.discard(fingerprint)
+            if not fingerprints:
+                del self._by_email[email]
+
+
+def _effective_ttl() -> float:
+    if settings.WS_PUBSUB_BACKEND == "mongo":
+        return settings.PRINCIPAL_CACHE_TTL_SECONDS
+    return min(settings.PRINCIPAL_CACHE_TTL_SECONDS, settings.PRINCIPAL_CACHE_LOCAL_TTL_SECONDS)
+
+
+principal_cache = PrincipalCache(
+    maxsize=settings.PRINCIPAL_CACHE_SIZE,
+    ttl=_effective_ttl(),
+)
+
+
+class _InvalidationListener(Subscriber):
+    """
+    Hub subscriber that applies invalidations broadcast by other workers
+    as they are delivered, instead of queueing them
+    """
+
+    def offer(self, text: str) -> bool:
+        try:
+            principal_cache.invalidate(json.loads(text)["email"])
+        except (ValueError, KeyError, TypeError):
+            return False
+        return True
+
+
+def listen_for_invalidations():
+    """
+    Called once per worker at startup
+    """
+    from app.services.pubsub import PRINCIPAL_INVALIDATIONS_TOPIC
+    from app.services.ws_hub import hub
+
+    hub.register(_InvalidationListener(1, {PRINCIPAL_INVALIDATIONS_TOPIC}))
+
+
+async def invalidate_principal(email: str):
+    """
+    Call after any write that changes what get_current_user would return
+    (password, verification state, role, ...). Drops the local entry, then
+    tells every other worker to do the same.
+    """
+    if not email:
+        return
+    principal_cache.invalidate(email)
+    from app.services.pubsub import publish, PRINCIPAL_INVALIDATIONS_TOPIC
+
+    try:
+        await publish(PRINCIPAL_INVALIDATIONS_TOPIC, {"email": email})
+    except Exception as e:
+        # Other workers fall back to the TTL
+        print(f"Principal invalidation broadcast failed for {email}: {e}")
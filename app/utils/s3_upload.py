@@ -0,0 +1,280 @@
+# app/utils/s3_upload.py
+import asyncio
+import base64
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+
+from fastapi import UploadFile
+
+from app.core.config import settings
+
+# Shared by every upload in this process; boto3 clients are thread-safe
+_executor = ThreadPoolExecutor(
+    max_workers=settings.S3_UPLOAD_THREADS,
+    thread_name_prefix="s3-upload",
+)
+
+MIN_PART_SIZE = 5 * 1024 * 1024  # S3 minimum for every part but the last
+
+
+@dataclass
+class UploadResult:
+    key: str
+    url: str
+    size: int
+    sha256: str
+    elapsed_ms: float = 0.0
+
+
+def public_url(key: str, bucket: str = None) -> str:
+    bucket = bucket or settings.BUCKET_NAME
+    return f"https://{bucket}.s3.{settings.AWS_REGION}.amazonaws.com/{key}"
+
+
+async def _in_thread(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, lambda: fn(*args, **kwargs))
+
+
+async def stream_upload_to_s3(
+    file: UploadFile,
+    key: str,
+    client,
+    bucket: str = None,
+    content_type: Optional[str] = None,
+    part_size: int = None,
+    max_inflight: int = None,
+) -> UploadResult:
+    """
+    Streams an UploadFile to S3 without reading it into memory whole.
+
+    Note that the bytes have already touched disk by then: Starlette parses
+    the multipart body into SpooledTemporaryFiles, which spill to a temp file
+    past 1 MB, before the handler runs. That spool is also what lets the
+    route inspect the ZIP's central directory (at the end of the file) before
+    uploading. Clients that must avoid the API host entirely use the
+    presigned flow (POST /uploads).
+
+    Files smaller than one part go up with a single put_object. Larger ones
+    use a multipart upload with at most `max_inflight` parts (each
+    `part_size` bytes) in memory/in flight at once. A SHA-256 of the content
+    is computed while reading. Any failure or cancellation aborts the
+    multipart upload so no orphaned parts are left behind.
+    """
+    bucket = bucket or settings.BUCKET_NAME
+    part_size = max(part_size or settings.S3_UPLOAD_PART_SIZE_MB * 1024 * 1024, MIN_PART_SIZE)
+    max_inflight = max_inflight or settings.S3_UPLOAD_MAX_INFLIGHT_PARTS
+    extra = {"ContentType": content_type} if content_type else {}
+    started = time.perf_counter()
+    digest = hashlib.sha256()
+
+    first = await file.read(part_size)
+    digest.update(first)
+    if len(first) < part_size:
+        await _in_thread(client.put_object, Bucket=bucket, Key=key, Body=first, **extra)
+        return UploadResult(
+            key=key,
+            url=public_url(key, bucket),
+            size=len(first),
+            sha256=digest.hexdigest(),
+            elapsed_ms=(time.perf_counter() - started) * 1000,
+        )
+
+    mpu = await _in_thread(client.create_multipart_upload, Bucket=bucket, Key=key, **extra)
+    upload_id = mpu["UploadId"]
+    slots = asyncio.Semaphore(max_inflight)
+    inflight = []
+    parts = []
+    size = 0
+
+    async def upload_part(number: int, body: bytes):
+        try:
+            resp = await _in_thread(
+                client.upload_part,
+                Bucket=bucket,
+                Key=key,
+                UploadId=upload_id,
+                PartNumber=number,
+                Body=body,
+            )
+            parts.append({"PartNumber": number, "ETag": resp["ETag"]})
+        finally:
+            slots.release()
+
+    try:
+        number, chunk = 1, first
+        while chunk:
+            size += len(chunk)
+            await slots.acquire()
+            inflight.append(asyncio.create_task(upload_part(number, chunk)))
+            # Surface a failed part early instead of reading the rest of the file
+            for task in inflight:
+                if task.done() and task.exception():
+                    raise task.exception()
+            chunk = await file.read(part_size)
+            digest.update(chunk)
+            number += 1
+
+        await asyncio.gather(*inflight)
+        parts.sort(key=lambda p: p["PartNumber"])
+        await _in_thread(
+            client.complete_multipart_upload,
+            Bucket=bucket,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": parts},
+        )
+    except BaseException:
+        # Let running part uploads settle (their threads can't be interrupted),
+        # then abort. Shielded so a cancelled request still cleans up.
+        await asyncio.shield(_abort(client, bucket, key, upload_id, inflight))
+        raise
+
+    return UploadResult(
+        key=key,
+        url=public_url(key, bucket),
+        size=size,
+        sha256=digest.hexdigest(),
+        elapsed_ms=(time.perf_counter() - started) * 1000,
+    )
+
+
+async def _abort(client, bucket: str, key: str, upload_id: str, inflight: list):
+    await asyncio.gather(*inflight, return_exceptions=True)
+    try:
+        await _in_thread(client.abort_multipart_upload, Bucket=bucket, Key=key, UploadId=upload_id)
+    except Exception as e:
+        print(f"Failed to abort multipart upload {upload_id} for {key}: {e}")
+
+
+async def delete_keys(client, keys: list, bucket: str = None):
+    bucket = bucket or settings.BUCKET_NAME
+    for i in range(0, len(keys), 1000):
+        batch = [{"Key": k} for k in keys[i:i + 1000]]
+        try:
+            await _in_thread(client.delete_objects, Bucket=bucket, Delete={"Objects": batch, "Quiet": True})
+        except Exception as e:
+            print(f"Failed to clean up uploaded objects {keys[i:i + 1000]}: {e}")
+
+
+async def upload_all_to_s3(uploads: list, client, limit: int, bucket: str = None) -> list:
+    """
+    Uploads (UploadFile, key) pairs concurrently, at most `limit` at a time.
+    Results come back in input order. If any upload fails, the rest are
+    cancelled and every object that may have been written is deleted
+    before the error is re-raised.
+    """
+    slots = asyncio.Semaphore(max(1, limit))
+
+    async def one(file: UploadFile, key: str) -> UploadResult:
+        async with slots:
+            return await stream_upload_to_s3(file, key, client, bucket=bucket, content_type=file.content_type)
+
+    tasks = [asyncio.create_task(one(file, key)) for file, key in uploads]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # Deleting a key that was never written is a no-op, so clean up every key we started
+        await asyncio.shield(delete_keys(client, [key for _, key in uploads], bucket))
+        raise
+
+
+def server_timing(timings: dict) -> str:
+    """
+    Formats {name: ms} as a Server-Timing header value
+    """
+    return ", ".join(f"{name};dur={ms:.1f}" for name, ms in timings.items())
+
+
+# -----------------------------
+# Presigned direct uploads
+# -----------------------------
+def sha256_b64(hex_digest: str) -> str:
+    """
+    S3 exchanges SHA-256 checksums base64-encoded
+    """
+    return base64.b64encode(bytes.fromhex(hex_digest)).decode()
+
+
+def presign_put(client, key: str, sha256_hex: str, content_type: str = None, expires: int = 900, bucket: str = None) -> dict:
+    """
+    Presigned PUT that S3 only accepts with the declared SHA-256 (it verifies
+    the x-amz-checksum-sha256 header against the body). Returns the URL and
+    the headers the client must send with it.
+    """
+    bucket = bucket or settings.BUCKET_NAME
+    params = {"Bucket": bucket, "Key": key, "ChecksumSHA256": sha256_b64(sha256_hex)}
+    headers = {"x-amz-checksum-sha256": params["ChecksumSHA256"]}
+    if content_type:
+        params["ContentType"] = content_type
+        headers["Content-Type"] = content_type
+    url = client.generate_presigned_url("put_object", Params=params, ExpiresIn=expires)
+    return {"url": url, "headers": headers}
+
+
+class S3ObjectReader:
+    """
+    Read-only, seekable file object over an S3 object using ranged GETs, so
+    zipfile can read an archive's central directory without downloading it.
+    Reads are rounded up to `block_size` and the last block is kept.
+    Blocking: use from a thread.
+    """
+
+    def __init__(self, client, key: str, size: int, bucket: str = None, block_size: int = 256 * 1024):
+        self.client = client
+        self.key = key
+        self.size = size
+        self.bucket = bucket or settings.BUCKET_NAME
+        self.block_size = block_size
+        self.pos = 0
+        self._buf_start = 0
+        self._buf = b""
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.pos
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        base = {0: 0, 1: self.pos, 2: self.size}[whence]
+        self.pos = max(0, base + offset)
+        return self.pos
+
+    def read(self, n: int = -1) -> bytes:
+        end = self.size if n is None or n < 0 else min(self.size, self.pos + n)
+        if self.pos >= end:
+            return b""
+        if not (self._buf_start <= self.pos and end <= self._buf_start + len(self._buf)):
+            fetch_end = min(self.size, max(end, self.pos + self.block_size))
+            resp = self.client.get_object(Bucket=self.bucket, Key=self.key, Range=f"bytes={self.pos}-{fetch_end - 1}")
+            self._buf_start, self._buf = self.pos, resp["Body"].read()
+        data = self._buf[self.pos - self._buf_start:end - self._buf_start]
+        self.pos += len(data)
+        return data
+
+
+async def verify_uploaded_object(client, key: str, size: int, sha256_hex: str, bucket: str = None) -> Optional[str]:
+    """
+    Returns None if the object exists with the expected size and checksum,
+    otherwise a short reason
+    """
+    bucket = bucket or settings.BUCKET_NAME
+    try:
+        head = await _in_thread(client.head_object, Bucket=bucket, Key=key, ChecksumMode="ENABLED")
+    except Exception as e:
+        code = getattr(e, "response", {}).get("Error", {}).get("Code")
+        if code in ("404", "NoSuchKey", "NotFound"):
+            return "not uploaded"
+        raise
+    if head.get("ContentLength") != size:
+        return f"size {head.get('ContentLength')} != declared {size}"
+    if head.get("ChecksumSHA256") != sha256_b64(sha256_hex):
+        return "checksum mismatch"
+    return None
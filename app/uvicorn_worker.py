@@ -0,0 +1,20 @@
+# app/uvicorn_worker.py
+from uvicorn.workers import UvicornWorker
+
+from app.core.config import settings
+
+
+class S8UvicornWorker(UvicornWorker):
+    """
+    Gunicorn worker with websocket transport settings: protocol-level
+    ping/pong (dead TCP peers are dropped even if the app heartbeat is
+    starved) and negotiated permessage-deflate compression.
+    """
+
+    CONFIG_KWARGS = {
+        **UvicornWorker.CONFIG_KWARGS,
+        "ws": "websockets",
+        "ws_ping_interval": settings.WS_HEARTBEAT_INTERVAL_SECONDS,
+        "ws_ping_timeout": settings.WS_IDLE_TIMEOUT_SECONDS,
+        "ws_per_message_deflate": settings.WS_PER_MESSAGE_DEFLATE,
+    }
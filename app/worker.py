@@ -8,15 +8,36 @@ import asyncio
 import tempfile
 import subprocess
 import signal
+import socket
 import sys
-from typing import Optional, Tuple
+import hashlib
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from typing import Callable, Optional, Tuple
 
 import psutil
 import boto3
+from botocore.exceptions import ClientError
+from bson import ObjectId
+from bson.errors import InvalidId
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 
 from app.core.config import settings
-from app.template_service import update_template_status
+from app.template_service import update_template_status, publish_template_event, get_template_owner
+from app.services import pubsub
+from app.indexes import apply_indexes
+from app.build_plan import LOCKFILES, detect_framework_from_package
+from app.npm_cache import npm_cache
+from app.s3_publisher import publish_folder
+from app.build_log import BuildLog
+from app.build_metrics import (
+    BuildMetrics, ProcessTreeSampler, Gauge, registry, start_metrics_server, BYTES_PUBLISHED,
+)
 
 # -----------------------------
 # MongoDB (async)
@@ -24,6 +45,8 @@ from app.template_service import update_template_status
 mongo_client = AsyncIOMotorClient(settings.MONGO_URL)
 db = mongo_client.get_default_database()
 template_collection = db["templates"]
+build_artifact_collection = db["build_artifacts"]
+build_log_collection = db["build_log_chunks"]
 
 # -----------------------------
 # AWS clients
@@ -42,6 +65,7 @@ s3 = boto3.client(
 )
 BUCKET = settings.BUCKET_NAME
 REGION = settings.AWS_REGION
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
 
 # -----------------------------
 # Logging
@@ -76,31 +100,110 @@ signal.signal(signal.SIGINT, handle_shutdown)
 # -----------------------------
 # Utils
 # -----------------------------
-def run_with_timeout(cmd, cwd=None, timeout=None, env=None):
-    logger.info(f"$ {' '.join(cmd)} (cwd={cwd})")
-    proc = subprocess.Popen(
-        cmd,
-        cwd=cwd,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        text=True,
-        env=env,
-    )
+class PermanentBuildError(RuntimeError):
+    """
+    The template itself is broken; retrying the same archive can't succeed
+    """
+
+class BuildInterrupted(RuntimeError):
+    """
+    The worker is shutting down and the build was handed back for another
+    worker to pick up
+    """
+
+# Child processes of in-flight builds, so shutdown can stop them
+_running_procs = set()
+_procs_lock = threading.Lock()
+_commands_stopped = False  # set by kill_running_commands; no command starts after it
 
+def _kill_tree(pid: int):
     try:
-        out, _ = proc.communicate(timeout=timeout)
-        if out:
-            logger.info(out.strip())
-        if proc.returncode != 0:
-            raise subprocess.CalledProcessError(proc.returncode, cmd, out)
-        return out
-    except subprocess.TimeoutExpired:
-        logger.error(f"Command timed out after {timeout} seconds: {' '.join(cmd)}")
-        parent = psutil.Process(proc.pid)
+        parent = psutil.Process(pid)
         for child in parent.children(recursive=True):
             child.kill()
         parent.kill()
-        raise RuntimeError(f"Timeout expired for command: {' '.join(cmd)}")
+    except psutil.NoSuchProcess:
+        pass
+
+def kill_running_commands():
+    """
+    Kills every running command and refuses to start new ones, so a build
+    that was between steps (unzip, cache restore, install -> build) can't
+    launch its next npm run after the sweep
+    """
+    global _commands_stopped
+    with _procs_lock:
+        _commands_stopped = True
+        procs = list(_running_procs)
+    for proc in procs:
+        _kill_tree(proc.pid)
+
+MAX_LINE_BYTES = 64 * 1024  # longer lines are split, so one huge line can't blow up memory
+
+def run_with_timeout(
+    cmd,
+    cwd=None,
+    timeout=None,
+    env=None,
+    metrics: Optional[BuildMetrics] = None,
+    log: Optional[BuildLog] = None,
+) -> str:
+    """
+    Runs a command, streaming its output line by line into `log` (tail
+    ring buffer + persisted chunks). A watchdog kills the whole process
+    tree after `timeout` seconds (TimeoutExpired). Returns the log tail.
+    """
+    logger.info(f"$ {' '.join(cmd)} (cwd={cwd})")
+    log = log or BuildLog.detached()
+    started = time.monotonic()
+    # Checked and registered under the same lock as the kill sweep
+    with _procs_lock:
+        if _commands_stopped:
+            raise BuildInterrupted(f"Worker stopping, not starting: {' '.join(cmd)}")
+        proc = subprocess.Popen(
+            cmd,
+            cwd=cwd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            env=env,
+        )
+        _running_procs.add(proc)
+    sampler = ProcessTreeSampler(proc.pid, settings.BUILD_SAMPLE_SECONDS).start()
+    timed_out = threading.Event()
+
+    def on_timeout():
+        timed_out.set()
+        logger.error(f"Command timed out after {timeout} seconds: {' '.join(cmd)}")
+        _kill_tree(proc.pid)
+
+    watchdog = threading.Timer(timeout, on_timeout) if timeout else None
+    try:
+        if watchdog:
+            watchdog.daemon = True
+            watchdog.start()
+        log.write(f"$ {' '.join(cmd)}\n")
+        for raw in iter(lambda: proc.stdout.readline(MAX_LINE_BYTES), b""):
+            line = raw.decode("utf-8", errors="replace")
+            logger.debug(line.rstrip())
+            log.write(line)
+        proc.wait()
+        if timed_out.is_set():
+            raise subprocess.TimeoutExpired(cmd, timeout, output=log.tail())
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, cmd, log.tail())
+        return log.tail()
+    finally:
+        if watchdog:
+            watchdog.cancel()
+        if proc.poll() is None:
+            _kill_tree(proc.pid)
+            proc.wait()
+        proc.stdout.close()
+        with _procs_lock:
+            _running_procs.discard(proc)
+        sampler.stop()
+        if metrics is not None:
+            metrics.add_command(cmd, time.monotonic() - started, sampler.peak_rss, sampler.cpu_seconds, proc.returncode)
 
 def safe_rmtree(path: str):
     try:
@@ -115,14 +218,6 @@ def unzip_to(zip_path: str, dst: str):
     with zipfile.ZipFile(zip_path, "r") as zf:
         zf.extractall(dst)
 
-def upload_folder_to_s3(folder_path: str, s3_prefix: str):
-    for root, _, files in os.walk(folder_path):
-        for f in files:
-            full = os.path.join(root, f)
-            rel = os.path.relpath(full, folder_path).replace(os.sep, "/")
-            key = f"{s3_prefix}/{rel}"
-            s3.upload_file(full, BUCKET, key)
-
 def presign(key: str, expires: int = 3600) -> str:
     return s3.generate_presigned_url(
         "get_object",
@@ -142,21 +237,11 @@ def read_package_json(path: str) -> Optional[dict]:
         return None
 
 def detect_framework(project_dir: str) -> Tuple[str, Optional[str]]:
-    pkg = read_package_json(project_dir)
-    if not pkg:
-        return "plain", None
-    deps = {**pkg.get("dependencies", {}), **pkg.get("devDependencies", {})}
-    scripts = pkg.get("scripts", {})
-    if "next" in deps:
-        return "next", "out"
-    if "vite" in deps:
-        return "vite", "dist"
-    if "react" in deps:
-        return "cra", "build"
-    for guess in ("dist", "build", "out"):
-        if os.path.exists(os.path.join(project_dir, guess)):
-            return "unknown", guess
-    return "plain", None
+    # Same rules the API applies to the archive at upload time (app.build_plan)
+    return detect_framework_from_package(
+        read_package_json(project_dir),
+        lambda name: os.path.exists(os.path.join(project_dir, name)),
+    )
 
 def ensure_build_output(project_dir: str, framework: str, guessed_dir: Optional[str]) -> Optional[str]:
     if guessed_dir:
@@ -171,134 +256,789 @@ def ensure_build_output(project_dir: str, framework: str, guessed_dir: Optional[
         return project_dir
     return None
 
+def sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# -----------------------------
+# Build artifact cache
+# -----------------------------
+# Builds are content-addressed: identical archives built by the same builder
+# version produce the same site, so a hit reuses the existing previews/
+# prefix instead of downloading, installing and building again.
+async def find_build_artifact(content_hash: Optional[str]) -> Optional[dict]:
+    if not content_hash or not settings.BUILD_ARTIFACT_CACHE:
+        return None
+    artifact = await build_artifact_collection.find_one(
+        {"content_hash": content_hash, "builder_version": settings.BUILDER_VERSION}
+    )
+    if not artifact:
+        return None
+    # Guard against a prefix that was removed from the bucket out-of-band
+    try:
+        await asyncio.to_thread(s3.head_object, Bucket=BUCKET, Key=f"{artifact['prefix']}/index.html")
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") not in ("404", "NoSuchKey", "NotFound"):
+            # Throttling or a blip: build this time, but keep the entry
+            logger.warning(f"Could not check build artifact {artifact['prefix']}: {e}")
+            return None
+        logger.warning(f"Build artifact {artifact['prefix']} missing from S3, dropping cache entry")
+        await build_artifact_collection.delete_one({"_id": artifact["_id"]})
+        return None
+    except Exception as e:
+        logger.warning(f"Could not check build artifact {artifact['prefix']}: {e}")
+        return None
+    return artifact
+
+async def record_build_artifact(content_hash: str, prefix: str, framework: str, template_id: str):
+    try:
+        await build_artifact_collection.update_one(
+            {"content_hash": content_hash, "builder_version": settings.BUILDER_VERSION},
+            {"$setOnInsert": {
+                "prefix": prefix,
+                "framework": framework,
+                "template_id": template_id,
+                "created_at": datetime.utcnow(),
+            }},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        pass  # a concurrent build of the same archive recorded it first
+    except Exception as e:
+        logger.warning(f"Failed to record build artifact for {template_id}: {e}")
+
+# -----------------------------
+# Template claims
+# -----------------------------
+# A worker builds a template only while it holds its claim: status
+# "processing" with build_worker/build_lease_until, renewed by the scheduler's
+# heartbeat. A claim whose lease has lapsed (dead worker, or handed back on
+# shutdown / for a retry) can be taken over by any worker.
+def _claim_fields(now: datetime) -> dict:
+    return {
+        "status": "processing",
+        "build_worker": WORKER_ID,
+        "build_lease_until": now + timedelta(seconds=settings.SQS_VISIBILITY_TIMEOUT_SECONDS),
+    }
+
+async def claim_template(template_id: str) -> Tuple[bool, Optional[str]]:
+    """
+    Atomically claims a pending template (or one whose claim expired).
+    Returns (claimed, current status); the status is None if it's gone.
+    """
+    oid = ObjectId(template_id)
+    now = datetime.utcnow()
+    doc = await template_collection.find_one_and_update(
+        {"_id": oid, "$or": [
+            {"status": "pending"},
+            {"status": "processing", "build_lease_until": {"$lt": now}},
+        ]},
+        {"$set": _claim_fields(now)},
+        projection={"_id": 1},
+    )
+    if doc is not None:
+        return True, "processing"
+    current = await template_collection.find_one({"_id": oid}, {"status": 1})
+    return False, current.get("status") if current else None
+
+async def claim_stuck_template() -> Optional["BuildJob"]:
+    """
+    Claims one template whose build claim expired, or returns None
+    """
+    while True:
+        now = datetime.utcnow()
+        doc = await template_collection.find_one_and_update(
+            {"status": "processing", "build_lease_until": {"$lt": now}},
+            {"$set": _claim_fields(now)},
+            sort=[("build_lease_until", 1)],
+        )
+        if doc is None:
+            return None
+        if not doc.get("zip_s3_key"):
+            logger.warning(f"Template {doc['_id']} has no zip_s3_key; marking it failed")
+            await update_template_status(str(doc["_id"]), "error", None)
+            continue
+        return BuildJob(str(doc["_id"]), doc["zip_s3_key"], doc.get("content_hash"), claimed=True)
+
+async def renew_claims(template_ids: list):
+    await template_collection.update_many(
+        {"_id": {"$in": [ObjectId(t) for t in template_ids]}, "status": "processing", "build_worker": WORKER_ID},
+        {"$set": {"build_lease_until": datetime.utcnow() + timedelta(seconds=settings.SQS_VISIBILITY_TIMEOUT_SECONDS)}},
+    )
+
+async def release_claim(template_id: str):
+    """
+    Expires this worker's claim so the next delivery or recovery can take it
+    """
+    await template_collection.update_one(
+        {"_id": ObjectId(template_id), "status": "processing", "build_worker": WORKER_ID},
+        {"$set": {"build_lease_until": datetime.utcnow()}},
+    )
+
 # -----------------------------
 # Build & publish
 # -----------------------------
-def build_project_if_needed(project_dir: str) -> Tuple[str, str]:
+def install_dependencies(
+    project_dir: str,
+    has_lock: bool,
+    env: dict,
+    metrics: Optional[BuildMetrics] = None,
+    log: Optional[BuildLog] = None,
+):
+    """
+    Restores node_modules from the host cache when the lockfile has been
+    installed before; otherwise installs and snapshots the result
+    """
+    key = npm_cache.key(project_dir) if npm_cache and has_lock else None
+    if key and npm_cache.restore(key, project_dir):
+        if metrics:
+            metrics.extra["npm_cache"] = "hit"
+        return
+    if metrics:
+        metrics.extra["npm_cache"] = "miss" if key else "uncacheable"
+    install_cmd = ["npm", "ci"] if has_lock else ["npm", "install", "--legacy-peer-deps"]
+    started = time.monotonic()
+    with npm_cache.installing() if npm_cache else nullcontext():
+        run_with_timeout(install_cmd, cwd=project_dir, timeout=20*60, env=env, metrics=metrics, log=log)
+    if key:
+        npm_cache.save(key, project_dir, time.monotonic() - started)
+
+def build_project_if_needed(
+    project_dir: str,
+    on_stage: Optional[Callable[[str], None]] = None,
+    metrics: Optional[BuildMetrics] = None,
+    log: Optional[BuildLog] = None,
+) -> Tuple[str, str]:
+    on_stage = on_stage or (lambda stage: None)
     framework, guess = detect_framework(project_dir)
     logger.info(f"Detected framework: {framework} (guess out: {guess})")
     if framework == "plain":
         out = ensure_build_output(project_dir, framework, guess)
         if not os.path.exists(os.path.join(out, "index.html")):
-            raise RuntimeError("Plain template missing index.html")
+            raise PermanentBuildError("Plain template missing index.html")
         return framework, out
 
     env = os.environ.copy()
-    has_lock = any(os.path.exists(os.path.join(project_dir, lf)) for lf in ("package-lock.json", "npm-shrinkwrap.json"))
-    install_cmd = ["npm", "ci"] if has_lock else ["npm", "install", "--legacy-peer-deps"]
-    run_with_timeout(install_cmd, cwd=project_dir, timeout=20*60, env=env)
+    if npm_cache:
+        env = npm_cache.env(env)
+    has_lock = any(os.path.exists(os.path.join(project_dir, lf)) for lf in LOCKFILES)
+    on_stage("installing")
+    install_dependencies(project_dir, has_lock, env, metrics, log)
 
     if framework == "next":
         pkg = read_package_json(project_dir) or {}
         scripts = pkg.get("scripts", {})
         if "build" in scripts:
-            run_with_timeout(["npm", "run", "build"], cwd=project_dir, timeout=30*60, env=env)
+            on_stage("building")
+            run_with_timeout(["npm", "run", "build"], cwd=project_dir, timeout=30*60, env=env, metrics=metrics, log=log)
+        on_stage("exporting")
         if "export" in scripts:
-            run_with_timeout(["npm", "run", "export"], cwd=project_dir, timeout=15*60, env=env)
+            run_with_timeout(["npm", "run", "export"], cwd=project_dir, timeout=15*60, env=env, metrics=metrics, log=log)
         else:
             try:
-                run_with_timeout(["npx", "next", "export"], cwd=project_dir, timeout=15*60, env=env)
+                run_with_timeout(["npx", "next", "export"], cwd=project_dir, timeout=15*60, env=env, metrics=metrics, log=log)
+            except BuildInterrupted:
+                raise
             except Exception as e:
                 logger.warning(f"next export fallback failed: {e}")
     elif framework in ("vite", "cra", "unknown"):
-        run_with_timeout(["npm", "run", "build"], cwd=project_dir, timeout=30*60, env=env)
+        on_stage("building")
+        run_with_timeout(["npm", "run", "build"], cwd=project_dir, timeout=30*60, env=env, metrics=metrics, log=log)
 
     out_dir = ensure_build_output(project_dir, framework, guess)
     if not out_dir or not os.path.exists(os.path.join(out_dir, "index.html")):
-        raise RuntimeError("Build output missing index.html (SPA entry).")
+        raise PermanentBuildError("Build output missing index.html (SPA entry).")
     return framework, out_dir
 
-async def process_template(template_id: str, upload_zip_key: str):
-    work_dir = None
-    zip_path = None
-    try:
-        logger.info(f"Processing template {template_id} (zip={upload_zip_key})")
-        work_dir = tempfile.mkdtemp(prefix=f"s8builder_{template_id}_")
-        zip_path = os.path.join(work_dir, os.path.basename(upload_zip_key))
-        s3.download_file(BUCKET, upload_zip_key, zip_path)
+# -----------------------------
+# Build jobs (pipelined: build stage, then upload stage)
+# -----------------------------
+@dataclass(eq=False)  # identity semantics: jobs live in the scheduler's in-flight set
+class BuildJob:
+    template_id: str
+    s3_key: str
+    content_hash: Optional[str] = None
+    message: Optional[dict] = None  # SQS message; None for recovered templates
+    owner_id: Optional[str] = None
+    work_dir: Optional[str] = None
+    framework: Optional[str] = None
+    out_dir: Optional[str] = None
+    phase: str = "building"
+    claimed: bool = False              # this worker holds the template's build claim
+    released: bool = False             # handed back to SQS on shutdown
+    retry_after: Optional[int] = None  # transient failure: redeliver after N seconds
+    metrics: BuildMetrics = field(default_factory=BuildMetrics)
+    log: Optional[BuildLog] = None
+
+    @property
+    def receive_count(self) -> int:
+        if self.message is None:
+            return 1
+        return int(self.message.get("Attributes", {}).get("ApproximateReceiveCount", 1))
 
-        extract_dir = os.path.join(work_dir, "src")
-        unzip_to(zip_path, extract_dir)
-        entries = [e for e in os.listdir(extract_dir) if not e.startswith(".")]
-        if len(entries) == 1 and os.path.isdir(os.path.join(extract_dir, entries[0])):
-            extract_dir = os.path.join(extract_dir, entries[0])
+    def check_released(self):
+        """
+        Stops a build between steps once shutdown has handed it back
+        """
+        if self.released:
+            raise BuildInterrupted(f"Build of {self.template_id} released on shutdown")
 
-        framework, out_dir = build_project_if_needed(extract_dir)
-        logger.info(f"Build complete. Framework={framework}, out={out_dir}")
+    async def stage(self, name: str, status: str = "processing", **extra):
+        self.metrics.mark(name)
+        await self.publish(name, status, **extra)
 
-        s3_prefix = f"previews/{template_id}"
-        upload_folder_to_s3(out_dir, s3_prefix)
-        index_key = f"{s3_prefix}/index.html"
+    async def publish(self, name: str, status: str = "processing", **extra):
+        await publish_template_event(self.template_id, self.owner_id, status, name, **extra)
+
+async def finish_from_artifact(job: BuildJob, artifact: dict):
+    prefix = artifact["prefix"]
+    preview_url = presign(f"{prefix}/index.html", expires=3600)
+    job.metrics.extra["cached_build"] = True
+    await update_template_status(
+        job.template_id, "ready", preview_url, preview_prefix=prefix, build_metrics=job.metrics.finish("cached")
+    )
+    await job.stage("done", status="ready", preview_url=preview_url, cached=True)
+    logger.info(f"Template {job.template_id} reused build {prefix} (hash={artifact['content_hash'][:12]})")
 
-        preview_url = presign(index_key, expires=3600)
-        await update_template_status(template_id, "ready", preview_url)
-        logger.info(f"Template {template_id} ready at {preview_url}")
+async def build_stage(job: BuildJob) -> bool:
+    """
+    Download, extract and build. Returns True when the output still has to
+    be uploaded, False when the job already finished (build cache hit).
+    """
+    loop = asyncio.get_running_loop()
 
-    except subprocess.CalledProcessError as e:
+    def stage_from_thread(name: str):
+        # Timed here, in the build thread, so the stage boundary isn't skewed by loop latency
+        job.metrics.mark(name)
+        asyncio.run_coroutine_threadsafe(job.publish(name), loop)
+
+    if not job.claimed:
+        claimed, status = await claim_template(job.template_id)
+        if not claimed:
+            if status == "processing" and job.message is not None:
+                # Another worker is on it; look again once its claim would have lapsed
+                job.retry_after = settings.SQS_VISIBILITY_TIMEOUT_SECONDS
+            logger.info(f"Template {job.template_id} is {status or 'gone'}; not building it here")
+            return False
+        job.claimed = True
+
+    logger.info(f"Processing template {job.template_id} (zip={job.s3_key})")
+    job.owner_id = await get_template_owner(job.template_id)
+    artifact = await find_build_artifact(job.content_hash)
+    if artifact:
+        await finish_from_artifact(job, artifact)
+        return False
+
+    job.check_released()
+    await job.stage("downloading")
+    job.work_dir = tempfile.mkdtemp(prefix=f"s8builder_{job.template_id}_")
+    zip_path = os.path.join(job.work_dir, os.path.basename(job.s3_key))
+    await asyncio.to_thread(s3.download_file, BUCKET, job.s3_key, zip_path)
+
+    # Templates uploaded before hashing existed: hash now to at least skip the build
+    if not job.content_hash:
+        job.content_hash = await asyncio.to_thread(sha256_file, zip_path)
+        await template_collection.update_one({"_id": ObjectId(job.template_id)}, {"$set": {"content_hash": job.content_hash}})
+        artifact = await find_build_artifact(job.content_hash)
+        if artifact:
+            await finish_from_artifact(job, artifact)
+            return False
+
+    job.check_released()
+    await job.stage("extracting")
+    extract_dir = os.path.join(job.work_dir, "src")
+    await asyncio.to_thread(unzip_to, zip_path, extract_dir)
+    os.remove(zip_path)
+    entries = [e for e in os.listdir(extract_dir) if not e.startswith(".")]
+    if len(entries) == 1 and os.path.isdir(os.path.join(extract_dir, entries[0])):
+        extract_dir = os.path.join(extract_dir, entries[0])
+
+    # The previous attempt's output is replaced by this one's
+    await build_log_collection.delete_many({"template_id": job.template_id})
+    job.check_released()
+    job.log = BuildLog(job.template_id, build_log_collection, loop)
+
+    def build():
+        try:
+            return build_project_if_needed(extract_dir, stage_from_thread, job.metrics, job.log)
+        finally:
+            job.log.close()
+
+    # Off the loop so stage events and the other jobs keep flowing during npm
+    job.framework, job.out_dir = await loop.run_in_executor(build_executor, build)
+    logger.info(f"Build complete for {job.template_id}. Framework={job.framework}, out={job.out_dir}")
+    return True
+
+async def upload_stage(job: BuildJob):
+    await job.stage("uploading")
+    s3_prefix = f"previews/{job.template_id}"
+    stats = await asyncio.to_thread(publish_folder, s3, job.out_dir, s3_prefix, BUCKET)
+    job.metrics.extra["publish"] = stats
+    BYTES_PUBLISHED.inc(amount=stats["bytes_sent"])
+    index_key = f"{s3_prefix}/index.html"
+
+    preview_url = presign(index_key, expires=3600)
+    await update_template_status(
+        job.template_id, "ready", preview_url, preview_prefix=s3_prefix, build_metrics=job.metrics.finish("ready")
+    )
+    await record_build_artifact(job.content_hash, s3_prefix, job.framework, job.template_id)
+    await job.stage("done", status="ready", preview_url=preview_url)
+    logger.info(f"Template {job.template_id} ready at {preview_url}")
+
+async def fail_job(job: BuildJob, e: Exception):
+    if isinstance(e, subprocess.CalledProcessError):
         logger.error(f"Build command failed (code {e.returncode}): {e.output}")
-        await update_template_status(template_id, "error", None)
-    except Exception as e:
-        logger.error(f"Error processing template {template_id}: {e}")
-        await update_template_status(template_id, "error", None)
-    finally:
-        if zip_path and os.path.exists(zip_path):
-            try: os.remove(zip_path)
-            except Exception: pass
-        if work_dir: safe_rmtree(work_dir)
+    elif isinstance(e, subprocess.TimeoutExpired):
+        logger.error(f"Build command timed out after {e.timeout}s: {e.output}")
+    else:
+        logger.error(f"Error processing template {job.template_id}: {e}")
+    if job.log is not None:
+        job.metrics.extra["log_tail"] = job.log.tail()
+    await update_template_status(job.template_id, "error", None, build_metrics=job.metrics.finish("error"))
+    await job.stage("failed", status="error")
 
 # -----------------------------
-# SQS consumption
+# Build scheduler
 # -----------------------------
-async def process_message(msg):
+def default_max_builds() -> int:
+    """
+    Concurrent builds this host can sustain: bounded by cores and by RAM
+    (an npm install + bundler build easily takes a couple of GB).
+    """
+    if settings.WORKER_MAX_BUILDS > 0:
+        return settings.WORKER_MAX_BUILDS
+    by_cpu = int((psutil.cpu_count() or 1) / settings.BUILD_CPUS_PER_JOB)
+    by_mem = psutil.virtual_memory().total // (settings.BUILD_MEM_PER_JOB_MB * 1024 * 1024)
+    return max(1, min(by_cpu, by_mem))
+
+MAX_BUILDS = default_max_builds()
+# npm/bundler runs block a thread for their whole duration, so they get their own pool
+build_executor = ThreadPoolExecutor(max_workers=MAX_BUILDS, thread_name_prefix="build")
+
+def has_headroom() -> bool:
+    free_mb = psutil.virtual_memory().available / (1024 * 1024)
+    cpu = psutil.cpu_percent(interval=None)  # since the previous call
+    return free_mb >= settings.BUILD_MIN_FREE_MEM_MB and cpu < settings.BUILD_MAX_CPU_PERCENT
+
+def receive_messages(count: int) -> list:
+    resp = sqs.receive_message(
+        QueueUrl=settings.SQS_QUEUE_URL,
+        MaxNumberOfMessages=max(1, min(count, 10)),
+        WaitTimeSeconds=20,
+        VisibilityTimeout=settings.SQS_VISIBILITY_TIMEOUT_SECONDS,
+        AttributeNames=["ApproximateReceiveCount", "SentTimestamp"],
+    )
+    return resp.get("Messages", [])
+
+def job_from_message(msg: dict) -> BuildJob:
     body = json.loads(msg["Body"])
-    template_id = body["template_id"]
-    s3_key = body["s3_key"]
-    await process_template(template_id, s3_key)
+    sent_ms = msg.get("Attributes", {}).get("SentTimestamp")
+    lag = max(0.0, time.time() - int(sent_ms) / 1000) if sent_ms else None
+    return BuildJob(
+        body["template_id"], body["s3_key"], body.get("content_hash"), message=msg, metrics=BuildMetrics(lag)
+    )
 
-def poll_sqs():
-    logger.info("Starting SQS polling...")
-    loop = asyncio.get_event_loop()
-    while not stop_flag:
-        try:
-            resp = sqs.receive_message(
+INSTALL_COMMANDS = (("npm", "ci"), ("npm", "install"))
+
+def failure_signature(e: subprocess.CalledProcessError) -> str:
+    return f"{' '.join(e.cmd)} exited {e.returncode}"
+
+async def count_repeated_failure(template_id: str, signature: str) -> int:
+    """
+    Records a failed build command on the template and returns how many
+    builds in a row have now failed with that same signature
+    """
+    oid = ObjectId(template_id)
+    doc = await template_collection.find_one_and_update(
+        {"_id": oid, "build_failure.signature": signature},
+        {"$inc": {"build_failure.count": 1}},
+        projection={"build_failure": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    if doc is not None:
+        return doc["build_failure"]["count"]
+    await template_collection.update_one({"_id": oid}, {"$set": {"build_failure": {"signature": signature, "count": 1}}})
+    return 1
+
+def is_permanent(e: Exception, repeats: int = 1) -> bool:
+    """
+    Failures caused by the template or message itself: no index.html in the
+    output, an archive that isn't a ZIP, a bad id, or a build script that
+    failed the same way `repeats` >= BUILD_SCRIPT_PERMANENT_AFTER times.
+    Anything else (npm ci/install, timeouts, S3, Mongo, network, a killed
+    host, plain bugs) is assumed transient and retried; SQS_MAX_RECEIVE_COUNT
+    still bounds those.
+    """
+    if isinstance(e, ClientError):
+        # The archive was deleted from the bucket: no retry will bring it back
+        return e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey")
+    if isinstance(e, subprocess.CalledProcessError):
+        # Installs fail on registry and network blips as often as on bad manifests
+        if tuple(e.cmd[:2]) in INSTALL_COMMANDS:
+            return False
+        return repeats >= settings.BUILD_SCRIPT_PERMANENT_AFTER
+    return isinstance(e, (
+        PermanentBuildError,
+        zipfile.BadZipFile,
+        InvalidId,
+    ))
+
+def dead_letter(msg: dict, error: Exception):
+    """
+    Parks a message that will never succeed on the dead-letter queue (if
+    configured) so it can be inspected or replayed instead of retried forever
+    """
+    if not settings.SQS_DLQ_URL:
+        logger.warning(f"No SQS_DLQ_URL configured, dropping message {msg.get('MessageId')}")
+        return
+    sqs.send_message(
+        QueueUrl=settings.SQS_DLQ_URL,
+        MessageBody=msg["Body"],
+        MessageAttributes={
+            "error": {"DataType": "String", "StringValue": str(error)[:1000] or type(error).__name__},
+            "receive_count": {
+                "DataType": "Number",
+                "StringValue": msg.get("Attributes", {}).get("ApproximateReceiveCount", "1"),
+            },
+        },
+    )
+
+def delete_message(msg: dict):
+    sqs.delete_message(QueueUrl=settings.SQS_QUEUE_URL, ReceiptHandle=msg["ReceiptHandle"])
+
+# -----------------------------
+# SQS leases
+# -----------------------------
+class LeaseManager:
+    """
+    Keeps the SQS messages of in-flight jobs invisible for as long as they
+    run. Builds can take far longer than the receive-time visibility
+    timeout; without heartbeats the message would reappear and another
+    worker would build the same template concurrently.
+    """
+
+    def __init__(self, visibility: int, interval: float):
+        self.visibility = visibility
+        self.interval = interval
+        self.leases = {}  # MessageId -> BuildJob
+        self._task: Optional[asyncio.Task] = None
+
+    def acquire(self, job: BuildJob):
+        self.leases[job.message["MessageId"]] = job
+
+    def drop(self, job: BuildJob):
+        self.leases.pop(job.message["MessageId"], None)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._heartbeat_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.change_visibility(list(self.leases.values()), self.visibility)
+            except Exception as e:
+                logger.error(f"Lease heartbeat failed: {e}")
+
+    async def change_visibility(self, jobs: list, timeout: int):
+        for i in range(0, len(jobs), 10):  # SQS batch limit
+            batch = jobs[i:i + 10]
+            resp = await asyncio.to_thread(
+                sqs.change_message_visibility_batch,
                 QueueUrl=settings.SQS_QUEUE_URL,
-                MaxNumberOfMessages=5,
-                WaitTimeSeconds=20,
-                VisibilityTimeout=300,
+                Entries=[
+                    {"Id": str(n), "ReceiptHandle": job.message["ReceiptHandle"], "VisibilityTimeout": timeout}
+                    for n, job in enumerate(batch)
+                ],
             )
-            msgs = resp.get("Messages", [])
+            for failure in resp.get("Failed", []):
+                job = batch[int(failure["Id"])]
+                logger.warning(f"Could not change visibility for {job.template_id}: {failure.get('Message')}")
+
+    async def release(self, jobs: list, delay: int = 0):
+        """
+        Makes messages visible again after `delay` seconds (0 = right away)
+        """
+        for job in jobs:
+            self.drop(job)
+        await self.change_visibility(jobs, delay)
+
+class BuildScheduler:
+    """
+    Receive -> build -> upload pipeline.
+
+    The receiver only pulls messages from SQS while a build slot is free and
+    the host has CPU/memory headroom, so nothing sits invisible in a local
+    backlog. Builds run up to `max_builds` at once; finished builds hand off
+    to `upload_workers` uploader tasks and free their slot straight away, so
+    S3 transfers overlap with other templates' npm runs.
+
+    Every received message is leased (see LeaseManager) until its job ends,
+    and every build holds its template's claim (see claim_template), so a
+    template is built by one worker at a time however it was queued.
+    Permanent failures are dead-lettered, transient ones are handed back to
+    SQS with a backoff until SQS_MAX_RECEIVE_COUNT deliveries.
+    """
+
+    def __init__(self, max_builds: int, upload_workers: int):
+        self.max_builds = max_builds
+        self.upload_workers = upload_workers
+        self.building = 0
+        self.jobs = set()  # every job from submit() to _finish(), with or without an SQS message
+        self.uploads: asyncio.Queue = asyncio.Queue()
+        self.tasks = set()
+        self.leases = LeaseManager(settings.SQS_VISIBILITY_TIMEOUT_SECONDS, settings.SQS_LEASE_HEARTBEAT_SECONDS)
+
+    def _has_capacity(self) -> bool:
+        if self.building >= self.max_builds:
+            return False
+        # Don't let built output pile up on disk faster than it can be uploaded
+        if self.uploads.qsize() >= self.max_builds:
+            return False
+        # Always allow one build so a busy host still makes progress
+        return self.building == 0 or has_headroom()
+
+    async def _wait_for_capacity(self):
+        while not stop_flag and not self._has_capacity():
+            await asyncio.sleep(settings.BUILD_ADMISSION_POLL_SECONDS)
+
+    def submit(self, job: BuildJob):
+        self.jobs.add(job)
+        if job.message is not None:
+            self.leases.acquire(job)
+        self.building += 1
+        task = asyncio.create_task(self._build(job))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _build(self, job: BuildJob):
+        handed_off = False
+        try:
+            try:
+                needs_upload = await build_stage(job)
+            except Exception as e:
+                await self._handle_failure(job, e)
+                needs_upload = False
+            finally:
+                self.building -= 1
+            if needs_upload and not job.released:
+                job.phase = "uploading"
+                job.metrics.mark("upload_queued")
+                self.uploads.put_nowait(job)  # unbounded; admission keeps it short
+                handed_off = True
+        finally:
+            # Whatever happened above, the lease and work_dir must not outlive the job
+            if not handed_off:
+                await self._finish(job)
+
+    async def _upload_loop(self):
+        while True:
+            job = await self.uploads.get()
+            try:
+                await upload_stage(job)
+            except Exception as e:
+                await self._handle_failure(job, e)
+            finally:
+                await self._finish(job)
+                self.uploads.task_done()
+
+    async def _handle_failure(self, job: BuildJob, e: Exception):
+        """
+        Never raises: it runs in the uploader loops and build tasks, which
+        must survive a failing Mongo or SQS call here
+        """
+        try:
+            await self._record_failure(job, e)
+        except Exception as handler_error:
+            logger.error(f"Failed to handle failure of {job.template_id}: {handler_error}")
+            if job.message is not None and job.retry_after is None:
+                # The template may still say "processing": let SQS redeliver rather than drop it
+                job.retry_after = settings.SQS_RETRY_BASE_SECONDS
+
+    async def _record_failure(self, job: BuildJob, e: Exception):
+        if job.released:
+            logger.info(f"Template {job.template_id} interrupted by shutdown; released for retry")
+            job.metrics.finish("released")
+            return
+        out_of_retries = job.receive_count >= settings.SQS_MAX_RECEIVE_COUNT
+        repeats = 1
+        if job.message is not None and job.claimed and isinstance(e, subprocess.CalledProcessError):
+            repeats = await count_repeated_failure(job.template_id, failure_signature(e))
+        if job.message is not None and not is_permanent(e, repeats) and not out_of_retries:
+            job.retry_after = min(settings.SQS_RETRY_BASE_SECONDS * 2 ** (job.receive_count - 1), 900)
+            logger.warning(
+                f"Transient failure for {job.template_id} (attempt {job.receive_count}), "
+                f"retrying in {job.retry_after}s: {e}"
+            )
+            job.metrics.finish("retry")
+            await job.stage("retrying", attempt=job.receive_count)
+            return
+        await fail_job(job, e)
+        if job.message is not None:
+            try:
+                await asyncio.to_thread(dead_letter, job.message, e)
+            except Exception as dlq_error:
+                logger.error(f"Failed to dead-letter message for {job.template_id}: {dlq_error}")
+
+    async def _finish(self, job: BuildJob):
+        self.jobs.discard(job)
+        if job.work_dir:
+            await asyncio.to_thread(safe_rmtree, job.work_dir)
+        if job.claimed and (job.released or job.retry_after is not None):
+            try:
+                await release_claim(job.template_id)
+            except Exception as e:
+                # Lapses on its own once the lease runs out
+                logger.error(f"Failed to release claim on {job.template_id}: {e}")
+        if job.message is None or job.released:
+            return
+        try:
+            if job.retry_after is not None:
+                await self.leases.release([job], delay=job.retry_after)
+            else:
+                self.leases.drop(job)
+                await asyncio.to_thread(delete_message, job.message)
+        except Exception as e:
+            logger.error(f"Failed to settle message for {job.template_id}: {e}")
+
+    async def _receive_loop(self):
+        while not stop_flag:
+            await self._wait_for_capacity()
+            if stop_flag:
+                break
+            # When idle, fill every slot; otherwise admit one at a time so each
+            # new build is re-checked against the load the previous one added
+            free = self.max_builds - self.building if self.building == 0 else 1
+            try:
+                msgs = await asyncio.to_thread(receive_messages, free)
+            except Exception as e:
+                logger.error(f"Error polling SQS: {e}")
+                await asyncio.sleep(5)
+                continue
             for m in msgs:
                 try:
-                    loop.run_until_complete(process_message(m))
-                    sqs.delete_message(
-                        QueueUrl=settings.SQS_QUEUE_URL,
-                        ReceiptHandle=m["ReceiptHandle"],
-                    )
+                    job = job_from_message(m)
                 except Exception as e:
-                    logger.error(f"Error processing message: {e}")
-        except Exception as e:
-            logger.error(f"Error polling SQS: {e}")
-            time.sleep(5)
-    logger.info("Exiting SQS poll loop. Worker stopped.")
+                    logger.error(f"Malformed message {m.get('MessageId')}: {e}")
+                    try:
+                        await asyncio.to_thread(dead_letter, m, e)
+                        await asyncio.to_thread(delete_message, m)
+                    except Exception as dlq_error:
+                        logger.error(f"Failed to dead-letter malformed message: {dlq_error}")
+                    continue
+                self.submit(job)
 
-# -----------------------------
-# Recover pending templates
-# -----------------------------
-async def process_stuck_templates():
-    async for t in template_collection.find({"status": "pending"}):
-        s3_key = t.get("zip_s3_key")
-        if not s3_key:
-            logger.warning(f"Skipping {t['_id']} — no zip_s3_key")
-            continue
-        logger.info(f"Recovering pending template {t['_id']}")
-        await process_template(str(t["_id"]), s3_key)
+    async def _shutdown(self):
+        """
+        Gives in-flight builds a grace period, then kills their commands (no
+        new ones start after that, see kill_running_commands) and hands their
+        messages straight back to SQS (visibility 0) so another
+        worker picks them up now rather than after the lease runs out.
+        Uploads already under way are short and are allowed to finish.
+        """
+        logger.info("Stopped receiving; waiting for in-flight builds and uploads...")
+        if self.tasks:
+            await asyncio.wait(list(self.tasks), timeout=settings.WORKER_SHUTDOWN_GRACE_SECONDS)
+        # Recovered jobs have no message/lease but are interrupted all the same:
+        # marking them released keeps the killed npm run from failing the template
+        # (_finish expires its claim and the next worker start recovers it)
+        unfinished = [job for job in list(self.jobs) if job.phase == "building"]
+        if unfinished:
+            logger.info(f"Releasing {len(unfinished)} in-flight builds")
+            for job in unfinished:
+                job.released = True
+            kill_running_commands()
+            # Claims first, so whoever receives the released message can take it over
+            for job in unfinished:
+                if job.claimed:
+                    try:
+                        await release_claim(job.template_id)
+                    except Exception as e:
+                        logger.error(f"Failed to release claim on {job.template_id}: {e}")
+            try:
+                await self.leases.release([job for job in unfinished if job.message is not None])
+            except Exception as e:
+                logger.error(f"Failed to release messages on shutdown: {e}")
+        await asyncio.gather(*list(self.tasks), return_exceptions=True)
+        await self.uploads.join()
+        await self.leases.stop()
+
+    async def _renew_claims_loop(self):
+        while True:
+            await asyncio.sleep(settings.SQS_LEASE_HEARTBEAT_SECONDS)
+            template_ids = [job.template_id for job in self.jobs if job.claimed and not job.released]
+            if not template_ids:
+                continue
+            try:
+                await renew_claims(template_ids)
+            except Exception as e:
+                logger.error(f"Claim heartbeat failed: {e}")
+
+    async def _recover(self):
+        """
+        Takes over templates whose claim expired: their worker died mid-build
+        or handed them back on shutdown. Each is claimed atomically, so
+        workers starting together never build the same one.
+        """
+        while not stop_flag:
+            await self._wait_for_capacity()
+            if stop_flag:
+                break
+            try:
+                job = await claim_stuck_template()
+            except Exception as e:
+                logger.error(f"Failed to recover stuck templates: {e}")
+                break
+            if job is None:
+                break
+            logger.info(f"Recovering template {job.template_id}")
+            self.submit(job)
+
+    async def run(self):
+        logger.info(f"Starting build scheduler: {self.max_builds} builds, {self.upload_workers} uploaders")
+        uploaders = [asyncio.create_task(self._upload_loop()) for _ in range(self.upload_workers)]
+        self.leases.start()
+        claims = asyncio.create_task(self._renew_claims_loop())
+        await self._recover()
+
+        await self._receive_loop()
+        await self._shutdown()
+        claims.cancel()
+        for task in uploaders:
+            task.cancel()
+        logger.info("Exiting build scheduler. Worker stopped.")
 
 # -----------------------------
 # Main
 # -----------------------------
+async def main():
+    await apply_indexes(db)
+    await pubsub.backend.prepare()
+    scheduler = BuildScheduler(MAX_BUILDS, settings.WORKER_UPLOAD_CONCURRENCY)
+    if settings.WORKER_METRICS_PORT:
+        registry.register(Gauge("s8_builds_in_progress", "Builds currently running", lambda: scheduler.building))
+        registry.register(Gauge("s8_build_slots", "Concurrent build capacity of this worker", lambda: scheduler.max_builds))
+        registry.register(Gauge("s8_build_uploads_queued", "Built templates waiting to upload", lambda: scheduler.uploads.qsize()))
+        registry.register(Gauge("s8_build_leases", "SQS messages currently leased", lambda: len(scheduler.leases.leases)))
+        start_metrics_server(settings.WORKER_METRICS_PORT)
+        logger.info(f"Serving Prometheus metrics on :{settings.WORKER_METRICS_PORT}/metrics")
+    await scheduler.run()
+
 if __name__ == "__main__":
     loop = asyncio.get_event_loop()
-    loop.run_until_complete(process_stuck_templates())
-    poll_sqs()
+    loop.run_until_complete(main())
     logger.info("Worker shutdown complete.")
     sys.exit(0)
@@ -0,0 +1,82 @@
+"""
+Event-loop latency benchmark for password hashing.
+
+Runs a burst of concurrent "logins" (bcrypt verify) while a probe sleeps
+on a fixed period, then prints the p50/p99/max wake-up lag of that probe
+(actual wake - scheduled wake) with inline hashing vs the process-pool
+variant. Any time the loop spends blocked shows up as wake-up lag, which is
+the delay every other request on the worker would see.
+
+    python bench_hashing.py [concurrent_logins] [rounds]
+"""
+import asyncio
+import statistics
+import sys
+import time
+
+from app.utils.hash_utils import (
+    hash_password,
+    verify_password,
+    verify_password_async,
+    HashPoolSaturated,
+    shutdown_hash_pool,
+)
+
+
+async def probe(stop: asyncio.Event, samples: list, interval: float = 0.005):
+    loop = asyncio.get_running_loop()
+    scheduled = loop.time() + interval
+    while not stop.is_set():
+        await asyncio.sleep(max(0.0, scheduled - loop.time()))
+        woke = loop.time()
+        samples.append((woke - scheduled) * 1000)
+        # Next tick is relative to now: one long stall counts once, not as a burst of late ticks
+        scheduled = woke + interval
+
+
+async def login_inline(hashed: str):
+    return verify_password("correct horse", hashed)
+
+
+async def login_pooled(hashed: str):
+    try:
+        return await verify_password_async("correct horse", hashed)
+    except HashPoolSaturated:
+        return None
+
+
+async def run(label: str, login, hashed: str, concurrent: int, rounds: int):
+    samples = []
+    stop = asyncio.Event()
+    probe_task = asyncio.create_task(probe(stop, samples))
+    started = time.perf_counter()
+    for _ in range(rounds):
+        await asyncio.gather(*(login(hashed) for _ in range(concurrent)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await probe_task
+
+    samples.sort()
+    p50 = statistics.median(samples)
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    print(
+        f"{label:<8} logins={concurrent * rounds:<5} wall={elapsed:6.2f}s "
+        f"probe_n={len(samples):<5} lag p50={p50:8.2f}ms p99={p99:8.2f}ms max={samples[-1]:8.2f}ms"
+    )
+
+
+async def main(concurrent: int, rounds: int):
+    hashed = hash_password("correct horse")
+    # Warm the pool so process start-up isn't billed to the first round
+    await verify_password_async("correct horse", hashed)
+    await run("inline", login_inline, hashed, concurrent, rounds)
+    await run("pooled", login_pooled, hashed, concurrent, rounds)
+
+
+if __name__ == "__main__":
+    concurrent = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    try:
+        asyncio.run(main(concurrent, rounds))
+    finally:
+        shutdown_hash_pool()
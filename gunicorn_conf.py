@@ -0,0 +1,5 @@
+# gunicorn_conf.py
+# Usage: gunicorn -c gunicorn_conf.py app.main:app
+
+# Uvicorn worker with websocket heartbeat and permessage-deflate enabled
+worker_class = "app.uvicorn_worker.S8UvicornWorker"
@@ -0,0 +1,10 @@
+# tests/conftest.py
+import os
+import sys
+
+# app.database needs a URL with a default database at import time; nothing connects to it
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017/s8test")
+os.environ.setdefault("AWS_REGION", "us-east-1")
+os.environ.setdefault("BUCKET_NAME", "s8-test-bucket")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
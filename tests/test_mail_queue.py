@@ -0,0 +1,220 @@
+# tests/test_mail_queue.py
+"""
+MailQueue against a local aiosmtpd server. SMTP host/port come from
+settings, as in production; mail_deliveries is replaced by an in-memory
+stand-in.
+"""
+import asyncio
+import socket
+import time
+
+import pytest
+
+pytest.importorskip("motor")
+aiosmtpd_controller = pytest.importorskip("aiosmtpd.controller")
+
+from app.core.config import settings
+from app.utils import mail_queue as mq
+
+
+class FakeDeliveries:
+    """
+    Just enough of a Motor collection for MailQueue: UpdateOne upserts
+    """
+
+    def __init__(self):
+        self.docs = {}
+
+    async def bulk_write(self, ops, ordered=True):
+        for op in ops:
+            update = op._doc
+            doc = self.docs.get(op._filter["_id"])
+            if doc is None:
+                doc = {"_id": op._filter["_id"], **update.get("$setOnInsert", {})}
+                self.docs[doc["_id"]] = doc
+            doc.update(update.get("$set", {}))
+            for key in update.get("$unset", {}):
+                doc.pop(key, None)
+
+
+class Handler:
+    def __init__(self):
+        self.messages = []
+        self.fail_next = 0     # reply 451 to this many DATA commands
+        self.always_fail = False
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.always_fail or self.fail_next > 0:
+            self.fail_next = max(0, self.fail_next - 1)
+            return "451 Try again later"
+        self.messages.append(envelope.content)
+        return "250 OK"
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def smtp(monkeypatch):
+    handler = Handler()
+    port = _free_port()
+    controller = aiosmtpd_controller.Controller(handler, hostname="127.0.0.1", port=port)
+    controller.start()
+    monkeypatch.setattr(settings, "SMTP_SERVER", "127.0.0.1")
+    monkeypatch.setattr(settings, "SMTP_PORT", port)
+    monkeypatch.setattr(settings, "SMTP_USE_SSL", False)
+    monkeypatch.setattr(settings, "SMTP_USER", "noreply@example.com")
+    monkeypatch.setattr(settings, "SMTP_PASSWORD", None)
+    monkeypatch.setattr(settings, "SMTP_TIMEOUT_SECONDS", 5)
+    yield handler, controller
+    controller.stop()
+
+
+@pytest.fixture
+def deliveries(monkeypatch):
+    fake = FakeDeliveries()
+    monkeypatch.setattr(mq, "mail_delivery_collection", fake)
+    return fake
+
+
+@pytest.fixture
+def connections(monkeypatch):
+    opened = []
+    real = mq.open_smtp_connection
+
+    def counting(*args, **kwargs):
+        opened.append(time.monotonic())
+        return real(*args, **kwargs)
+
+    monkeypatch.setattr(mq, "open_smtp_connection", counting)
+    return opened
+
+
+async def _until(predicate, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        await asyncio.sleep(0.02)
+
+
+def test_batch_is_sent_over_one_connection(smtp, deliveries, connections, monkeypatch):
+    handler, _ = smtp
+    monkeypatch.setattr(settings, "MAIL_BATCH_SIZE", 20)
+
+    async def scenario():
+        queue = mq.MailQueue()
+        ids = [queue.enqueue(f"user{i}@example.com", "Hi", f"body {i}") for i in range(5)]
+        queue.start()
+        await _until(lambda: queue.sent == 5)
+        await queue.stop()
+        return ids
+
+    ids = asyncio.run(scenario())
+    assert len(handler.messages) == 5
+    assert len(connections) == 1
+    assert all(deliveries.docs[mq.ObjectId(i)]["status"] == "sent" for i in ids)
+    assert all("body" not in doc for doc in deliveries.docs.values())
+
+
+def test_reconnects_after_server_drops_session(smtp, deliveries, connections):
+    handler, controller = smtp
+
+    async def scenario():
+        queue = mq.MailQueue()
+        queue.start()
+        queue.enqueue("a@example.com", "first", "one")
+        await _until(lambda: queue.sent == 1)
+        # Server restart closes the idle session under the client
+        await asyncio.to_thread(controller.stop)
+        await asyncio.to_thread(controller.start)
+        queue.enqueue("b@example.com", "second", "two")
+        await _until(lambda: queue.sent == 2)
+        await queue.stop()
+        return queue
+
+    queue = asyncio.run(scenario())
+    assert queue.failed == 0 and queue.retried == 0
+    assert len(handler.messages) == 2
+    assert len(connections) == 2
+
+
+def test_transient_failure_is_retried_with_backoff(smtp, deliveries, monkeypatch):
+    handler, _ = smtp
+    handler.fail_next = 2
+    monkeypatch.setattr(settings, "MAIL_RETRY_BASE_SECONDS", 0.1)
+    monkeypatch.setattr(settings, "MAIL_MAX_ATTEMPTS", 5)
+
+    async def scenario():
+        queue = mq.MailQueue()
+        queue.start()
+        started = time.monotonic()
+        delivery_id = queue.enqueue("a@example.com", "Hi", "body")
+        await _until(lambda: queue.sent == 1)
+        elapsed = time.monotonic() - started
+        await queue.stop()
+        return queue, delivery_id, elapsed
+
+    queue, delivery_id, elapsed = asyncio.run(scenario())
+    doc = deliveries.docs[mq.ObjectId(delivery_id)]
+    assert doc["status"] == "sent" and doc["attempts"] == 3
+    assert queue.retried == 2
+    assert elapsed >= 0.1 + 0.2  # base, then doubled
+
+
+def test_gives_up_after_max_attempts(smtp, deliveries, monkeypatch):
+    handler, _ = smtp
+    handler.always_fail = True
+    monkeypatch.setattr(settings, "MAIL_RETRY_BASE_SECONDS", 0.01)
+    monkeypatch.setattr(settings, "MAIL_MAX_ATTEMPTS", 3)
+
+    async def scenario():
+        queue = mq.MailQueue()
+        queue.start()
+        delivery_id = queue.enqueue("a@example.com", "Hi", "body")
+        await _until(lambda: queue.failed == 1)
+        await queue.stop()
+        return delivery_id
+
+    doc = deliveries.docs[mq.ObjectId(asyncio.run(scenario()))]
+    assert doc["status"] == "failed" and doc["attempts"] == 3
+    assert "body" not in doc
+
+
+def test_stop_parks_scheduled_retries(smtp, deliveries, monkeypatch):
+    handler, _ = smtp
+    handler.always_fail = True
+    monkeypatch.setattr(settings, "MAIL_RETRY_BASE_SECONDS", 60)
+
+    async def scenario():
+        queue = mq.MailQueue()
+        queue.start()
+        delivery_id = queue.enqueue("a@example.com", "Hi", "keep me")
+        await _until(lambda: queue.retried == 1)
+        await queue.stop()
+        return delivery_id
+
+    doc = deliveries.docs[mq.ObjectId(asyncio.run(scenario()))]
+    assert doc["status"] == "queued"
+    assert doc["body"] == "keep me"
+
+
+def test_failure_during_drain_is_parked(smtp, deliveries, monkeypatch):
+    handler, _ = smtp
+    handler.always_fail = True
+    monkeypatch.setattr(settings, "MAIL_RETRY_BASE_SECONDS", 60)
+
+    async def scenario():
+        queue = mq.MailQueue()
+        queue.start()
+        delivery_id = queue.enqueue("a@example.com", "Hi", "keep me")
+        await queue.stop()  # the only attempt happens while draining
+        return queue, delivery_id
+
+    queue, delivery_id = asyncio.run(scenario())
+    doc = deliveries.docs[mq.ObjectId(delivery_id)]
+    assert doc["status"] == "queued" and doc["body"] == "keep me"
+    assert queue.stats()["retry_scheduled"] == 0
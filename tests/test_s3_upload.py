@@ -0,0 +1,201 @@
+# tests/test_s3_upload.py
+"""
+s3_upload against moto's in-memory S3. The client is wrapped so tests can
+see (and fail) individual S3 calls.
+"""
+import asyncio
+import hashlib
+import io
+import os
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("fastapi")
+boto3 = pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+
+from app.utils.s3_upload import MIN_PART_SIZE, stream_upload_to_s3, upload_all_to_s3
+
+mock_aws = getattr(moto, "mock_aws", None) or moto.mock_s3  # moto >= 5 / < 5
+BUCKET = "s8-test-bucket"
+
+
+class FakeUpload:
+    """
+    The slice of UploadFile that stream_upload_to_s3 reads from
+    """
+
+    def __init__(self, data: bytes, content_type: str = "application/zip"):
+        self._buf = io.BytesIO(data)
+        self.content_type = content_type
+
+    async def read(self, n: int = -1) -> bytes:
+        return self._buf.read(n)
+
+
+class RecordingClient:
+    """
+    Proxies a boto3 client, recording each call by name. `hooks[name]` runs
+    with the call's kwargs before it is forwarded and may raise.
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self.calls = []
+        self.hooks = {}
+
+    def __getattr__(self, name):
+        fn = getattr(self._client, name)
+
+        def call(*args, **kwargs):
+            self.calls.append(name)
+            hook = self.hooks.get(name)
+            if hook is not None:
+                hook(**kwargs)
+            return fn(*args, **kwargs)
+
+        return call
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        yield RecordingClient(client)
+
+
+def _body(s3, key: str) -> bytes:
+    return s3._client.get_object(Bucket=BUCKET, Key=key)["Body"].read()
+
+
+def _keys(s3) -> list:
+    return [o["Key"] for o in s3._client.list_objects_v2(Bucket=BUCKET).get("Contents", [])]
+
+
+def _open_multipart(s3) -> list:
+    return s3._client.list_multipart_uploads(Bucket=BUCKET).get("Uploads", [])
+
+
+def test_small_file_uses_put_object(s3):
+    data = os.urandom(1024)
+    result = asyncio.run(stream_upload_to_s3(FakeUpload(data), "small.zip", s3, bucket=BUCKET))
+
+    assert s3.calls == ["put_object"]
+    assert result.size == len(data)
+    assert result.sha256 == hashlib.sha256(data).hexdigest()
+    assert _body(s3, "small.zip") == data
+
+
+def test_file_at_part_size_goes_multipart(s3):
+    data = os.urandom(2 * MIN_PART_SIZE + 123)
+    result = asyncio.run(
+        stream_upload_to_s3(FakeUpload(data), "big.zip", s3, bucket=BUCKET, part_size=MIN_PART_SIZE)
+    )
+
+    assert "put_object" not in s3.calls
+    assert s3.calls.count("upload_part") == 3
+    assert s3.calls[-1] == "complete_multipart_upload"
+    assert result.size == len(data)
+    assert result.sha256 == hashlib.sha256(data).hexdigest()
+    assert _body(s3, "big.zip") == data
+
+
+def test_inflight_parts_are_bounded(s3):
+    lock = threading.Lock()
+    state = {"now": 0, "peak": 0}
+
+    def slow_part(**kwargs):
+        with lock:
+            state["now"] += 1
+            state["peak"] = max(state["peak"], state["now"])
+        time.sleep(0.1)
+        with lock:
+            state["now"] -= 1
+
+    s3.hooks["upload_part"] = slow_part
+    data = os.urandom(5 * MIN_PART_SIZE)
+    asyncio.run(
+        stream_upload_to_s3(FakeUpload(data), "bounded.zip", s3, bucket=BUCKET, part_size=MIN_PART_SIZE, max_inflight=2)
+    )
+
+    assert s3.calls.count("upload_part") == 5
+    assert state["peak"] == 2
+    assert _body(s3, "bounded.zip") == data
+
+
+def test_failed_part_aborts_multipart_upload(s3):
+    def fail_second(**kwargs):
+        if kwargs["PartNumber"] == 2:
+            raise RuntimeError("part 2 failed")
+
+    s3.hooks["upload_part"] = fail_second
+    data = os.urandom(3 * MIN_PART_SIZE)
+    with pytest.raises(RuntimeError, match="part 2 failed"):
+        asyncio.run(
+            stream_upload_to_s3(FakeUpload(data), "broken.zip", s3, bucket=BUCKET, part_size=MIN_PART_SIZE)
+        )
+
+    assert "abort_multipart_upload" in s3.calls
+    assert "complete_multipart_upload" not in s3.calls
+    assert _open_multipart(s3) == []
+    assert _keys(s3) == []
+
+
+def test_cancelled_upload_still_aborts(s3):
+    part_started = threading.Event()
+
+    def slow_part(**kwargs):
+        part_started.set()
+        time.sleep(0.2)
+
+    s3.hooks["upload_part"] = slow_part
+    data = os.urandom(3 * MIN_PART_SIZE)
+
+    async def scenario():
+        task = asyncio.create_task(
+            stream_upload_to_s3(FakeUpload(data), "cancelled.zip", s3, bucket=BUCKET, part_size=MIN_PART_SIZE, max_inflight=1)
+        )
+        await asyncio.to_thread(part_started.wait, 5)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # The shielded abort outlives the cancellation; give it time to finish
+        deadline = time.monotonic() + 5
+        while "abort_multipart_upload" not in s3.calls and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+
+    asyncio.run(scenario())
+    assert "abort_multipart_upload" in s3.calls
+    assert _open_multipart(s3) == []
+
+
+def test_upload_all_deletes_written_keys_on_failure(s3):
+    def fail_bad(**kwargs):
+        if kwargs["Key"] == "bad.png":
+            time.sleep(0.1)  # let the other upload land first
+            raise RuntimeError("rejected")
+
+    s3.hooks["put_object"] = fail_bad
+    uploads = [
+        (FakeUpload(b"good", "image/png"), "good.png"),
+        (FakeUpload(b"bad", "image/png"), "bad.png"),
+    ]
+    with pytest.raises(RuntimeError, match="rejected"):
+        asyncio.run(upload_all_to_s3(uploads, s3, limit=2, bucket=BUCKET))
+
+    assert "delete_objects" in s3.calls
+    assert _keys(s3) == []
+
+
+def test_upload_all_returns_results_in_input_order(s3):
+    uploads = [(FakeUpload(f"file {i}".encode(), "image/png"), f"img/{i}.png") for i in range(5)]
+    results = asyncio.run(upload_all_to_s3(uploads, s3, limit=2, bucket=BUCKET))
+
+    assert [r.key for r in results] == [key for _, key in uploads]
+    assert "delete_objects" not in s3.calls
+    assert sorted(_keys(s3)) == sorted(key for _, key in uploads)